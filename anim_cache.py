@@ -0,0 +1,114 @@
+import hashlib
+import os
+import struct
+
+# On-disk cache of compiled <anim> nodes for anim_compiler.
+#
+# Every entry is keyed by a digest of the content of one <anim> node and holds the bytes LocalExport wrote
+# for it plus the strings it hashed, in the order they were first seen so the merged hash table comes out
+# the same as without the cache. Entry file format (little endian):
+#   chunk length (int), chunk
+#   num hashed strings (int)
+#     hash (int)
+#     original string (int, string)
+#
+# The cache is trimmed to max_size bytes by removing the least recently used entries, the modification
+# time of an entry file is bumped every time it is used.
+
+CACHEVERSION = 1
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+class AnimCache(object):
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def Digest(self, endianstring, anim_node):
+        # Tags, attribute names and values of the node and all its children, attribute counts keep the
+        # boundaries between nodes unambiguous
+        parts = [str(CACHEVERSION), endianstring]
+        for node in anim_node.iter():
+            attrib = node.attrib
+            parts.append(node.tag)
+            parts.append(str(len(attrib)))
+            parts.extend(attrib)
+            parts.extend(attrib.values())
+        data = "\0".join(parts)
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        return hashlib.sha1(data).hexdigest()
+
+    def EntryPath(self, key):
+        return os.path.join(self.path, key + ".anim")
+
+    def Get(self, key):
+        # Returns (chunk, [(hash, string), ...]) or None when the anim is not cached
+        path = self.EntryPath(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+
+        chunk_len = struct.unpack_from('<I', data, 0)[0]
+        offset = 4
+        chunk = data[offset:offset + chunk_len]
+        offset += chunk_len
+        hash_list = struct.unpack_from('<I', data, offset)[0]
+        offset += 4
+        pairs = []
+        for _ in range(hash_list):
+            hash_idx, name_len = struct.unpack_from('<Ii', data, offset)
+            offset += 8
+            pairs.append((hash_idx, data[offset:offset + name_len]))
+            offset += name_len
+        self.hits += 1
+        return chunk, pairs
+
+    def Put(self, key, chunk, pairs):
+        path = self.EntryPath(key)
+        if os.path.exists(path):
+            return
+        data = [struct.pack('<I', len(chunk)), chunk, struct.pack('<I', len(pairs))]
+        for hash_idx, name in pairs:
+            data.append(struct.pack('<Ii', hash_idx, len(name)))
+            data.append(name)
+
+        # Written under a temporary name first so a concurrent compile never reads half an entry
+        tmppath = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmppath, "wb") as f:
+            f.write(b"".join(data))
+        try:
+            os.rename(tmppath, path)
+        except OSError:
+            os.remove(tmppath)
+
+    def Trim(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith(".anim"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size
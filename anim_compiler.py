@@ -1,11 +1,27 @@
+import argparse
+import multiprocessing
 import os
 import re
 import struct
 import sys
+import time
 import traceback
-import xml.dom.minidom
+from collections import OrderedDict
 from io import BytesIO
 
+import anim_cache
+import anim_jsonl
+import anim_model
+import anim_stats
+import anim_zip
+from anim_errors import FormatError
+from anim_hash import StrHashes, strhash
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
 ANIMVERSION = 4
 
 #ANIM format 4
@@ -43,26 +59,15 @@ FACING_DOWNRIGHT = 1 << 6
 FACING_DOWNLEFT = 1 << 7
 
 
-def strhash(str, hashcollection):
-    hash = 0
-    for c in str:
-        v = ord(c.lower())
-        hash = (v + (hash << 6) + (hash << 16) - hash) & 0xFFFFFFFF
-    hashcollection[hash] = str
-    return hash
-
-
 def get_z_index(element):
-    return int(element.attributes["z_index"].value)
+    return int(element.attrib["z_index"])
 
 
 EXPORT_DEPTH = 10
-hashcollection = {}
-
 
-def LocalExport(anim_node, outfile):
-    name = anim_node.attributes["name"].value.encode('ascii')
 
+def ParseFacing(name):
+    # Splits the facing suffix off an anim name as it appears in anim.xml, returns the name and facingbyte
     dirs = (re.search("(.*)_up\Z", name), re.search("(.*)_down\Z", name), re.search("(.*)_side\Z", name),
             re.search("(.*)_left\Z", name), re.search("(.*)_right\Z", name), re.search("(.*)_upside\Z", name),
             re.search("(.*)_downside\Z", name), re.search("(.*)_upleft\Z", name), re.search("(.*)_upright\Z", name),
@@ -111,90 +116,428 @@ def LocalExport(anim_node, outfile):
     elif dirs[12]:
         name = dirs[12].group(1)
         facingbyte = FACING_UP | FACING_DOWN | FACING_LEFT | FACING_RIGHT
+    return name, facingbyte
 
-    root = anim_node.attributes["root"].value.encode('ascii')
-    num_frames = len(anim_node.getElementsByTagName("frame"))
-    frame_rate = float(anim_node.attributes["framerate"].value)
 
-    outfile.write(struct.pack(endianstring + 'i' + str(len(name)) + 's', len(name), name))
-    outfile.write(struct.pack(endianstring + 'B', facingbyte))
-    outfile.write(struct.pack(endianstring + 'I', strhash(root, hashcollection)))
-    outfile.write(struct.pack(endianstring + 'fI', float(frame_rate), num_frames))
-    for frame_node in anim_node.getElementsByTagName("frame"):
-        outfile.write(
-            struct.pack(endianstring + 'ffff', float(frame_node.attributes["x"].value),
-                        float(frame_node.attributes["y"].value), float(frame_node.attributes["w"].value),
-                        float(frame_node.attributes["h"].value)))
-        num_events = len(frame_node.getElementsByTagName("event"))
-        outfile.write(struct.pack(endianstring + 'I', num_events))
-
-        for event_node in frame_node.getElementsByTagName("event"):
-            outfile.write(
-                struct.pack(endianstring + 'I',
-                            strhash(event_node.attributes["name"].value.encode('ascii'), hashcollection)))
-
-        elements = frame_node.getElementsByTagName("element")
+def AnimFromXml(anim_node, hashcollection):
+    # Builds the anim_model.Anim of an <anim> node, the strings it hashes are added to hashcollection
+    name, facingbyte = ParseFacing(anim_node.attrib["name"].encode('ascii'))
+
+    root = strhash(anim_node.attrib["root"].encode('ascii'), hashcollection)
+    frame_nodes = list(anim_node.iter("frame"))
+    frame_rate = float(anim_node.attrib["framerate"])
+
+    frames = []
+    elements = dict((field, []) for field in anim_model.ELEMENT_FIELDS)
+    for frame_node in frame_nodes:
+        events = [strhash(event_node.attrib["name"].encode('ascii'), hashcollection)
+                  for event_node in frame_node.iter("event")]
+
+        element_nodes = list(frame_node.iter("element"))
         try:
-            elements = sorted(elements, key=get_z_index)
+            element_nodes = sorted(element_nodes, key=get_z_index)
         except:
             pass
 
-        num_elements = len(elements)
-        outfile.write(struct.pack(endianstring + 'I', num_elements))
+        num_elements = len(element_nodes)
+        frames.append(
+            anim_model.AnimFrame(float(frame_node.attrib["x"]), float(frame_node.attrib["y"]),
+                                 float(frame_node.attrib["w"]), float(frame_node.attrib["h"]), events, num_elements))
 
+        # The name and layername of every element are hashed in one call, in the order they come in
+        strings = []
         eidx = 0
-        for element_node in elements:
-            outfile.write(
-                struct.pack(endianstring + 'I',
-                            strhash(element_node.attributes["name"].value.encode('ascii'), hashcollection)))
-            outfile.write(struct.pack(endianstring + 'I', int(element_node.attributes["frame"].value)))
-            layername = element_node.attributes["layername"].value.encode('ascii').split('/')[-1]
-            outfile.write(struct.pack(endianstring + 'I', strhash(layername, hashcollection)))
-
-            z = (eidx / float(num_elements)) * float(EXPORT_DEPTH) - EXPORT_DEPTH * .5
-            outfile.write(
-                struct.pack(endianstring + 'fffffff', float(element_node.attributes["m_a"].value),
-                            float(element_node.attributes["m_b"].value), float(element_node.attributes["m_c"].value),
-                            float(element_node.attributes["m_d"].value), float(element_node.attributes["m_tx"].value),
-                            float(element_node.attributes["m_ty"].value), z))
-
+        for element_node in element_nodes:
+            attrib = element_node.attrib
+            strings.append(attrib["name"].encode('ascii'))
+            elements["frame"].append(int(attrib["frame"]))
+            strings.append(attrib["layername"].encode('ascii').split('/')[-1])
+            for field in ("m_a", "m_b", "m_c", "m_d", "m_tx", "m_ty"):
+                elements[field].append(float(attrib[field]))
+            elements["z"].append((eidx / float(num_elements)) * float(EXPORT_DEPTH) - EXPORT_DEPTH * .5)
             eidx += 1
-
-
-def CompileAnim(endianstring, xmlstr, outfilename):
-    doc = xml.dom.minidom.parseString(xmlstr)
-    outfile = BytesIO()
-
+        hashes = StrHashes(strings, hashcollection)
+        elements["name"].extend(hashes[0::2])
+        elements["layername"].extend(hashes[1::2])
+
+    columns = dict((field, anim_model.Column(typecode, elements[field]))
+                   for field, typecode in zip(anim_model.ELEMENT_FIELDS, anim_model.ELEMENT_FORMAT))
+    return anim_model.Anim(name, facingbyte, root, frame_rate, frames, columns)
+
+
+def LocalExport(endianstring, anim_node, outfile, hashcollection):
+    anim_model.WriteAnim(endianstring, AnimFromXml(anim_node, hashcollection), outfile)
+
+
+def CachedExport(endianstring, anim_node, outfile, hashcollection, cache):
+    # Same as LocalExport, but an anim whose content is found in the cache is copied from there instead of
+    # being packed again. The strings of the anim are merged in the order they were first seen, which
+    # keeps the hash table identical to the one LocalExport would have built.
+    key = cache.Digest(endianstring, anim_node)
+    entry = cache.Get(key)
+    if entry is None:
+        chunk = BytesIO()
+        anim_hashcollection = OrderedDict()
+        LocalExport(endianstring, anim_node, chunk, anim_hashcollection)
+        entry = (chunk.getvalue(), list(anim_hashcollection.items()))
+        cache.Put(key, *entry)
+
+    chunk, pairs = entry
+    outfile.write(chunk)
+    for hash_idx, name in pairs:
+        hashcollection[hash_idx] = name
+
+
+def AnimShards(xml, num):
+    # Splits the content of anim.xml into about num shards of whole <anim> nodes of similar size, returns
+    # the text before the first <anim>, the text from the closing tag of the root on and the (start, end)
+    # of every shard. None when the file can not be split safely by looking at its text alone.
+    if b"<!--" in xml or b"<![CDATA[" in xml:
+        return None
+    starts = [match.start() for match in re.finditer(br"<anim[\s/>]", xml)]
+    tail_pos = xml.rfind(b"</")
+    if len(starts) < 2 or tail_pos < starts[-1] or xml.startswith(b"</anim>", tail_pos):
+        return None
+
+    shard_size = (tail_pos - starts[0]) / float(num)
+    shards = []
+    first = starts[0]
+    for start in starts[1:]:
+        if start - first >= shard_size:
+            shards.append((first, start))
+            first = start
+    shards.append((first, tail_pos))
+    return xml[:starts[0]], xml[tail_pos:], shards
+
+
+def CompileAnimShard(args):
+    # Runs in a worker process, packs the anims of a shard. Returns the packed anims, the strings they hash
+    # in the order they were first seen and the node counts.
+    endianstring, xml = args
+    chunk = BytesIO()
+    hashcollection = OrderedDict()
+    counts = {"element": 0, "frame": 0, "event": 0, "anim": 0}
+    for _, node in ElementTree.iterparse(BytesIO(xml)):
+        if node.tag in counts:
+            counts[node.tag] += 1
+        if node.tag == "anim":
+            LocalExport(endianstring, node, chunk, hashcollection)
+            node.clear()
+    return chunk.getvalue(), list(hashcollection.items()), counts
+
+
+def ParallelExport(endianstring, xml, outfile, hashcollection, counts, jobs, stats=None):
+    # Packs the anims of the content of anim.xml in jobs worker processes. The shards are written in their
+    # order and their strings merged in the order they were first seen, so the result is the same as packing
+    # them one after another. Returns False, having written nothing, when xml can not be split.
+    split = AnimShards(xml, jobs * 4)
+    if split is None:
+        return False
+    head, tail, shards = split
+
+    pool = multiprocessing.Pool(min(jobs, len(shards)))
+    try:
+        tasks = ((endianstring, head + xml[start:end] + tail) for start, end in shards)
+        for chunk, pairs, shard_counts in pool.imap(CompileAnimShard, tasks):
+            outfile.write(chunk)
+            for hash_idx, name in pairs:
+                hashcollection[hash_idx] = name
+            for tag, num in shard_counts.items():
+                counts[tag] += num
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    if stats is not None:
+        stats.Count("shards", len(shards))
+    return True
+
+
+def CompileAnimStream(endianstring, xmlfile, outfile, cache=None, stats=None, jobs=1):
+    # <anim> nodes are read one at a time and written out as soon as they are closed, so memory is bounded
+    # by the largest single anim. The header totals are not known until the end and get patched afterwards,
+    # so outfile has to be seekable.
+    # With an anim_cache.AnimCache only the anims that changed since they were cached get packed.
+    # With jobs > 1 and no cache anim.xml is read whole and its anims are packed in that many processes.
+    stats = anim_stats.Start("compile_anim", stats)
+    hashcollection = {}
+
+    start_pos = outfile.tell()
     outfile.write(struct.pack(endianstring + 'cccci', 'A', 'N', 'I', 'M', ANIMVERSION))
-    outfile.write(struct.pack(endianstring + 'I', len(doc.getElementsByTagName("element"))))
-    outfile.write(struct.pack(endianstring + 'I', len(doc.getElementsByTagName("frame"))))
-    outfile.write(struct.pack(endianstring + 'I', len(doc.getElementsByTagName("event"))))
-    outfile.write(struct.pack(endianstring + 'I', len(doc.getElementsByTagName("anim"))))
-
-    nodes = doc.getElementsByTagName("anim")
-    for anim_node in nodes:
-        LocalExport(anim_node, outfile)
+    header_pos = outfile.tell()
+    outfile.write(struct.pack(endianstring + 'IIII', 0, 0, 0, 0))
+
+    # Parsing and packing are interleaved, the time between two anims is the parse time of the second one
+    clock = time.time
+    last = clock()
+    counts = {"element": 0, "frame": 0, "event": 0, "anim": 0}
+    nodes = ()
+    if jobs > 1 and cache is None:
+        xml = xmlfile.read()
+        if not ParallelExport(endianstring, xml, outfile, hashcollection, counts, jobs, stats):
+            nodes = ElementTree.iterparse(BytesIO(xml))
+        elif stats is not None:
+            now = clock()
+            stats.AddTime("pack", now - last)
+            last = now
+    else:
+        nodes = ElementTree.iterparse(xmlfile)
+    for _, node in nodes:
+        if node.tag in counts:
+            counts[node.tag] += 1
+        if node.tag == "anim":
+            if stats is not None:
+                now = clock()
+                stats.AddTime("parse", now - last)
+            if cache is None:
+                LocalExport(endianstring, node, outfile, hashcollection)
+            else:
+                CachedExport(endianstring, node, outfile, hashcollection, cache)
+            node.clear()
+            if stats is not None:
+                last = clock()
+                stats.AddTime("pack", last - now)
+    if stats is not None:
+        stats.AddTime("parse", clock() - last)
 
     #write out a lookup table of the pre-hashed strings
+    hash_start = clock()
     outfile.write(struct.pack(endianstring + 'I', len(hashcollection)))
     for hash_idx, name in hashcollection.iteritems():
         outfile.write(struct.pack(endianstring + 'I', hash_idx))
         outfile.write(struct.pack(endianstring + 'i' + str(len(name)) + 's', len(name), name))
 
-    with open(outfilename, "wb") as f:
-        f.write(outfile.getvalue())
+    end_pos = outfile.tell()
+    outfile.seek(header_pos)
+    outfile.write(
+        struct.pack(endianstring + 'IIII', counts["element"], counts["frame"], counts["event"], counts["anim"]))
+    outfile.seek(end_pos)
+
+    if cache is not None:
+        cache.Trim()
+
+    if stats is not None:
+        stats.AddTime("hash_table", clock() - hash_start)
+        for name in ("anim", "frame", "element", "event"):
+            stats.Count(name + "s", counts[name])
+        stats.Count("hash_strings", len(hashcollection))
+        if cache is not None:
+            stats.Count("cache_hits", cache.hits)
+            stats.Count("cache_misses", cache.misses)
+        try:
+            stats.AddBytes(bytes_in=xmlfile.tell())
+        except (AttributeError, IOError, ValueError):
+            pass
+        stats.AddBytes(bytes_out=end_pos - start_pos)
+        anim_stats.Finish(stats)
+
+
+def CompileAnimData(endianstring, xml, cache=None, stats=None, jobs=1):
+    # Returns the content of anim.bin, xml is either the content of anim.xml or a file object to read it from
+    if not hasattr(xml, "read"):
+        xml = BytesIO(xml)
+    outfile = BytesIO()
+    CompileAnimStream(endianstring, xml, outfile, cache, stats, jobs)
+    return outfile.getvalue()
+
+
+def CompileAnim(endianstring, xml, outfilename, cache=None, stats=None, jobs=1):
+    # xml is either the content of anim.xml or a file object to read it from
+    with anim_stats.Run("compile_anim", stats) as stats:
+        if not hasattr(xml, "read"):
+            xml = BytesIO(xml)
+
+        tmpfilename = outfilename + ".tmp"
+        try:
+            with open(tmpfilename, "w+b") as outfile:
+                CompileAnimStream(endianstring, xml, outfile, cache, stats, jobs)
+        except:
+            if os.path.exists(tmpfilename):
+                os.remove(tmpfilename)
+            raise
+
+        if os.path.exists(outfilename):
+            os.remove(outfilename)
+        os.rename(tmpfilename, outfilename)
+
+
+def JsonlHash(value, hashcollection):
+    # A string is hashed, a hash (written for strings missing from the hash table) is used as it is
+    value = anim_jsonl.Ascii(value)
+    if isinstance(value, (int, long)):
+        return value
+    return strhash(value, hashcollection)
+
+
+def AnimFromJsonl(record, floats, hashcollection):
+    # Builds the anim_model.Anim of an anim.jsonl line, the strings are hashed in the same order as
+    # AnimFromXml hashes them so the hash table comes out the same
+    name, facingbyte = ParseFacing(anim_jsonl.Ascii(record["name"]))
+    root = JsonlHash(record["root"], hashcollection)
+
+    frame_records = record["frames"]
+    offset = record["offset"]
+    bboxes = floats[offset:offset + 4 * len(frame_records)]
+    offset += 4 * len(frame_records)
+
+    frames = []
+    elements = dict((field, []) for field in ("name", "frame", "layername", "z"))
+    for frame_idx, frame_record in enumerate(frame_records):
+        events = [JsonlHash(event, hashcollection) for event in frame_record["events"]]
+        element_records = frame_record["elements"]
+        num_elements = len(element_records)
+        x, y, w, h = bboxes[4 * frame_idx:4 * frame_idx + 4]
+        frames.append(anim_model.AnimFrame(x, y, w, h, events, num_elements))
+
+        for eidx, (symbol, frameint, layername) in enumerate(element_records):
+            elements["name"].append(JsonlHash(symbol, hashcollection))
+            elements["frame"].append(frameint)
+            if not isinstance(layername, (int, long)):
+                layername = layername.split('/')[-1]
+            elements["layername"].append(JsonlHash(layername, hashcollection))
+            elements["z"].append((eidx / float(num_elements)) * float(EXPORT_DEPTH) - EXPORT_DEPTH * .5)
+
+    num_elements = len(elements["name"])
+    matrices = floats[offset:offset + 6 * num_elements]
+    if len(bboxes) != 4 * len(frame_records) or len(matrices) != 6 * num_elements:
+        raise FormatError("The float32 sidecar ends inside anim " + record["name"])
+    for i, field in enumerate(("m_a", "m_b", "m_c", "m_d", "m_tx", "m_ty")):
+        elements[field] = matrices[i::6]
+
+    columns = dict((field, anim_model.Column(typecode, elements[field]))
+                   for field, typecode in zip(anim_model.ELEMENT_FIELDS, anim_model.ELEMENT_FORMAT))
+    return anim_model.Anim(name, facingbyte, root, float(record["framerate"]), frames, columns)
+
+
+def CompileAnimJsonlStream(endianstring, jsonlfile, sidecar, outfile, stats=None):
+    # Same as CompileAnimStream for anim.jsonl, sidecar is the content of its float32 sidecar
+    stats = anim_stats.Start("compile_anim", stats)
+    hashcollection = {}
+    start_pos = outfile.tell()
+
+    with anim_stats.Phase(stats, "parse"):
+        floats = anim_jsonl.ReadSidecar(sidecar)
+        lines = iter(jsonlfile)
+        anim_jsonl.ReadHeader(next(lines, ""), "anim")
+
+    outfile.write(struct.pack(endianstring + 'cccci', 'A', 'N', 'I', 'M', ANIMVERSION))
+    header_pos = outfile.tell()
+    outfile.write(struct.pack(endianstring + 'IIII', 0, 0, 0, 0))
+
+    counts = {"element": 0, "frame": 0, "event": 0, "anim": 0}
+    records = anim_jsonl.Records(lines)
+    while True:
+        with anim_stats.Phase(stats, "parse"):
+            record = next(records, None)
+        if record is None:
+            break
+        with anim_stats.Phase(stats, "pack"):
+            anim = AnimFromJsonl(record, floats, hashcollection)
+            anim_model.WriteAnim(endianstring, anim, outfile)
+        counts["anim"] += 1
+        counts["frame"] += len(anim.frames)
+        counts["element"] += len(anim.elements["name"])
+        counts["event"] += sum(len(frame.events) for frame in anim.frames)
+
+    with anim_stats.Phase(stats, "hash_table"):
+        anim_model.WriteHashCollection(endianstring, list(hashcollection.items()), outfile)
+        end_pos = outfile.tell()
+        outfile.seek(header_pos)
+        outfile.write(
+            struct.pack(endianstring + 'IIII', counts["element"], counts["frame"], counts["event"], counts["anim"]))
+        outfile.seek(end_pos)
+
+    if stats is not None:
+        for name in ("anim", "frame", "element", "event"):
+            stats.Count(name + "s", counts[name])
+        stats.Count("hash_strings", len(hashcollection))
+        try:
+            stats.AddBytes(bytes_in=jsonlfile.tell() + len(sidecar))
+        except (AttributeError, IOError, ValueError):
+            pass
+        stats.AddBytes(bytes_out=end_pos - start_pos)
+        anim_stats.Finish(stats)
+
+
+def CompileAnimJsonlData(endianstring, jsonl, sidecar, stats=None):
+    # Returns the content of anim.bin, jsonl is either the content of anim.jsonl or a file object to read it
+    # from and sidecar the content of anim.f32
+    if not hasattr(jsonl, "read"):
+        jsonl = BytesIO(jsonl)
+    outfile = BytesIO()
+    CompileAnimJsonlStream(endianstring, jsonl, sidecar, outfile, stats)
+    return outfile.getvalue()
+
+
+def CompileAnimJsonl(endianstring, jsonlpath, outfilename, stats=None):
+    # Compiles anim.jsonl and the float32 sidecar next to it
+    with anim_stats.Run("compile_anim", stats) as stats:
+        with open(anim_jsonl.SidecarPath(jsonlpath), 'rb') as f:
+            sidecar = f.read()
+
+        tmpfilename = outfilename + ".tmp"
+        try:
+            with open(jsonlpath, 'rb') as jsonlfile, open(tmpfilename, "w+b") as outfile:
+                CompileAnimJsonlStream(endianstring, jsonlfile, sidecar, outfile, stats)
+        except:
+            if os.path.exists(tmpfilename):
+                os.remove(tmpfilename)
+            raise
+
+        if os.path.exists(outfilename):
+            os.remove(outfilename)
+        os.rename(tmpfilename, outfilename)
 
 
 if __name__ == "__main__":
-    workspace = sys.argv[1]
-    anim_path = os.path.join(workspace, "anim.xml")
+    parser = argparse.ArgumentParser(description="Compile anim.xml of a workspace folder into anim.bin.")
+    parser.add_argument("workspace")
+    parser.add_argument("zippath", nargs="?", metavar="anim.zip",
+                        help="write anim.bin into this anim.zip instead of into the workspace")
+    parser.add_argument("--cache", metavar="DIR", help="reuse the compiled anims cached in this folder")
+    parser.add_argument("--cache-size", type=int, default=anim_cache.DEFAULT_MAX_SIZE // (1024 * 1024),
+                        metavar="MB", help="size limit of the cache, least recently used anims are removed first")
+    parser.add_argument("--stats", nargs="?", const="-", metavar="FILE",
+                        help="write a json report of the time spent per phase and the records counted to FILE "
+                        "(default: stdout)")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="pack the anims of anim.xml in this many processes, the output is the same (default: 1, "
+                        "not used with --cache)")
+    parser.add_argument("--format", choices=anim_jsonl.FORMATS,
+                        help="compile anim.xml, or anim.jsonl with its float32 sidecar anim.f32 (default: anim.xml, "
+                        "anim.jsonl when the workspace only has that one)")
+    args = parser.parse_args()
+
+    workspace = args.workspace
+    anim_path, anim_format = anim_jsonl.WorkspaceFile(workspace, "anim", args.format)
     if not os.path.exists(anim_path):
-        sys.stderr.write("Error: There is no anim.xml under dictionary " + workspace + "\n")
+        sys.stderr.write("Error: There is no anim." + anim_format + " under dictionary " + workspace + "\n")
 
     try:
         endianstring = "<"
-        with open(anim_path, 'rb') as f:
-            CompileAnim(endianstring, f.read(), outfilename=os.path.join(workspace, "anim.bin"))
+        cache = anim_cache.AnimCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+        stats = anim_stats.Stats("compile_anim") if args.stats else None
+        if anim_format == "jsonl":
+            if args.zippath:
+                with open(anim_jsonl.SidecarPath(anim_path), 'rb') as f:
+                    sidecar = f.read()
+                with open(anim_path, 'rb') as f:
+                    anim_bin = CompileAnimJsonlData(endianstring, f, sidecar, stats)
+                with anim_stats.Phase(stats, "write_zip"):
+                    anim_zip.WriteAnimZip(args.zippath, {"anim.bin": anim_bin})
+            else:
+                CompileAnimJsonl(endianstring, anim_path, os.path.join(workspace, "anim.bin"), stats)
+        else:
+            with open(anim_path, 'rb') as f:
+                if args.zippath:
+                    anim_bin = CompileAnimData(endianstring, f, cache, stats, args.jobs)
+                    with anim_stats.Phase(stats, "write_zip"):
+                        anim_zip.WriteAnimZip(args.zippath, {"anim.bin": anim_bin})
+                else:
+                    CompileAnim(endianstring, f, os.path.join(workspace, "anim.bin"), cache, stats, args.jobs)
+        if stats is not None:
+            anim_stats.WriteReport(stats, args.stats)
 
     except:  # catch *all* exceptions
         e = sys.exc_info()[1]
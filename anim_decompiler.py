@@ -1,10 +1,25 @@
+import argparse
+import mmap
 import os
 import struct
 import sys
+import time
 import traceback
-import xml.dom.minidom
+from collections import OrderedDict
 from io import BytesIO
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import anim_jsonl
+import anim_model
+import anim_names
+import anim_stats
+import anim_zip
+from anim_errors import FormatError, ReadsInput
+
 ANIMVERSION = 4
 
 #ANIM format 4
@@ -72,121 +87,397 @@ dir = {
     ""
 }
 
+ELEMENT_FIELDS = anim_model.ELEMENT_FIELDS
+ELEMENT_FORMAT = anim_model.ELEMENT_FORMAT
 
-def strhash(str, hashcollection):
-    hash = 0
-    for c in str:
-        v = ord(c.lower())
-        hash = (v + (hash << 6) + (hash << 16) - hash) & 0xFFFFFFFF
-    hashcollection[hash] = str
-    return hash
 
+def _escape(data):
+    # Same escaping as xml.dom.minidom uses for attribute values
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
 
-def DecompileAnim(endianstring, anim, outfile):
-    hashcollection = {}
-    infile = BytesIO(anim)
 
-    if infile.read(4).decode() != "ANIM" or struct.unpack(endianstring + 'i', infile.read(4))[0] != ANIMVERSION:
-        sys.stderr.write("Error: Input file not match ANIMVERSION_" + str(ANIMVERSION))
-        exit(-1)
+def ReadHashCollection(endianstring, anim, offset):
+    return dict(anim_model.ReadHashCollection(endianstring, anim, offset)[0])
+
+
+def ElementDtype(endianstring):
+    return numpy.dtype([(field, endianstring + ("u4" if fmt == "I" else "f4"))
+                        for field, fmt in zip(ELEMENT_FIELDS, ELEMENT_FORMAT)])
+
+
+@ReadsInput("anim.bin")
+def ReadAnim(endianstring, anim, offset, use_numpy=True):
+    # Decodes the anim starting at offset, returns it as a dict and the offset right after it.
+    # "frames" holds (x, y, w, h, event hashes, element count) for every frame and "elements" maps each of
+    # ELEMENT_FIELDS to a column holding the element records of all frames in order.
+    # With numpy the element blocks are mapped onto a structured dtype and the columns are numpy arrays,
+    # otherwise they are the array.array columns of anim_model.
+    if use_numpy and numpy is not None:
+        record, blocks, offset = anim_model.ReadAnimFrames(endianstring, anim, offset)
+        dtype = ElementDtype(endianstring)
+        if blocks:
+            records = numpy.concatenate(
+                [numpy.frombuffer(anim, dtype, count=count, offset=start) for start, count in blocks])
+        else:
+            records = numpy.empty(0, dtype)
+        elements = dict((field, records[field]) for field in ELEMENT_FIELDS)
+    else:
+        record, offset = anim_model.ReadAnim(endianstring, anim, offset)
+        elements = record.elements
 
-    element_list = struct.unpack(endianstring + 'I', infile.read(4))[0]
-    frame_list = struct.unpack(endianstring + 'I', infile.read(4))[0]
-    event_list = struct.unpack(endianstring + 'I', infile.read(4))[0]
-    anim_len = struct.unpack(endianstring + 'I', infile.read(4))[0]
+    anim_record = {
+        "name": record.name,
+        "facing": record.facing,
+        "root": record.root,
+        "framerate": record.framerate,
+        "frames": [(frame.x, frame.y, frame.w, frame.h, tuple(frame.events), frame.num_elements)
+                   for frame in record.frames],
+        "elements": elements,
+    }
+    return anim_record, offset
 
-    dom = xml.dom.minidom.Document()
-    root_node = dom.createElement('Anims')
-    dom.appendChild(root_node)
 
+def ReadAnims(endianstring, anim, use_numpy=True):
+    # Yields every anim as decoded by ReadAnim
+    anim_len = struct.unpack_from(endianstring + 'I', anim, 20)[0]
+    offset = 24
     for _ in range(anim_len):
-        anim_node = dom.createElement('anim')
-        root_node.appendChild(anim_node)
+        anim_record, offset = ReadAnim(endianstring, anim, offset, use_numpy)
+        yield anim_record
 
-        anim_name_len = struct.unpack(endianstring + "i", infile.read(4))[0]
-        anim_name = struct.unpack(endianstring + str(anim_name_len) + "s", infile.read(anim_name_len))[0]
 
-        facingbyte = struct.unpack(endianstring + "B", infile.read(1))[0]
-        anim_node.setAttribute('name', str(anim_name) + dir[facingbyte])
+def MapFile(f):
+    # Memory maps an open anim.bin, an empty file can not be mapped and is read instead
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        return f.read()
+
 
-        hash = struct.unpack(endianstring + "I", infile.read(4))[0]
-        frame_rate = struct.unpack(endianstring + "f", infile.read(4))[0]
-        frames_num = struct.unpack(endianstring + "I", infile.read(4))[0]
-        anim_node.setAttribute("root", hash)
-        anim_node.setAttribute("framerate", str(frame_rate))
-        anim_node.setAttribute("numframes", str(frames_num))
+class AnimBinIndex(object):
+    # Random access to the anims of an anim.bin. A single skip pass over the counts records where every anim,
+    # its frame block and the trailing hash table start, an anim is only decoded when it is asked for.
+    @ReadsInput("anim.bin")
+    def __init__(self, endianstring, anim):
+        if anim[0:4] != b"ANIM" or struct.unpack_from(endianstring + 'i', anim, 4)[0] != ANIMVERSION:
+            raise FormatError("Input file not match ANIMVERSION_" + str(ANIMVERSION))
 
-        if frames_num > 0:
+        self.endianstring = endianstring
+        self.anim = anim
+        self.hashcollection = None
+
+        # (name, facingbyte, anim offset, frame block offset, num frames) of every anim
+        self.anims = []
+        self.lookup = {}
+        anim_len = struct.unpack_from(endianstring + 'I', anim, 20)[0]
+        offset = 24
+        for idx in range(anim_len):
+            anim_offset = offset
+            anim_name_len = struct.unpack_from(endianstring + "i", anim, offset)[0]
+            offset += 4
+            anim_name = struct.unpack_from(endianstring + str(anim_name_len) + "s", anim, offset)[0]
+            offset += anim_name_len
+            facingbyte = struct.unpack_from(endianstring + "B", anim, offset)[0]
+            offset += 1 + 4 + 4
+            frames_num = struct.unpack_from(endianstring + "I", anim, offset)[0]
+            offset += 4
+            self.anims.append((anim_name, facingbyte, anim_offset, offset, frames_num))
+            self.lookup.setdefault((anim_name, facingbyte), idx)
+            self.lookup.setdefault(anim_name + dir.get(facingbyte, ""), idx)
             for _ in range(frames_num):
-                frame_node = dom.createElement('frame')
-                anim_node.appendChild(frame_node)
-
-                x, y, w, h = struct.unpack(endianstring + "ffff", infile.read(16))
-                frame_node.setAttribute("w", str(w))
-                frame_node.setAttribute("h", str(h))
-                frame_node.setAttribute("x", str(x))
-                frame_node.setAttribute("y", str(y))
-
-                frame_event_len = struct.unpack(endianstring + "I", infile.read(4))[0]
-                for _ in range(0, frame_event_len):
-                    frame_event_node = dom.createElement('event')
-                    frame_node.appendChild(frame_event_node)
-                    frame_event_name_hash = struct.unpack(endianstring + "I", infile.read(4))[0]
-                    frame_event_node.setAttribute("name", frame_event_name_hash)
-
-                element_num = struct.unpack(endianstring + "I", infile.read(4))[0]
-                for i in range(element_num):
-                    elements_node = dom.createElement('element')
-                    frame_node.appendChild(elements_node)
-                    element_name_hash = struct.unpack(endianstring + "I", infile.read(4))[0]
-                    frameint = struct.unpack(endianstring + "I", infile.read(4))[0]
-                    layernamehash = struct.unpack(endianstring + "I", infile.read(4))[0]
-                    m_a, m_b, m_c, m_d, m_tx, m_ty, z = struct.unpack(endianstring + "fffffff", infile.read(28))
-                    elements_node.setAttribute("name", element_name_hash)
-                    elements_node.setAttribute("layername", layernamehash)
-                    elements_node.setAttribute("frame", str(frameint))
-                    elements_node.setAttribute("z_index", str(15 + i))
-                    elements_node.setAttribute("m_a", str(m_a))
-                    elements_node.setAttribute("m_b", str(m_b))
-                    elements_node.setAttribute("m_c", str(m_c))
-                    elements_node.setAttribute("m_d", str(m_d))
-                    elements_node.setAttribute("m_tx", str(m_tx))
-                    elements_node.setAttribute("m_ty", str(m_ty))
-                    elements_node.setAttribute("z", str(z))
-
-    hash_list = struct.unpack(endianstring + 'I', infile.read(4))[0]
-    for _ in range(hash_list):
-        hashid, hashlen = struct.unpack(endianstring + 'Ii', infile.read(8))
-        hashstr = struct.unpack(endianstring + str(hashlen) + 's', infile.read(hashlen))[0]
-        hashcollection[hashid] = hashstr
-
-    node_list = root_node.getElementsByTagName("anim")
-    for node in node_list:
-        node.setAttribute("root", hashcollection[node.getAttribute("root")])
-        frame_list = node.getElementsByTagName("frame")
-        for frame in frame_list:
-            event_list = frame.getElementsByTagName("event")
-            for event in event_list:
-                event.setAttribute("name", hashcollection[event.getAttribute("name")])
-            element_list = frame.getElementsByTagName("element")
-            for element in element_list:
-                element.setAttribute("name", hashcollection[element.getAttribute("name")])
-                element.setAttribute("layername", hashcollection[element.getAttribute("layername")])
-
-    with open(os.path.join(workspace, "anim.xml"), "wb") as f:
-        root_node.writexml(f, indent='', addindent='\t', newl='\n')
+                offset += 16
+                frame_event_len = struct.unpack_from(endianstring + "I", anim, offset)[0]
+                offset += 4 + 4 * frame_event_len
+                element_num = struct.unpack_from(endianstring + "I", anim, offset)[0]
+                offset += 4 + 40 * element_num
+        self.hash_offset = offset
+
+    @classmethod
+    def FromFile(cls, endianstring, path):
+        with open(path, 'rb') as f:
+            return cls(endianstring, MapFile(f))
+
+    def Close(self):
+        if isinstance(self.anim, mmap.mmap):
+            self.anim.close()
+
+    def __len__(self):
+        return len(self.anims)
+
+    def __iter__(self):
+        for idx in range(len(self.anims)):
+            yield self.Decode(idx)
+
+    def __contains__(self, name):
+        return name in self.lookup
+
+    def Names(self):
+        # Names as they appear in anim.xml, with the facing suffix
+        return [anim_name + dir.get(facingbyte, "") for anim_name, facingbyte, _, _, _ in self.anims]
+
+    def Select(self, only=None):
+        # Indices of the anims named in only (all of them without it), names as they appear in anim.xml
+        if only is None:
+            return range(len(self.anims))
+        names = self.Names()
+        unknown = sorted(set(only) - set(names))
+        if unknown:
+            raise KeyError("no anim named " + ", ".join(unknown))
+        return [idx for idx, name in enumerate(names) if name in only]
+
+    def HashCollection(self):
+        if self.hashcollection is None:
+            self.hashcollection = ReadHashCollection(self.endianstring, self.anim, self.hash_offset)
+        return self.hashcollection
+
+    def Decode(self, idx, use_numpy=True):
+        return ReadAnim(self.endianstring, self.anim, self.anims[idx][2], use_numpy)[0]
+
+    def Get(self, name, facing=None, use_numpy=True):
+        # Either the name as it appears in anim.xml ("idle_loop_down") or the name and facingbyte
+        key = name if facing is None else (name, facing)
+        if key not in self.lookup:
+            raise KeyError(key)
+        return self.Decode(self.lookup[key], use_numpy)
+
+
+def WriteAnimXml(outfile, anim, hashcollection):
+    # Writes the <anim> node of an anim_model.Anim, hashcollection maps hashes to already escaped strings
+    frames = anim.frames
+    outfile.write('\t<anim framerate="%s" name="%s" numframes="%s" root="%s"' %
+                  (str(anim.framerate), _escape(str(anim.name) + dir[anim.facing]), str(len(frames)),
+                   hashcollection[anim.root]))
+    if not frames:
+        outfile.write('/>\n')
+        return
+    outfile.write('>\n')
+
+    # The float32 columns come out as python floats, so str() formats them the same as struct.unpack does
+    rows = anim.Rows()
+
+    start = 0
+    for frame in frames:
+        lines = ['\t\t<frame h="%s" w="%s" x="%s" y="%s"' % (str(frame.h), str(frame.w), str(frame.x), str(frame.y))]
+
+        for frame_event_name_hash in frame.events:
+            lines.append('\t\t\t<event name="%s"/>\n' % hashcollection[frame_event_name_hash])
+
+        for i in range(frame.num_elements):
+            element_name_hash, frameint, layernamehash, m_a, m_b, m_c, m_d, m_tx, m_ty, z = rows[start + i]
+            lines.append('\t\t\t<element frame="%s" layername="%s" m_a="%s" m_b="%s" m_c="%s" m_d="%s" m_tx="%s" '
+                         'm_ty="%s" name="%s" z="%s" z_index="%s"/>\n' %
+                         (str(frameint), hashcollection[layernamehash], str(m_a), str(m_b), str(m_c), str(m_d),
+                          str(m_tx), str(m_ty), hashcollection[element_name_hash], str(z), str(15 + i)))
+        start += frame.num_elements
+
+        if len(lines) > 1:
+            lines[0] += '>\n'
+            lines.append('\t\t</frame>\n')
+        else:
+            lines[0] += '/>\n'
+        outfile.write(''.join(lines))
+
+    outfile.write('\t</anim>\n')
+
+
+def DecompileAnimStream(endianstring, anim, outfile, only=None, stats=None, names=None):
+    # anim.xml is written straight to outfile in a single forward pass. The hash table sits at the end of
+    # anim.bin, so it is located first with a cheap skip pass and names are resolved while writing.
+    # With only, a collection of anim names as they appear in anim.xml, just those anims are written.
+    # With names, an anim_names.NameDictionary, the strings of the hash table are added to it and hashes
+    # missing from the table are looked up in it.
+    stats = anim_stats.Start("decompile_anim", stats)
+    start_pos = outfile.tell()
+    with anim_stats.Phase(stats, "index"):
+        index = AnimBinIndex(endianstring, anim)
+        selected = index.Select(only)
+        hashcollection = dict((hashid, _escape(hashstr)) for hashid, hashstr in index.HashCollection().items())
+        if names is not None:
+            names.AddHashCollection(index.HashCollection().items())
+            hashcollection = anim_names.ResolvingDict(hashcollection, names, _escape)
+
+    outfile.write('<Anims>\n' if selected else '<Anims/>\n')
+
+    clock = time.time
+    for idx in selected:
+        decode_start = clock()
+        record = anim_model.ReadAnim(endianstring, anim, index.anims[idx][2])[0]
+        if stats is not None:
+            write_start = clock()
+            stats.AddTime("decode", write_start - decode_start)
+            stats.Count("anims")
+            stats.Count("frames", len(record.frames))
+            stats.Count("elements", len(record.elements["name"]))
+            stats.Count("events", sum(len(frame.events) for frame in record.frames))
+        WriteAnimXml(outfile, record, hashcollection)
+        if stats is not None:
+            stats.AddTime("write", clock() - write_start)
+
+    if selected:
+        outfile.write('</Anims>\n')
+
+    if stats is not None:
+        stats.Count("hash_strings", len(hashcollection))
+        stats.AddBytes(bytes_in=len(anim), bytes_out=outfile.tell() - start_pos)
+        anim_stats.Finish(stats)
+
+
+def DecompileAnimData(endianstring, anim, only=None, stats=None, names=None):
+    # Returns the content of anim.xml
+    outfile = BytesIO()
+    DecompileAnimStream(endianstring, anim, outfile, only, stats, names)
+    return outfile.getvalue()
+
+
+def DecompileAnim(endianstring, anim, workspace, only=None, stats=None, names=None):
+    with anim_stats.Run("decompile_anim", stats) as stats:
+        outfilename = os.path.join(workspace, "anim.xml")
+        tmpfilename = outfilename + ".tmp"
+        try:
+            with open(tmpfilename, "wb") as f:
+                DecompileAnimStream(endianstring, anim, f, only, stats, names)
+        except:
+            if os.path.exists(tmpfilename):
+                os.remove(tmpfilename)
+            raise
+
+        if os.path.exists(outfilename):
+            os.remove(outfilename)
+        os.rename(tmpfilename, outfilename)
+
+
+def WriteAnimJsonl(outfile, sidecar, anim, hashcollection):
+    # Writes the line of an anim_model.Anim to anim.jsonl and its floats to the sidecar, hashcollection maps
+    # hashes to raw strings
+    frames = anim.frames
+    offset = sidecar.Add([value for frame in frames for value in (frame.x, frame.y, frame.w, frame.h)])
+    elements = anim.elements
+    sidecar.AddRows([elements[field] for field in ("m_a", "m_b", "m_c", "m_d", "m_tx", "m_ty")])
+
+    rows = zip(elements["name"].tolist(), elements["frame"].tolist(), elements["layername"].tolist())
+    frame_records = []
+    start = 0
+    for frame in frames:
+        frame_records.append(OrderedDict([
+            ("events", [hashcollection.get(event_hash, event_hash) for event_hash in frame.events]),
+            ("elements", [[hashcollection.get(name_hash, name_hash), frameint, hashcollection.get(layer_hash, layer_hash)]
+                          for name_hash, frameint, layer_hash in rows[start:start + frame.num_elements]]),
+        ]))
+        start += frame.num_elements
+
+    anim_jsonl.DumpLine(outfile, OrderedDict([
+        ("name", str(anim.name) + dir[anim.facing]),
+        ("root", hashcollection.get(anim.root, anim.root)),
+        ("framerate", anim.framerate),
+        ("offset", offset),
+        ("frames", frame_records),
+    ]))
+
+
+def DecompileAnimJsonlStream(endianstring, anim, outfile, sidecarfile, only=None, stats=None, names=None):
+    # Same as DecompileAnimStream, but writes anim.jsonl to outfile and its floats to sidecarfile
+    stats = anim_stats.Start("decompile_anim", stats)
+    start_pos = outfile.tell()
+    with anim_stats.Phase(stats, "index"):
+        index = AnimBinIndex(endianstring, anim)
+        selected = index.Select(only)
+        hashcollection = index.HashCollection()
+        if names is not None:
+            names.AddHashCollection(hashcollection.items())
+            hashcollection = anim_names.ResolvingDict(hashcollection, names)
+
+    anim_jsonl.DumpLine(outfile, anim_jsonl.Header("anim"))
+    sidecar = anim_jsonl.Sidecar(sidecarfile)
+    for idx in selected:
+        with anim_stats.Phase(stats, "decode"):
+            record = anim_model.ReadAnim(endianstring, anim, index.anims[idx][2])[0]
+        with anim_stats.Phase(stats, "write"):
+            WriteAnimJsonl(outfile, sidecar, record, hashcollection)
+            sidecar.Flush()
+        if stats is not None:
+            stats.Count("anims")
+            stats.Count("frames", len(record.frames))
+            stats.Count("elements", len(record.elements["name"]))
+            stats.Count("events", sum(len(frame.events) for frame in record.frames))
+
+    if stats is not None:
+        stats.Count("hash_strings", len(hashcollection))
+        stats.AddBytes(bytes_in=len(anim), bytes_out=outfile.tell() - start_pos + 4 * sidecar.base)
+        anim_stats.Finish(stats)
+
+
+def DecompileAnimJsonlData(endianstring, anim, only=None, stats=None, names=None):
+    # Returns the content of anim.jsonl and of its float32 sidecar
+    outfile = BytesIO()
+    sidecarfile = BytesIO()
+    DecompileAnimJsonlStream(endianstring, anim, outfile, sidecarfile, only, stats, names)
+    return outfile.getvalue(), sidecarfile.getvalue()
+
+
+def DecompileAnimJsonl(endianstring, anim, workspace, only=None, stats=None, names=None):
+    with anim_stats.Run("decompile_anim", stats) as stats:
+        outfilename = os.path.join(workspace, "anim.jsonl")
+        sidecarfilename = anim_jsonl.SidecarPath(outfilename)
+        try:
+            with open(outfilename + ".tmp", "wb") as f, open(sidecarfilename + ".tmp", "wb") as sidecarfile:
+                DecompileAnimJsonlStream(endianstring, anim, f, sidecarfile, only, stats, names)
+        except:
+            for filename in (outfilename, sidecarfilename):
+                if os.path.exists(filename + ".tmp"):
+                    os.remove(filename + ".tmp")
+            raise
+
+        for filename in (outfilename, sidecarfilename):
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rename(filename + ".tmp", filename)
 
 
 if __name__ == "__main__":
-    workspace = sys.argv[1]
-    anim_path = os.path.join(workspace, "anim.bin")
-    if not os.path.exists(anim_path):
-        sys.stderr.write("Error: There is no anim.bin under dictionary " + workspace + "\n")
+    parser = argparse.ArgumentParser(description="Decompile anim.bin of a workspace folder or anim.zip into anim.xml.")
+    parser.add_argument("workspace", help="workspace folder, or an anim.zip which is read directly and whose "
+                        "anim.xml goes to the folder named after it (\"foo.zip\" -> \"foo\")")
+    parser.add_argument("--only", metavar="NAMES", help="comma separated anim names to write, as in anim.xml")
+    parser.add_argument("--format", choices=anim_jsonl.FORMATS, default="xml",
+                        help="write anim.xml, or anim.jsonl with its float32 sidecar anim.f32 (default: xml)")
+    parser.add_argument("--stats", nargs="?", const="-", metavar="FILE",
+                        help="write a json report of the time spent per phase and the records counted to FILE "
+                        "(default: stdout)")
+    parser.add_argument("--names", metavar="DATABASE",
+                        help="reverse hash dictionary (see anim_names.py) the strings of the hash table are added "
+                        "to and missing strings are looked up in")
+    args = parser.parse_args()
+
+    workspace = args.workspace
+    only = set(args.only.split(",")) if args.only else None
+    zippath = None
+    if anim_zip.IsAnimZip(workspace):
+        zippath = workspace
+        workspace = anim_zip.ZipWorkspace(zippath)
+        anim_path = zippath + "/anim.bin"
+    else:
+        anim_path = os.path.join(workspace, "anim.bin")
+        if not os.path.exists(anim_path):
+            sys.stderr.write("Error: There is no anim.bin under dictionary " + workspace + "\n")
 
     try:
         endianstring = "<"
-        with open(anim_path, 'rb') as f:
-            DecompileAnim(endianstring, f.read(), workspace)
+        stats = anim_stats.Stats("decompile_anim") if args.stats else None
+        decompile = DecompileAnimJsonl if args.format == "jsonl" else DecompileAnim
+        names = anim_names.NameDictionary(args.names) if args.names else None
+        if zippath:
+            if not os.path.isdir(workspace):
+                os.makedirs(workspace)
+            with anim_stats.Phase(stats, "read_zip"):
+                anim = anim_zip.ReadZipEntry(zippath, "anim.bin")
+            decompile(endianstring, anim, workspace, only, stats, names)
+        else:
+            with open(anim_path, 'rb') as f:
+                decompile(endianstring, MapFile(f), workspace, only, stats, names)
+        if names is not None:
+            names.Close()
+        if stats is not None:
+            anim_stats.WriteReport(stats, args.stats)
 
     except:  # catch *all* exceptions
         e = sys.exc_info()[1]
@@ -0,0 +1,340 @@
+import argparse
+import json
+import struct
+import sys
+import traceback
+from collections import OrderedDict
+
+import anim_decompiler
+import anim_model
+import anim_zip
+from anim_errors import FormatError, ReadsInput
+
+# Structural diff of two anim.bin or two build.bin files, without decompiling them to XML.
+#
+# Anims are matched by name and facing and shown with their anim.xml name, their frames by index and the elements
+# of a frame by symbol, layer and how often that pair came before in the frame. Build symbols are matched by hash,
+# their frames by framenum.
+# Every change is an (op, what, detail) tuple, op being "+" added, "-" removed or "~" changed.
+#
+# Both files are first only walked to find the byte span of every anim and build frame, records whose bytes
+# are the same in both are skipped without being decoded. Floats that differ by no more than the tolerance
+# count as the same.
+
+DEFAULT_TOLERANCE = 1e-4
+
+
+def _Close(a, b, tolerance):
+    return abs(a - b) <= tolerance
+
+
+def _Name(names, hash_idx):
+    return names.get(hash_idx, str(hash_idx))
+
+
+def AnimLabel(name, facing):
+    # The name of an anim as it appears in anim.xml, a facing anim.xml has no suffix for is added as a number
+    if facing in anim_decompiler.dir:
+        return "anim " + name + anim_decompiler.dir[facing]
+    return "anim {}:{}".format(name, facing)
+
+
+@ReadsInput("anim.bin")
+def AnimSpans(endianstring, data):
+    # The (start, end) byte span of every anim by (name, facing) in file order, and the offset of the hash table
+    if data[0:4] != b"ANIM" or struct.unpack_from(endianstring + 'i', data, 4)[0] != anim_model.ANIMVERSION:
+        raise FormatError("Input file not match ANIMVERSION_" + str(anim_model.ANIMVERSION))
+
+    spans = OrderedDict()
+    anims_num = struct.unpack_from(endianstring + 'I', data, 20)[0]
+    offset = 24
+    for _ in range(anims_num):
+        start = offset
+        name_len = struct.unpack_from(endianstring + "i", data, offset)[0]
+        offset += 4
+        name = data[offset:offset + name_len]
+        offset += name_len
+        facing, _, _, frames_num = struct.unpack_from(endianstring + "BIfI", data, offset)
+        offset += 13
+        for _ in range(frames_num):
+            events = struct.unpack_from(endianstring + "I", data, offset + 16)[0]
+            offset += 20 + 4 * events
+            elements = struct.unpack_from(endianstring + "I", data, offset)[0]
+            offset += 4 + 40 * elements
+        # Of anims with the same name and facing only the last one is compared
+        spans[(name, facing)] = (start, offset)
+    return spans, offset
+
+
+def DiffFrame(label, old, old_rows, new, new_rows, names, tolerance, changes):
+    old_bbox = (old.x, old.y, old.w, old.h)
+    new_bbox = (new.x, new.y, new.w, new.h)
+    if not all(_Close(a, b, tolerance) for a, b in zip(old_bbox, new_bbox)):
+        changes.append(("~", label, "bbox {} -> {}".format(old_bbox, new_bbox)))
+    if old.events != new.events:
+        changes.append(("~", label, "events {} -> {}".format([_Name(names, e) for e in old.events],
+                                                             [_Name(names, e) for e in new.events])))
+    if old_rows == new_rows:
+        return
+
+    def Keyed(rows):
+        keyed = OrderedDict()
+        seen = {}
+        for row in rows:
+            pair = (row[0], row[2])
+            seen[pair] = seen.get(pair, -1) + 1
+            keyed[pair + (seen[pair],)] = row
+        return keyed
+
+    old_keyed = Keyed(old_rows)
+    new_keyed = Keyed(new_rows)
+    for key in list(old_keyed) + [key for key in new_keyed if key not in old_keyed]:
+        what = "{} element {}/{}{}".format(label, _Name(names, key[0]), _Name(names, key[1]),
+                                           "#" + str(key[2]) if key[2] else "")
+        if key not in new_keyed:
+            changes.append(("-", what, ""))
+        elif key not in old_keyed:
+            changes.append(("+", what, ""))
+        else:
+            old_row = old_keyed[key]
+            new_row = new_keyed[key]
+            fields = ["{} {} -> {}".format(field, a, b)
+                      for field, a, b in zip(anim_model.ELEMENT_FIELDS[3:], old_row[3:], new_row[3:])
+                      if not _Close(a, b, tolerance)]
+            if old_row[1] != new_row[1]:
+                fields.insert(0, "frame {} -> {}".format(old_row[1], new_row[1]))
+            if fields:
+                changes.append(("~", what, ", ".join(fields)))
+    if [key for key in old_keyed if key in new_keyed] != [key for key in new_keyed if key in old_keyed]:
+        changes.append(("~", label, "elements reordered"))
+
+
+def DiffAnim(label, old, new, names, tolerance, changes):
+    if not _Close(old.framerate, new.framerate, tolerance):
+        changes.append(("~", label, "framerate {} -> {}".format(old.framerate, new.framerate)))
+    if old.root != new.root:
+        changes.append(("~", label, "root {} -> {}".format(_Name(names, old.root), _Name(names, new.root))))
+
+    old_rows = old.Rows()
+    new_rows = new.Rows()
+    old_starts = old.FrameStarts()
+    new_starts = new.FrameStarts()
+    for idx in range(max(len(old.frames), len(new.frames))):
+        what = "{} frame {}".format(label, idx)
+        if idx >= len(new.frames):
+            changes.append(("-", what, "{} elements".format(old.frames[idx].num_elements)))
+        elif idx >= len(old.frames):
+            changes.append(("+", what, "{} elements".format(new.frames[idx].num_elements)))
+        else:
+            old_frame = old.frames[idx]
+            new_frame = new.frames[idx]
+            DiffFrame(what, old_frame, old_rows[old_starts[idx]:old_starts[idx] + old_frame.num_elements],
+                      new_frame, new_rows[new_starts[idx]:new_starts[idx] + new_frame.num_elements],
+                      names, tolerance, changes)
+
+
+def DiffAnimBins(endianstring, old_data, new_data, tolerance=DEFAULT_TOLERANCE):
+    # Returns the changes from the anim.bin old_data to the anim.bin new_data
+    old_spans, old_offset = AnimSpans(endianstring, old_data)
+    new_spans, new_offset = AnimSpans(endianstring, new_data)
+    # Hashes of strings are the same in both files, so one table names the hashes of either
+    names = dict(anim_model.ReadHashCollection(endianstring, old_data, old_offset)[0])
+    names.update(anim_model.ReadHashCollection(endianstring, new_data, new_offset)[0])
+
+    changes = []
+    for key in list(old_spans) + [key for key in new_spans if key not in old_spans]:
+        label = AnimLabel(*key)
+        if key not in new_spans:
+            changes.append(("-", label, ""))
+        elif key not in old_spans:
+            changes.append(("+", label, ""))
+        else:
+            old_start, old_end = old_spans[key]
+            new_start, new_end = new_spans[key]
+            if old_data[old_start:old_end] == new_data[new_start:new_end]:
+                continue
+            DiffAnim(label, anim_model.ReadAnim(endianstring, old_data, old_start)[0],
+                     anim_model.ReadAnim(endianstring, new_data, new_start)[0], names, tolerance, changes)
+    return changes
+
+
+class BuildSpans(object):
+    # The offset of every frame record of a build.bin by symbol hash and framenum, and where its vertices are
+    @ReadsInput("build.bin")
+    def __init__(self, endianstring, data):
+        if data[0:4] != b"BILD" or struct.unpack_from(endianstring + 'i', data, 4)[0] != anim_model.BUILDVERSION:
+            raise FormatError("Input file not match BUILDVERSION_" + str(anim_model.BUILDVERSION))
+
+        self.endianstring = endianstring
+        self.data = data
+        symbols_num = struct.unpack_from(endianstring + 'I', data, 8)[0]
+        offset = 16
+        name_len = struct.unpack_from(endianstring + "i", data, offset)[0]
+        self.name = data[offset + 4:offset + 4 + name_len]
+        offset += 4 + name_len
+
+        self.textures = []
+        textures_num = struct.unpack_from(endianstring + 'I', data, offset)[0]
+        offset += 4
+        for _ in range(textures_num):
+            name_len = struct.unpack_from(endianstring + "i", data, offset)[0]
+            self.textures.append(data[offset + 4:offset + 4 + name_len])
+            offset += 4 + name_len
+
+        self.symbols = OrderedDict()
+        for _ in range(symbols_num):
+            symbol_hash, frames_num = struct.unpack_from(endianstring + 'II', data, offset)
+            offset += 8
+            frames = self.symbols[symbol_hash] = OrderedDict()
+            for _ in range(frames_num):
+                frames[struct.unpack_from(endianstring + 'I', data, offset)[0]] = offset
+                offset += 32
+
+        self.verts_num = struct.unpack_from(endianstring + 'I', data, offset)[0]
+        self.verts_offset = offset + 4
+        offset = self.verts_offset + 24 * self.verts_num
+        if offset > len(data):
+            raise FormatError("build.bin ends inside its vertices")
+        self.names = {}
+        if len(data) >= offset + 4:
+            try:
+                self.names = dict(anim_model.ReadHashCollection(endianstring, data, offset)[0])
+            except FormatError:
+                pass
+
+    @ReadsInput("build.bin")
+    def Record(self, offset):
+        # The frame record at offset without its alphaidx, which moves whenever vertices before it change,
+        # and the bytes of its vertices
+        record = self.data[offset:offset + 32]
+        alphaidx, alphacount = struct.unpack(self.endianstring + "II", record[24:32])
+        if alphaidx + alphacount > self.verts_num:
+            raise FormatError("build.bin has a frame with vertices past the end of its vertices")
+        start = self.verts_offset + 24 * alphaidx
+        return record[:24] + record[28:], self.data[start:start + 24 * alphacount]
+
+
+def DiffBuildFrame(what, old_record, new_record, endianstring, tolerance, changes):
+    # The records are the ones returned by BuildSpans.Record
+    old_frame = struct.unpack(endianstring + "IIffffI", old_record[0])
+    new_frame = struct.unpack(endianstring + "IIffffI", new_record[0])
+    fields = []
+    if old_frame[1] != new_frame[1]:
+        fields.append("duration {} -> {}".format(old_frame[1], new_frame[1]))
+    for field, a, b in zip(("x", "y", "w", "h"), old_frame[2:6], new_frame[2:6]):
+        if not _Close(a, b, tolerance):
+            fields.append("{} {} -> {}".format(field, a, b))
+    if fields:
+        changes.append(("~", what, ", ".join(fields)))
+
+    swap = anim_model.NeedSwap(endianstring)
+    old_verts = anim_model.ReadArray("f", old_record[1], swap)
+    new_verts = anim_model.ReadArray("f", new_record[1], swap)
+    if len(old_verts) != len(new_verts):
+        changes.append(("~", what + " vertices", "{} -> {} vertices".format(len(old_verts) // 6, len(new_verts) // 6)))
+        return
+    moved = set(idx // 6 for idx, (a, b) in enumerate(zip(old_verts, new_verts)) if not _Close(a, b, tolerance))
+    if moved:
+        delta = max(abs(a - b) for a, b in zip(old_verts, new_verts))
+        changes.append(("~", what + " vertices", "{} of {} vertices changed, by up to {}".format(
+            len(moved), len(old_verts) // 6, delta)))
+
+
+def DiffBuildBins(endianstring, old_data, new_data, tolerance=DEFAULT_TOLERANCE):
+    # Returns the changes from the build.bin old_data to the build.bin new_data
+    old = BuildSpans(endianstring, old_data)
+    new = BuildSpans(endianstring, new_data)
+    names = dict(old.names)
+    names.update(new.names)
+
+    changes = []
+    if old.name != new.name:
+        changes.append(("~", "build", "name {} -> {}".format(old.name, new.name)))
+    if old.textures != new.textures:
+        changes.append(("~", "build", "textures {} -> {}".format(old.textures, new.textures)))
+
+    added = [symbol_hash for symbol_hash in new.symbols if symbol_hash not in old.symbols]
+    for symbol_hash in list(old.symbols) + added:
+        label = "symbol " + _Name(names, symbol_hash)
+        if symbol_hash not in new.symbols:
+            changes.append(("-", label, "{} frames".format(len(old.symbols[symbol_hash]))))
+            continue
+        if symbol_hash not in old.symbols:
+            changes.append(("+", label, "{} frames".format(len(new.symbols[symbol_hash]))))
+            continue
+        old_frames = old.symbols[symbol_hash]
+        new_frames = new.symbols[symbol_hash]
+        for framenum in list(old_frames) + [framenum for framenum in new_frames if framenum not in old_frames]:
+            what = "{} frame {}".format(label, framenum)
+            if framenum not in new_frames:
+                changes.append(("-", what, ""))
+            elif framenum not in old_frames:
+                changes.append(("+", what, ""))
+            else:
+                old_record = old.Record(old_frames[framenum])
+                new_record = new.Record(new_frames[framenum])
+                if old_record != new_record:
+                    DiffBuildFrame(what, old_record, new_record, endianstring, tolerance, changes)
+    return changes
+
+
+def DiffData(endianstring, old_data, new_data, tolerance=DEFAULT_TOLERANCE):
+    # Picks the diff by the magic of old_data
+    if old_data[0:4] != new_data[0:4]:
+        raise FormatError("Both files have to be anim.bin or build.bin files")
+    if old_data[0:4] == b"BILD":
+        return DiffBuildBins(endianstring, old_data, new_data, tolerance)
+    return DiffAnimBins(endianstring, old_data, new_data, tolerance)
+
+
+def DiffPaths(endianstring, old, new, tolerance=DEFAULT_TOLERANCE):
+    # (file, changes) of two .bin files, or of the anim.bin and build.bin of two anim.zip files
+    if anim_zip.IsAnimZip(old) and anim_zip.IsAnimZip(new):
+        entries = [name for name in ("anim.bin", "build.bin")
+                   if name in anim_zip.ZipEntries(old) and name in anim_zip.ZipEntries(new)]
+        return [(name, DiffData(endianstring, anim_zip.ReadZipEntry(old, name), anim_zip.ReadZipEntry(new, name),
+                                tolerance)) for name in entries]
+    with open(old, "rb") as f:
+        old_data = f.read()
+    with open(new, "rb") as f:
+        new_data = f.read()
+    return [(new, DiffData(endianstring, old_data, new_data, tolerance))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show what changed between two anim.bin or two build.bin files.")
+    parser.add_argument("old", help="anim.bin, build.bin or anim.zip")
+    parser.add_argument("new", help="a file of the same kind as old")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="largest difference of floats that are still the same (default: {})".format(
+                            DEFAULT_TOLERANCE))
+    parser.add_argument("--json", nargs="?", const="-", metavar="FILE",
+                        help="write the changes as json to FILE (default: stdout)")
+    args = parser.parse_args()
+
+    endianstring = "<"
+    try:
+        diffs = DiffPaths(endianstring, args.old, args.new, args.tolerance)
+    except:  # catch *all* exceptions
+        e = sys.exc_info()[1]
+        sys.stderr.write("Error Comparing {} {}\n".format(args.old, args.new) + str(e) + "\n")
+        traceback.print_exc(file=sys.stderr)
+        exit(-1)
+
+    if args.json:
+        data = json.dumps(OrderedDict((name, [OrderedDict((("op", op), ("what", what), ("detail", detail)))
+                                              for op, what, detail in changes])
+                                      for name, changes in diffs), indent=2) + "\n"
+        if args.json == "-":
+            sys.stdout.write(data)
+        else:
+            with open(args.json, "w") as f:
+                f.write(data)
+    if args.json != "-":
+        for name, changes in diffs:
+            for op, what, detail in changes:
+                sys.stdout.write("{} {}{}\n".format(op, what, ": " + detail if detail else ""))
+            sys.stdout.write("{}: {} changes\n".format(name, len(changes)))
+    # Like diff, 1 when the files differ
+    if any(changes for _, changes in diffs):
+        exit(1)
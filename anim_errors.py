@@ -0,0 +1,32 @@
+import functools
+import struct
+import sys
+
+# Exceptions raised by the compilers and decompilers when they are used as a library.
+# The scripts still report them on stderr and exit with -1 when run from the command line.
+
+
+class AnimToolError(Exception):
+    pass
+
+
+class FormatError(AnimToolError, ValueError):
+    # The input is not an anim.bin / build.bin of the supported version, or is truncated or corrupt
+    pass
+
+
+def ReadsInput(what):
+    # Decorator for the functions reading a .bin: running past the end of a truncated or corrupt input shows up
+    # as struct.error, or as the ValueError of array.fromstring/numpy.frombuffer, both are raised as a
+    # FormatError instead so a host can catch every bad input as an AnimToolError
+    def Decorate(function):
+        @functools.wraps(function)
+        def Reader(*args, **kwargs):
+            try:
+                return function(*args, **kwargs)
+            except FormatError:
+                raise
+            except (struct.error, ValueError) as e:
+                raise FormatError("{} is truncated or corrupt: {}".format(what, e)), None, sys.exc_info()[2]
+        return Reader
+    return Decorate
@@ -0,0 +1,110 @@
+import argparse
+import random
+import sys
+import time
+
+# strhash, the case insensitive string hash of anim.bin/build.bin, shared by the compilers and decompilers.
+#
+# hash = hash * 65599 + lowercased byte, mod 2^32, for every byte of the string. The same few hundred
+# symbol, layer and event names are hashed over and over, so the hash of every string is remembered in a
+# memo, which is emptied when it reaches MEMO_SIZE strings to keep it bounded.
+#
+# strhash adds the string to hashcollection like it always did, StrHashes does the same for a whole list in
+# one call. SelfCheck compares both against the original per character implementation.
+
+MEMO_SIZE = 1 << 16
+
+_memo = {}
+
+
+def _Hash(str):
+    hash = 0
+    # bytearray of the lowercased string gives the bytes as ints without an ord() call per character
+    for v in bytearray(str.lower()) if isinstance(str, bytes) else [ord(c) for c in str.lower()]:
+        hash = (hash * 65599 + v) & 0xFFFFFFFF
+    return hash
+
+
+def strhash(str, hashcollection):
+    hash = _memo.get(str)
+    if hash is None:
+        if len(_memo) >= MEMO_SIZE:
+            _memo.clear()
+        hash = _memo[str] = _Hash(str)
+    hashcollection[hash] = str
+    return hash
+
+
+def StrHashes(strings, hashcollection):
+    # The hashes of strings, which are added to hashcollection in order exactly like strhash would
+    memo = _memo
+    hashes = []
+    for str in strings:
+        hash = memo.get(str)
+        if hash is None:
+            if len(memo) >= MEMO_SIZE:
+                memo.clear()
+            hash = memo[str] = _Hash(str)
+        hashcollection[hash] = str
+        hashes.append(hash)
+    return hashes
+
+
+def ClearMemo():
+    _memo.clear()
+
+
+def ReferenceStrhash(str, hashcollection):
+    # The original implementation, kept to check the one above against
+    hash = 0
+    for c in str:
+        v = ord(c.lower())
+        hash = (v + (hash << 6) + (hash << 16) - hash) & 0xFFFFFFFF
+    hashcollection[hash] = str
+    return hash
+
+
+def SelfCheck(count=20000, seed=0):
+    # Compares strhash and StrHashes with ReferenceStrhash on every single byte, names as they appear in
+    # anims and count random strings up to 300 bytes long, returns the strings that hash differently
+    rng = random.Random(seed)
+    strings = [chr(i) for i in range(256)]
+    strings += ["", "root", "Head", "HEAD", "head", "folder/Layer_1", "swap_object-12", "anim_down", "ev_footstep"]
+    alphabet = [chr(i) for i in range(256)]
+    for _ in range(count):
+        strings.append("".join(rng.choice(alphabet) for _ in range(rng.randint(0, rng.choice((16, 40, 300))))))
+    strings += [u"Head", u"folder/Layer_1"]
+
+    expected = [ReferenceStrhash(str, {}) for str in strings]
+    mismatches = []
+    ClearMemo()
+    for _ in range(2):  # the second time every hash comes from the memo
+        for str, hash in zip(strings, expected):
+            if strhash(str, {}) != hash:
+                mismatches.append(str)
+    hashcollection = {}
+    reference = {}
+    hashes = StrHashes(strings, hashcollection)
+    for str in strings:
+        ReferenceStrhash(str, reference)
+    mismatches.extend(str for str, hash, ref in zip(strings, hashes, expected) if hash != ref)
+    if hashcollection != reference:
+        mismatches.append("<hashcollection>")
+    ClearMemo()
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check strhash against its original implementation.")
+    parser.add_argument("--count", type=int, default=20000, help="number of random strings (default: 20000)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.time()
+    mismatches = SelfCheck(args.count, args.seed)
+    if mismatches:
+        sys.stderr.write("Error: strhash differs from the original for {} strings, the first one is {!r}\n".format(
+            len(mismatches), mismatches[0]))
+        exit(-1)
+    sys.stdout.write("strhash matches the original ({} random strings, {:.2f}s)\n".format(args.count,
+                                                                                         time.time() - start))
@@ -0,0 +1,117 @@
+import json
+import os
+from collections import OrderedDict
+
+import anim_model
+from anim_errors import FormatError
+
+# Compact intermediate format, an alternative to anim.xml/build.xml that is much faster to write and read.
+#
+# anim.jsonl/build.jsonl is line delimited json: a header line, then one line per anim or per symbol with the
+# strings and ints of the XML. The floats (frame bboxes, element matrices, vertices) are kept out of the json
+# in a raw little endian float32 sidecar next to it (anim.f32/build.f32), every line refers to its floats by
+# their index in the sidecar, so lines can be dropped or reordered without touching the sidecar.
+# The floats are the float32 values of the .bin, so .bin -> jsonl -> .bin is exact, unlike XML where they go
+# through str().
+#
+# anim.jsonl
+#   {"format": "anim", "version": 1}
+#   {"name": "idle_down", "root": "root", "framerate": 30.0, "offset": int, "frames": [
+#       {"events": ["event", ...], "elements": [["symbol", frame, "layername"], ...]}, ...]}
+#   sidecar at offset: x, y, w, h of every frame, then m_a, m_b, m_c, m_d, m_tx, m_ty of every element
+#
+# build.jsonl
+#   {"format": "build", "version": 1, "name": "build", "textures": ["atlas-0.tex", ...], "verts": [offset, num]}
+#   {"name": "symbol" or "namehash": int, "offset": int, "frames": [[framenum, duration, alphaidx, alphacount], ...]}
+#   sidecar at offset: x, y, w, h of every frame; at verts: x, y, z, u, v, w of every vertex
+#
+# A string whose hash is missing from the hash table of the .bin is written as the hash itself. Every build
+# symbol found in the hash table gets its name, where build.xml stops naming them at the first one missing.
+
+JSONLVERSION = 1
+FORMATS = ("xml", "jsonl")
+
+
+def SidecarPath(path):
+    # "anim.jsonl" -> "anim.f32"
+    return os.path.splitext(path)[0] + ".f32"
+
+
+def FormatOf(path):
+    # The intermediate format a file is in, by its extension
+    return "jsonl" if path.endswith(".jsonl") else "xml"
+
+
+def WorkspaceFile(workspace, kind, fmt=None):
+    # The path of anim.xml/anim.jsonl (kind "anim") or build.xml/build.jsonl in workspace and its format. Without
+    # fmt it is the .xml, or the .jsonl when the workspace only has that one
+    if fmt is not None:
+        path = os.path.join(workspace, kind + "." + fmt)
+    else:
+        path = os.path.join(workspace, kind + ".xml")
+        if not os.path.exists(path) and os.path.exists(os.path.join(workspace, kind + ".jsonl")):
+            path = os.path.join(workspace, kind + ".jsonl")
+    return path, FormatOf(path)
+
+
+def Header(kind, *fields):
+    return OrderedDict((("format", kind), ("version", JSONLVERSION)) + fields)
+
+
+def DumpLine(outfile, record):
+    outfile.write(json.dumps(record, separators=(",", ":")))
+    outfile.write("\n")
+
+
+def ReadHeader(line, kind):
+    try:
+        header = json.loads(line)
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("format") != kind or header.get("version") != JSONLVERSION:
+        raise FormatError("Input file is not a version " + str(JSONLVERSION) + " " + kind + ".jsonl")
+    return header
+
+
+def Records(lines):
+    # The json records of the lines after the header, blank lines are skipped
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def Ascii(value):
+    # Strings come back from json as unicode, hashes stay ints
+    return value.encode('ascii') if not isinstance(value, (int, long)) else value
+
+
+class Sidecar(object):
+    # Collects the floats written next to a .jsonl and hands out their offsets, Flush writes what was
+    # collected so far to outfile
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.base = 0
+        self.floats = anim_model.Column("f")
+
+    def Add(self, values):
+        offset = self.base + len(self.floats)
+        self.floats.extend(anim_model.Column("f", values))
+        return offset
+
+    def AddRows(self, columns):
+        # Adds the columns interleaved as rows, all of them have the same length
+        rows = anim_model.Column("f", [0.0]) * (len(columns[0]) * len(columns))
+        for i, column in enumerate(columns):
+            rows[i::len(columns)] = anim_model.Column("f", column)
+        return self.Add(rows)
+
+    def Flush(self):
+        self.outfile.write(anim_model.ArrayBytes(self.floats, anim_model.NeedSwap("<")))
+        self.base += len(self.floats)
+        self.floats = anim_model.Column("f")
+
+
+def ReadSidecar(data):
+    if len(data) % 4:
+        raise FormatError("The float32 sidecar has a partial float at its end")
+    return anim_model.ReadArray("f", data, anim_model.NeedSwap("<"))
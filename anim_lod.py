@@ -0,0 +1,196 @@
+import argparse
+import sys
+import traceback
+from io import BytesIO
+
+import anim_decompiler
+import anim_model
+import anim_zip
+
+# Lower cost variants of an anim.bin for far away or background entities, fewer frames per anim.
+#
+# Every anim plays its frames at one frame rate, frames have no duration of their own, so the frames kept are
+# spread evenly over the anim and all play at the new frame rate.
+#  - ResampleFrames keeps round(frames * target / framerate) frames and plays them at the target frame rate
+#  - SimilarStep finds the largest step for which every dropped frame is within a tolerance of the frame
+#    shown in its place: same elements, and no matrix value further than the tolerance from it
+# The events of a dropped frame move onto the frame shown in its place. The length of an anim can change a
+# little when the frames kept do not divide it evenly (10 frames at 30 fps are 3 at 10 fps, 0.3s instead of
+# 0.333s), keep_length sets the frame rate to keep it instead (3 frames at 9 fps).
+
+DEFAULT_TOLERANCE = 0.01
+
+
+def ResampleFrames(num_frames, framerate, target):
+    # Frames kept when playing at target frame rate and the frame rate they play at
+    if target <= 0 or target >= framerate or num_frames == 0:
+        return list(range(num_frames)), framerate
+    count = max(int(round(num_frames * target / framerate)), 1)
+    # A small epsilon keeps 30 -> 10 from landing a hair below the frame it means
+    return [min(int(j * num_frames / float(count) + 1e-6), num_frames - 1) for j in range(count)], target
+
+
+def SimilarStep(anim, tolerance):
+    # The largest step at which only frames within tolerance of the frame shown instead are dropped
+    starts = anim.FrameStarts()
+    elements = anim.elements
+    keys = ("name", "frame", "layername")
+    matrices = ("m_a", "m_b", "m_c", "m_d", "m_tx", "m_ty")
+
+    def Similar(idx, shown):
+        if anim.frames[idx].num_elements != anim.frames[shown].num_elements:
+            return False
+        a = starts[idx]
+        b = starts[shown]
+        num = anim.frames[idx].num_elements
+        for field in keys:
+            if elements[field][a:a + num] != elements[field][b:b + num]:
+                return False
+        for field in matrices:
+            column = elements[field]
+            if any(abs(x - y) > tolerance for x, y in zip(column[a:a + num], column[b:b + num])):
+                return False
+        return True
+
+    num_frames = len(anim.frames)
+    best = 1
+    # A step failing says nothing about larger ones, two 3 frame holds fail step 2 and pass step 3
+    for step in range(2, num_frames + 1):
+        if all(Similar(idx, idx - idx % step) for idx in range(num_frames) if idx % step):
+            best = step
+    return best
+
+
+def KeepFrames(anim, frame_indices, framerate):
+    # Keeps the given frames, in increasing order, the events of every other frame go onto the last kept
+    # frame before it. An event already on that frame is not added twice.
+    kept = set(frame_indices)
+    target = None
+    for idx, frame in enumerate(anim.frames):
+        if idx in kept:
+            target = frame
+        elif target is not None:
+            target.events.extend(event for event in frame.events if event not in target.events)
+    anim.SelectFrames(frame_indices)
+    anim.framerate = framerate
+
+
+def ReduceAnim(anim, framerate=None, tolerance=None, keep_length=False):
+    # Drops frames of the anim_model.Anim by target frame rate, by tolerance, or both (the larger step
+    # of the two wins), returns the number of frames dropped. With keep_length the frame rate is set so
+    # the frames kept play for as long as all of them did.
+    num_frames = len(anim.frames)
+    frame_indices = list(range(num_frames))
+    new_framerate = anim.framerate
+    if framerate is not None:
+        frame_indices, new_framerate = ResampleFrames(num_frames, anim.framerate, framerate)
+    if tolerance is not None:
+        step = SimilarStep(anim, tolerance)
+        if num_frames and anim.framerate / step < new_framerate:
+            frame_indices = list(range(0, num_frames, step))
+            new_framerate = anim.framerate / step
+    if len(frame_indices) == num_frames:
+        return 0
+    if keep_length:
+        new_framerate = anim.framerate * len(frame_indices) / float(num_frames)
+    KeepFrames(anim, frame_indices, new_framerate)
+    return num_frames - len(frame_indices)
+
+
+def AnimSize(endianstring, anim):
+    outfile = BytesIO()
+    anim_model.WriteAnim(endianstring, anim, outfile)
+    return len(outfile.getvalue())
+
+
+def ReduceAnimBin(endianstring, animbin, framerate=None, tolerance=None, keep_length=False):
+    # Reduces every anim of the anim_model.AnimBin, returns (name, frames, new frames, framerate,
+    # new framerate, bytes, new bytes) of each
+    report = []
+    for anim in animbin.anims:
+        frames_num = len(anim.frames)
+        old_framerate = anim.framerate
+        size = AnimSize(endianstring, anim)
+        if ReduceAnim(anim, framerate, tolerance, keep_length):
+            new_size = AnimSize(endianstring, anim)
+        else:
+            new_size = size
+        name = anim.name + anim_decompiler.dir.get(anim.facing, "")
+        report.append((name, frames_num, len(anim.frames), old_framerate, anim.framerate, size, new_size))
+    return report
+
+
+def HeldPoseAnim(holds, hold_frames):
+    # An anim of holds poses each shown for hold_frames frames, one element per frame
+    anim = anim_model.Anim(b"held", 0, 0, 30.0)
+    for pose in range(holds):
+        for _ in range(hold_frames):
+            anim.frames.append(anim_model.AnimFrame(0.0, 0.0, 1.0, 1.0, num_elements=1))
+            row = (1, 0, 2, 1.0, 0.0, 0.0, 1.0, 10.0 * pose, 0.0, 0.0)
+            for field, value in zip(anim_model.ELEMENT_FIELDS, row):
+                anim.elements[field].append(value)
+    return anim
+
+
+def SelfCheck():
+    # Returns the problems found reducing anims of held poses by tolerance
+    problems = []
+    for holds, hold_frames in ((2, 3), (3, 2), (2, 4), (1, 5)):
+        anim = HeldPoseAnim(holds, hold_frames)
+        step = SimilarStep(anim, DEFAULT_TOLERANCE)
+        if step != hold_frames:
+            problems.append("{} holds of {} frames: step {} instead of {}".format(holds, hold_frames, step,
+                                                                                  hold_frames))
+        dropped = ReduceAnim(anim, tolerance=DEFAULT_TOLERANCE)
+        if dropped != holds * (hold_frames - 1):
+            problems.append("{} holds of {} frames: {} frames dropped instead of {}".format(
+                holds, hold_frames, dropped, holds * (hold_frames - 1)))
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a variant of anim.bin with fewer frames per anim.")
+    parser.add_argument("anim", nargs="?", help="anim.bin, or an anim.zip holding it")
+    parser.add_argument("--output", "-o", help="file the reduced anim.bin is written to (default: overwrite anim)")
+    parser.add_argument("--framerate", type=float, help="resample the anims faster than this to this frame rate")
+    parser.add_argument("--tolerance", type=float, nargs="?", const=DEFAULT_TOLERANCE,
+                        help="drop frames whose elements are within this of the frame shown instead "
+                        "(default: %(const)s)")
+    parser.add_argument("--keep-length", action="store_true",
+                        help="set the frame rate so every anim keeps its length instead of using --framerate "
+                        "or the step as it is")
+    parser.add_argument("--self-check", action="store_true", help="check the reduction of anims of held poses")
+    args = parser.parse_args()
+    if args.self_check:
+        problems = SelfCheck()
+        for problem in problems:
+            sys.stderr.write("Error: " + problem + "\n")
+        if problems:
+            exit(-1)
+        sys.stdout.write("anims of held poses are reduced to one frame per pose\n")
+        exit(0)
+    if args.anim is None:
+        parser.error("anim is needed")
+    if args.framerate is None and args.tolerance is None:
+        parser.error("one of --framerate and --tolerance is needed")
+
+    try:
+        endianstring = "<"
+        anim_data = anim_zip.ReadBin(args.anim, "anim.bin")
+        animbin = anim_model.ReadAnimBin(endianstring, anim_data)
+        report = ReduceAnimBin(endianstring, animbin, args.framerate, args.tolerance, args.keep_length)
+
+        outfile = BytesIO()
+        anim_model.WriteAnimBin(endianstring, animbin, outfile)
+        anim_zip.WriteBin(args.output or args.anim, "anim.bin", outfile.getvalue())
+
+        for name, frames_num, new_frames_num, old_framerate, new_framerate, size, new_size in report:
+            sys.stdout.write("{}: {} -> {} frames at {:g} -> {:g} fps, {} -> {} bytes\n".format(
+                name, frames_num, new_frames_num, old_framerate, new_framerate, size, new_size))
+        sys.stdout.write("anim.bin: {} -> {} bytes\n".format(len(anim_data), len(outfile.getvalue())))
+
+    except:  # catch *all* exceptions
+        e = sys.exc_info()[1]
+        sys.stderr.write("Error Exporting {}\n".format(args.anim) + str(e) + "\n")
+        traceback.print_exc(file=sys.stderr)
+        exit(-1)
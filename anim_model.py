@@ -0,0 +1,444 @@
+import os
+import struct
+import sys
+from array import array
+
+from anim_errors import FormatError, ReadsInput
+from anim_hash import strhash
+
+ANIMVERSION = 4
+BUILDVERSION = 6
+
+INF = float("inf")
+
+# Compact in-memory model of anim.bin (ANIM 4) and build.bin (BILD 6), the formats are described in
+# anim_compiler.py and build_compiler.py.
+#
+# Records use __slots__ and the bulk data is kept in array.array columns: the elements of an anim as one
+# column per field for all its frames, the vertices of a build as one float32 array of x, y, z, u, v, w.
+# Floats stay float32 from load to save, so bin -> model -> bin is byte for byte the same and transforms
+# (renaming, re-timing, dropping frames or anims) run without going through XML.
+#
+# The hash tables are kept as lists of (hash, string) in file order, so they are written back unchanged.
+
+# Every element is a fixed 40 byte record, the field names match the attributes in anim.xml
+ELEMENT_FIELDS = ("name", "frame", "layername", "m_a", "m_b", "m_c", "m_d", "m_tx", "m_ty", "z")
+ELEMENT_FORMAT = "IIIfffffff"
+
+VERTEX_FIELDS = ("x", "y", "z", "u", "v", "w")
+
+
+def NeedSwap(endianstring):
+    # Arrays are in the byte order of this machine, True when endianstring asks for the other one
+    if endianstring == "<":
+        return sys.byteorder != "little"
+    if endianstring in (">", "!"):
+        return sys.byteorder != "big"
+    return False
+
+
+def ReadArray(typecode, data, swap):
+    column = array(typecode)
+    column.fromstring(data)
+    if swap:
+        column.byteswap()
+    return column
+
+
+def ArrayBytes(column, swap):
+    if swap:
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tostring()
+
+
+def Column(typecode, values=()):
+    # values as an array of typecode, arrays of the right type are used as they are
+    if isinstance(values, array) and values.typecode == typecode:
+        return values
+    if typecode != "f":
+        return array(typecode, values)
+
+    # array stores a float too large for float32 as inf where struct.pack raises, keep raising like it did
+    if not isinstance(values, (list, tuple, array)):
+        values = list(values)
+    column = array(typecode, values)
+    if INF in column or -INF in column:
+        for value, stored in zip(values, column):
+            if stored in (INF, -INF) and value not in (INF, -INF):
+                raise OverflowError("float too large to pack with f format")
+    return column
+
+
+def EmptyElements():
+    return dict((field, array(typecode)) for field, typecode in zip(ELEMENT_FIELDS, ELEMENT_FORMAT))
+
+
+class AnimFrame(object):
+    __slots__ = ("x", "y", "w", "h", "events", "num_elements")
+
+    def __init__(self, x, y, w, h, events=(), num_elements=0):
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.events = list(events)
+        self.num_elements = num_elements
+
+
+class Anim(object):
+    # elements maps each of ELEMENT_FIELDS to a column holding the elements of all frames in order, every
+    # frame knows how many of them are its own
+    __slots__ = ("name", "facing", "root", "framerate", "frames", "elements")
+
+    def __init__(self, name, facing, root, framerate, frames=None, elements=None):
+        self.name = name
+        self.facing = facing
+        self.root = root
+        self.framerate = framerate
+        self.frames = frames if frames is not None else []
+        self.elements = elements if elements is not None else EmptyElements()
+
+    def Rows(self):
+        # The elements of all frames as (name, frame, layername, m_a, m_b, m_c, m_d, m_tx, m_ty, z) tuples
+        return zip(*[Column(typecode, self.elements[field]).tolist()
+                     for field, typecode in zip(ELEMENT_FIELDS, ELEMENT_FORMAT)])
+
+    def FrameStarts(self):
+        # Index of the first element of every frame
+        starts = []
+        start = 0
+        for frame in self.frames:
+            starts.append(start)
+            start += frame.num_elements
+        return starts
+
+    def SelectFrames(self, frame_indices):
+        # Keeps the given frames, in the given order, together with their elements
+        starts = self.FrameStarts()
+        elements = EmptyElements()
+        for idx in frame_indices:
+            begin = starts[idx]
+            end = begin + self.frames[idx].num_elements
+            for field in ELEMENT_FIELDS:
+                elements[field].extend(self.elements[field][begin:end])
+        self.frames = [self.frames[idx] for idx in frame_indices]
+        self.elements = elements
+
+
+class AnimBin(object):
+    __slots__ = ("anims", "hashcollection")
+
+    def __init__(self, anims=None, hashcollection=None):
+        self.anims = anims if anims is not None else []
+        self.hashcollection = hashcollection if hashcollection is not None else []
+
+    def HashDict(self):
+        return dict(self.hashcollection)
+
+    def AddString(self, name):
+        # Hashes name and adds it to the hash table when it is not there yet
+        hash_idx = strhash(name, {})
+        if hash_idx not in self.HashDict():
+            self.hashcollection.append((hash_idx, name))
+        return hash_idx
+
+    def RenameSymbol(self, old, new):
+        # Points every element using symbol old to symbol new, the old string stays in the hash table
+        old_hash = strhash(old, {})
+        new_hash = self.AddString(new)
+        for anim in self.anims:
+            column = anim.elements["name"]
+            for i, hash_idx in enumerate(column):
+                if hash_idx == old_hash:
+                    column[i] = new_hash
+
+    def TrimHashCollection(self):
+        # Drops the strings no anim refers to any more
+        used = set()
+        for anim in self.anims:
+            used.add(anim.root)
+            for frame in anim.frames:
+                used.update(frame.events)
+            used.update(anim.elements["name"])
+            used.update(anim.elements["layername"])
+        self.hashcollection = [(hash_idx, name) for hash_idx, name in self.hashcollection if hash_idx in used]
+
+
+@ReadsInput("anim.bin")
+def ReadAnimFrames(endianstring, data, offset):
+    # Decodes the anim starting at offset up to its element records, returns the Anim without elements, the
+    # (offset, count) of the element records of every frame that has some and the offset right after the anim
+    anim_name_len = struct.unpack_from(endianstring + "i", data, offset)[0]
+    offset += 4
+    anim_name = struct.unpack_from(endianstring + str(anim_name_len) + "s", data, offset)[0]
+    offset += anim_name_len
+
+    facingbyte, root, frame_rate, frames_num = struct.unpack_from(endianstring + "BIfI", data, offset)
+    offset += 13
+
+    frames = []
+    blocks = []
+    for _ in range(frames_num):
+        x, y, w, h, frame_event_len = struct.unpack_from(endianstring + "ffffI", data, offset)
+        offset += 20
+        events = struct.unpack_from(endianstring + str(frame_event_len) + "I", data, offset)
+        offset += 4 * frame_event_len
+        element_num = struct.unpack_from(endianstring + "I", data, offset)[0]
+        offset += 4
+        if offset + 40 * element_num > len(data):
+            raise FormatError("anim.bin ends inside the elements of anim " + anim_name)
+        frames.append(AnimFrame(x, y, w, h, events, element_num))
+        if element_num:
+            blocks.append((offset, element_num))
+        offset += 40 * element_num
+
+    return Anim(anim_name, facingbyte, root, frame_rate, frames), blocks, offset
+
+
+def ReadAnim(endianstring, data, offset):
+    # Decodes the anim starting at offset, returns it and the offset right after it
+    anim, blocks, offset = ReadAnimFrames(endianstring, data, offset)
+
+    # The records are read as words twice, once as ints and once as floats, and split into columns
+    raw = b"".join(data[start:start + 40 * count] for start, count in blocks)
+    swap = NeedSwap(endianstring)
+    words = {"I": ReadArray("I", raw, swap), "f": ReadArray("f", raw, swap)}
+    anim.elements = dict((field, words[typecode][i::len(ELEMENT_FIELDS)])
+                         for i, (field, typecode) in enumerate(zip(ELEMENT_FIELDS, ELEMENT_FORMAT)))
+    return anim, offset
+
+
+@ReadsInput(".bin")
+def ReadHashCollection(endianstring, data, offset):
+    # Returns the (hash, string) pairs in file order and the offset right after them
+    pairs = []
+    hash_list = struct.unpack_from(endianstring + 'I', data, offset)[0]
+    offset += 4
+    for _ in range(hash_list):
+        hash_idx, name_len = struct.unpack_from(endianstring + 'Ii', data, offset)
+        offset += 8
+        pairs.append((hash_idx, struct.unpack_from(endianstring + str(name_len) + 's', data, offset)[0]))
+        offset += name_len
+    return pairs, offset
+
+
+@ReadsInput("anim.bin")
+def ReadAnimBin(endianstring, data):
+    if data[0:4] != b"ANIM" or struct.unpack_from(endianstring + 'i', data, 4)[0] != ANIMVERSION:
+        raise FormatError("Input file not match ANIMVERSION_" + str(ANIMVERSION))
+
+    anims = []
+    anim_len = struct.unpack_from(endianstring + 'I', data, 20)[0]
+    offset = 24
+    for _ in range(anim_len):
+        anim, offset = ReadAnim(endianstring, data, offset)
+        anims.append(anim)
+    hashcollection = ReadHashCollection(endianstring, data, offset)[0]
+    return AnimBin(anims, hashcollection)
+
+
+def WriteAnim(endianstring, anim, outfile):
+    elements = anim.elements
+    num_elements = len(elements["name"])
+
+    # Interleaves the columns into 40 byte records, float columns go in by their bits
+    words = array("I", [0]) * (num_elements * len(ELEMENT_FIELDS))
+    for i, (field, typecode) in enumerate(zip(ELEMENT_FIELDS, ELEMENT_FORMAT)):
+        column = Column(typecode, elements[field])
+        if typecode == "f":
+            column = ReadArray("I", column.tostring(), False)
+        words[i::len(ELEMENT_FIELDS)] = column
+    raw = ArrayBytes(words, NeedSwap(endianstring))
+
+    name = anim.name
+    outfile.write(struct.pack(endianstring + 'i' + str(len(name)) + 's', len(name), name))
+    outfile.write(struct.pack(endianstring + 'BIfI', anim.facing, anim.root, anim.framerate, len(anim.frames)))
+    start = 0
+    for frame in anim.frames:
+        outfile.write(struct.pack(endianstring + 'ffffI', frame.x, frame.y, frame.w, frame.h, len(frame.events)))
+        outfile.write(struct.pack(endianstring + str(len(frame.events)) + 'I', *frame.events))
+        outfile.write(struct.pack(endianstring + 'I', frame.num_elements))
+        outfile.write(raw[start:start + 40 * frame.num_elements])
+        start += 40 * frame.num_elements
+
+
+def WriteHashCollection(endianstring, pairs, outfile):
+    outfile.write(struct.pack(endianstring + 'I', len(pairs)))
+    for hash_idx, name in pairs:
+        outfile.write(struct.pack(endianstring + 'I', hash_idx))
+        outfile.write(struct.pack(endianstring + 'i' + str(len(name)) + 's', len(name), name))
+
+
+def WriteAnimBin(endianstring, animbin, outfile):
+    anims = animbin.anims
+    outfile.write(struct.pack(endianstring + 'cccci', 'A', 'N', 'I', 'M', ANIMVERSION))
+    outfile.write(
+        struct.pack(endianstring + 'IIII', sum(len(anim.elements["name"]) for anim in anims),
+                    sum(len(anim.frames) for anim in anims),
+                    sum(len(frame.events) for anim in anims for frame in anim.frames), len(anims)))
+    for anim in anims:
+        WriteAnim(endianstring, anim, outfile)
+    WriteHashCollection(endianstring, animbin.hashcollection, outfile)
+
+
+class BuildFrame(object):
+    __slots__ = ("framenum", "duration", "x", "y", "w", "h", "alphaidx", "alphacount")
+
+    def __init__(self, framenum, duration, x, y, w, h, alphaidx, alphacount):
+        self.framenum = framenum
+        self.duration = duration
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.alphaidx = alphaidx
+        self.alphacount = alphacount
+
+
+class BuildSymbol(object):
+    __slots__ = ("hash", "frames")
+
+    def __init__(self, hash, frames=None):
+        self.hash = hash
+        self.frames = frames if frames is not None else []
+
+
+class Build(object):
+    # verts holds x, y, z, u, v, w of every vertex in a float32 array. hashcollection is None when the
+    # build.bin has no hash table, which is what the compiler writes when every symbol has a namehash.
+    __slots__ = ("name", "textures", "symbols", "verts", "hashcollection")
+
+    def __init__(self, name, textures=None, symbols=None, verts=None, hashcollection=None):
+        self.name = name
+        self.textures = textures if textures is not None else []
+        self.symbols = symbols if symbols is not None else []
+        self.verts = Column("f", verts if verts is not None else ())
+        self.hashcollection = hashcollection
+
+    def HashDict(self):
+        return dict(self.hashcollection or ())
+
+    def SymbolName(self, symbol):
+        return self.HashDict().get(symbol.hash)
+
+    def RenameSymbol(self, old, new):
+        # Renames symbol old, its entry in the hash table is replaced
+        old_hash = strhash(old, {})
+        new_hash = strhash(new, {})
+        for symbol in self.symbols:
+            if symbol.hash == old_hash:
+                symbol.hash = new_hash
+        pairs = [(hash_idx, name) for hash_idx, name in self.hashcollection or () if hash_idx != old_hash]
+        self.hashcollection = pairs + [(new_hash, new)]
+
+
+@ReadsInput("build.bin")
+def ReadBuildBin(endianstring, data):
+    if data[0:4] != b"BILD" or struct.unpack_from(endianstring + 'i', data, 4)[0] != BUILDVERSION:
+        raise FormatError("Input file not match BUILDVERSION_" + str(BUILDVERSION))
+
+    symbol_len = struct.unpack_from(endianstring + 'I', data, 8)[0]
+    offset = 16
+    build_name_len = struct.unpack_from(endianstring + "i", data, offset)[0]
+    offset += 4
+    build_name = struct.unpack_from(endianstring + str(build_name_len) + 's', data, offset)[0]
+    offset += build_name_len
+
+    textures = []
+    atlases_len = struct.unpack_from(endianstring + 'I', data, offset)[0]
+    offset += 4
+    for _ in range(atlases_len):
+        namelen = struct.unpack_from(endianstring + "i", data, offset)[0]
+        offset += 4
+        textures.append(struct.unpack_from(endianstring + str(namelen) + 's', data, offset)[0])
+        offset += namelen
+
+    symbols = []
+    for _ in range(symbol_len):
+        symbol_hash, frame_len = struct.unpack_from(endianstring + 'II', data, offset)
+        offset += 8
+        frames = []
+        for _ in range(frame_len):
+            frames.append(BuildFrame(*struct.unpack_from(endianstring + 'IIffffII', data, offset)))
+            offset += 32
+        symbols.append(BuildSymbol(symbol_hash, frames))
+
+    alphavertslen = struct.unpack_from(endianstring + 'I', data, offset)[0]
+    offset += 4
+    verts = ReadArray("f", data[offset:offset + 24 * alphavertslen], NeedSwap(endianstring))
+    if len(verts) != 6 * alphavertslen:
+        raise FormatError("build.bin ends inside its vertices")
+    offset += 24 * alphavertslen
+
+    # The hash table is only there when some symbol was hashed by name, a broken one is dropped the same way
+    # the decompiler always ignored it
+    hashcollection = None
+    if len(data) >= offset + 4:
+        try:
+            hashcollection = ReadHashCollection(endianstring, data, offset)[0]
+        except FormatError:
+            pass
+    return Build(build_name, textures, symbols, verts, hashcollection)
+
+
+def WriteBuildBin(endianstring, build, outfile):
+    outfile.write(struct.pack(endianstring + 'cccci', 'B', 'I', 'L', 'D', BUILDVERSION))
+    outfile.write(struct.pack(endianstring + 'II', len(build.symbols),
+                              sum(len(symbol.frames) for symbol in build.symbols)))
+    outfile.write(struct.pack(endianstring + 'i' + str(len(build.name)) + 's', len(build.name), build.name))
+
+    outfile.write(struct.pack(endianstring + 'I', len(build.textures)))
+    for tex_name in build.textures:
+        outfile.write(struct.pack(endianstring + 'i' + str(len(tex_name)) + 's', len(tex_name), tex_name))
+
+    for symbol in build.symbols:
+        outfile.write(struct.pack(endianstring + 'II', symbol.hash, len(symbol.frames)))
+        for frame in symbol.frames:
+            outfile.write(
+                struct.pack(endianstring + 'IIffffII', frame.framenum, frame.duration, frame.x, frame.y, frame.w,
+                            frame.h, frame.alphaidx, frame.alphacount))
+
+    verts = Column("f", build.verts)
+    outfile.write(struct.pack(endianstring + 'I', len(verts) // len(VERTEX_FIELDS)))
+    outfile.write(ArrayBytes(verts, NeedSwap(endianstring)))
+
+    if build.hashcollection is not None:
+        WriteHashCollection(endianstring, build.hashcollection, outfile)
+
+
+def _ReadFile(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _WriteFile(path, write):
+    # Written under a temporary name first so a failed save never leaves half a file behind
+    tmppath = path + ".tmp"
+    try:
+        with open(tmppath, "wb") as f:
+            write(f)
+    except:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmppath, path)
+
+
+def LoadAnimBin(endianstring, path):
+    return ReadAnimBin(endianstring, _ReadFile(path))
+
+
+def SaveAnimBin(endianstring, animbin, path):
+    _WriteFile(path, lambda f: WriteAnimBin(endianstring, animbin, f))
+
+
+def LoadBuildBin(endianstring, path):
+    return ReadBuildBin(endianstring, _ReadFile(path))
+
+
+def SaveBuildBin(endianstring, build, path):
+    _WriteFile(path, lambda f: WriteBuildBin(endianstring, build, f))
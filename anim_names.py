@@ -0,0 +1,213 @@
+import argparse
+import os
+import sqlite3
+import sys
+import traceback
+
+import anim_model
+import anim_zip
+
+# Persistent reverse hash dictionary, maps strhash values back to the strings they were made from.
+#
+# The hash tables of anim.bin/build.bin only hold the strings of that file, and some files have them
+# stripped. The dictionary collects the strings of every file decompiled with it, plus word lists, in an
+# sqlite database, so a hash missing from one file can be resolved from the others.
+#
+# strhash ignores case, a string is stored once per hash with the spelling it was first seen with. Two
+# different strings with the same hash are a collision, both are kept and Lookup returns the first one.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS names (
+    hash INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (hash, key)
+)
+"""
+
+
+class NameDictionary(object):
+    def __init__(self, path):
+        # Waits for other processes writing to the same database instead of failing
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.text_factory = str
+        self.db.execute(SCHEMA)
+        self.db.commit()
+
+    def Close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.Close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM names").fetchone()[0]
+
+    def Lookup(self, hash_idx):
+        # The first string added for hash_idx, None when there is none
+        row = self.db.execute("SELECT name FROM names WHERE hash = ? ORDER BY rowid LIMIT 1", (hash_idx,)).fetchone()
+        return row[0] if row else None
+
+    def Names(self, hash_idx):
+        return [row[0] for row in self.db.execute("SELECT name FROM names WHERE hash = ? ORDER BY rowid",
+                                                  (hash_idx,))]
+
+    def Add(self, names):
+        # Adds the strings in names, returns the number added and the (hash, string) of every one added
+        # to a hash that already had a different string
+        added = 0
+        collisions = []
+        cursor = self.db.cursor()
+        for name in names:
+            if not name:
+                continue
+            hash_idx = anim_model.strhash(name, {})
+            key = name.lower()
+            cursor.execute("SELECT key FROM names WHERE hash = ?", (hash_idx,))
+            keys = [row[0] for row in cursor.fetchall()]
+            if key in keys:
+                continue
+            cursor.execute("INSERT INTO names (hash, key, name) VALUES (?, ?, ?)", (hash_idx, key, name))
+            added += 1
+            if keys:
+                collisions.append((hash_idx, name))
+        self.db.commit()
+        return added, collisions
+
+    def AddHashCollection(self, pairs):
+        # Adds the strings of the (hash, string) pairs of a hash table, a pair whose string does not hash
+        # to it is skipped
+        return self.Add(name for hash_idx, name in pairs if name and anim_model.strhash(name, {}) == hash_idx)
+
+    def Collisions(self):
+        # (hash, [strings]) of every hash with more than one string
+        collisions = []
+        rows = self.db.execute("SELECT hash, name FROM names WHERE hash IN "
+                               "(SELECT hash FROM names GROUP BY hash HAVING COUNT(*) > 1) ORDER BY hash, rowid")
+        for hash_idx, name in rows:
+            if not collisions or collisions[-1][0] != hash_idx:
+                collisions.append((hash_idx, []))
+            collisions[-1][1].append(name)
+        return collisions
+
+
+class ResolvingDict(dict):
+    # A hash -> string dict, usually the hash table of one file, that looks up the hashes missing from it
+    # in a NameDictionary. convert is applied to the strings found there (escaping for XML).
+    def __init__(self, pairs, names, convert=None):
+        dict.__init__(self, pairs)
+        self.names = names
+        self.convert = convert
+        self.unknown = set()
+
+    def __missing__(self, hash_idx):
+        name = None
+        if hash_idx not in self.unknown:
+            name = self.names.Lookup(hash_idx)
+        if name is None:
+            self.unknown.add(hash_idx)
+            raise KeyError(hash_idx)
+        if self.convert is not None:
+            name = self.convert(name)
+        self[hash_idx] = name
+        return name
+
+    def __contains__(self, hash_idx):
+        try:
+            self[hash_idx]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, hash_idx, default=None):
+        try:
+            return self[hash_idx]
+        except KeyError:
+            return default
+
+
+def FileNames(path):
+    # The strings found in path: the hash tables of an anim.bin, build.bin or the ones inside an anim.zip,
+    # otherwise a word list with one string per line
+    endianstring = "<"
+    if anim_zip.IsAnimZip(path):
+        names = []
+        entries = anim_zip.ZipEntries(path)
+        if "anim.bin" in entries:
+            names.extend(name for _, name in
+                         anim_model.ReadAnimBin(endianstring, anim_zip.ReadZipEntry(path, "anim.bin")).hashcollection)
+        if "build.bin" in entries:
+            hashcollection = anim_model.ReadBuildBin(endianstring,
+                                                     anim_zip.ReadZipEntry(path, "build.bin")).hashcollection
+            names.extend(name for _, name in hashcollection or ())
+        return names
+
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[0:4] == b"ANIM":
+        return [name for _, name in anim_model.ReadAnimBin(endianstring, data).hashcollection]
+    if data[0:4] == b"BILD":
+        return [name for _, name in anim_model.ReadBuildBin(endianstring, data).hashcollection or ()]
+    return [line.strip() for line in data.splitlines()]
+
+
+def ImportPaths(names, paths, report=sys.stdout):
+    # Adds the strings of every file in paths to the NameDictionary names, folders are searched for
+    # anim.bin, build.bin, anim.zip and .txt word lists
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, filenames in sorted(os.walk(path)):
+                for filename in sorted(filenames):
+                    if filename in ("anim.bin", "build.bin") or filename.endswith((".zip", ".txt")):
+                        files.append(os.path.join(folder, filename))
+        else:
+            files.append(path)
+
+    added = 0
+    collisions = []
+    for path in files:
+        try:
+            num, found = names.Add(FileNames(path))
+        except Exception:
+            report.write("FAIL {} {}\n".format(path, sys.exc_info()[1]))
+            continue
+        added += num
+        collisions.extend(found)
+    report.write("{} strings added from {} files, {} strings in the dictionary\n".format(added, len(files),
+                                                                                        len(names)))
+    for hash_idx, name in collisions:
+        report.write("Collision {}: {}\n".format(hash_idx, ", ".join(names.Names(hash_idx))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the reverse hash dictionary used by the decompilers.")
+    parser.add_argument("database", help="sqlite database of the dictionary, created when missing")
+    subparsers = parser.add_subparsers(dest="command")
+    import_parser = subparsers.add_parser("import", help="add the strings of anim.bin, build.bin, anim.zip files "
+                                          "and word lists (one string per line), folders are searched")
+    import_parser.add_argument("paths", nargs="+")
+    lookup_parser = subparsers.add_parser("lookup", help="print the strings of hashes")
+    lookup_parser.add_argument("hashes", nargs="+", type=int)
+    subparsers.add_parser("collisions", help="print every hash with more than one string")
+    args = parser.parse_args()
+
+    try:
+        with NameDictionary(args.database) as names:
+            if args.command == "import":
+                ImportPaths(names, args.paths)
+            elif args.command == "lookup":
+                for hash_idx in args.hashes:
+                    sys.stdout.write("{}: {}\n".format(hash_idx, ", ".join(names.Names(hash_idx))))
+            else:
+                for hash_idx, strings in names.Collisions():
+                    sys.stdout.write("{}: {}\n".format(hash_idx, ", ".join(strings)))
+
+    except:  # catch *all* exceptions
+        e = sys.exc_info()[1]
+        sys.stderr.write("Error Exporting {}\n".format(args.database) + str(e) + "\n")
+        traceback.print_exc(file=sys.stderr)
+        exit(-1)
@@ -0,0 +1,329 @@
+import argparse
+import bisect
+import math
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import anim_decompiler
+import anim_model
+import anim_zip
+import ktex
+
+# Renders frames of anim.bin with the symbols of build.bin and the atlas textures, without a GPU.
+#
+# Every element of a frame shows the build frame of its symbol that is current at its frame number (the
+# last one starting at or before it). The vertices of that build frame, quads of 6 vertices, are moved by
+# the element matrix (x' = a * x + c * y + tx, y' = b * x + d * y + ty, y pointing down) and filled with the
+# texture of their atlas, sampled at the affinely mapped u, v of every pixel. The elements are blended
+# back to front, the first element of a frame is the front most one.
+#
+# Textures are premultiplied, so blending is "over" with premultiplied colors and the finished image is
+# divided by alpha again.
+
+SHEET_CELL = 128
+SHEET_COLUMNS = 8
+SHEET_ROWS = 8
+MAX_SIZE = 4096
+
+
+def AnimName(anim):
+    # The name of an anim as it appears in anim.xml, with the facing suffix
+    return anim.name + anim_decompiler.dir.get(anim.facing, "")
+
+
+class Renderer(object):
+    # Holds an anim_model.Build and its textures, decoded by ktex.ReadKtex, as {texture filename: pixels}
+    def __init__(self, build, textures):
+        self.symbols = {}
+        for symbol in build.symbols:
+            self.symbols[symbol.hash] = ([frame.framenum for frame in symbol.frames], symbol.frames)
+        self.verts = numpy.frombuffer(anim_model.ArrayBytes(build.verts, False), numpy.float32).reshape(-1, 6)
+        self.textures = {}
+        for name, pixels in textures.items():
+            self.textures[name] = pixels.astype(numpy.float32) / 255.0
+
+    def FrameQuads(self, anim, frame_idx):
+        # The vertices of every element of a frame after its matrix, back to front, as (x, y, u, v, atlas)
+        # arrays of 6 vertices per quad
+        start = sum(frame.num_elements for frame in anim.frames[:frame_idx])
+        end = start + anim.frames[frame_idx].num_elements
+        rows = zip(*[anim.elements[field][start:end] for field in anim_model.ELEMENT_FIELDS])
+        quads = []
+        for name, frameint, _, m_a, m_b, m_c, m_d, m_tx, m_ty, _ in reversed(rows):
+            if name not in self.symbols:
+                continue
+            framenums, frames = self.symbols[name]
+            if not frames:
+                continue
+            frame = frames[max(bisect.bisect_right(framenums, frameint) - 1, 0)]
+            verts = self.verts[frame.alphaidx:frame.alphaidx + frame.alphacount // 6 * 6]
+            if not len(verts):
+                continue
+            x = m_a * verts[:, 0] + m_c * verts[:, 1] + m_tx
+            y = m_b * verts[:, 0] + m_d * verts[:, 1] + m_ty
+            quads.append(numpy.stack((x, y, verts[:, 3], verts[:, 4], verts[:, 5]), axis=-1).reshape(-1, 6, 5))
+        if not quads:
+            return numpy.zeros((0, 6, 5), numpy.float32)
+        return numpy.concatenate(quads)
+
+    def Bounds(self, anim, frame_indices=None):
+        # (left, top, right, bottom) covering the given frames, all of them by default
+        if frame_indices is None:
+            frame_indices = range(len(anim.frames))
+        bounds = None
+        for frame_idx in frame_indices:
+            quads = self.FrameQuads(anim, frame_idx)
+            if not len(quads):
+                continue
+            frame_bounds = (quads[:, :, 0].min(), quads[:, :, 1].min(), quads[:, :, 0].max(), quads[:, :, 1].max())
+            if bounds is None:
+                bounds = frame_bounds
+            else:
+                bounds = (min(bounds[0], frame_bounds[0]), min(bounds[1], frame_bounds[1]),
+                          max(bounds[2], frame_bounds[2]), max(bounds[3], frame_bounds[3]))
+        return bounds or (0.0, 0.0, 1.0, 1.0)
+
+    def RenderFrame(self, anim, frame_idx, bounds=None, scale=1.0):
+        # (height, width, 4) uint8 rgba of a frame, bounds is the part of the anim space drawn
+        left, top, right, bottom = bounds or self.Bounds(anim, [frame_idx])
+        width = min(max(int(math.ceil((right - left) * scale)), 1), MAX_SIZE)
+        height = min(max(int(math.ceil((bottom - top) * scale)), 1), MAX_SIZE)
+        canvas = numpy.zeros((height, width, 4), numpy.float32)
+        for quad in self.FrameQuads(anim, frame_idx):
+            texture = self.textures.get("atlas-" + str(int(quad[5, 4])) + ".tex")
+            if texture is None:
+                continue
+            points = quad.copy()
+            points[:, 0] = (points[:, 0] - left) * scale
+            points[:, 1] = (points[:, 1] - top) * scale
+            DrawQuad(canvas, points, texture)
+        return Straighten(canvas)
+
+
+def DrawQuad(canvas, points, texture):
+    # Blends the two triangles of a quad onto canvas, points are its 6 vertices as (x, y, u, v, atlas) in
+    # pixels of canvas
+    height, width = canvas.shape[:2]
+    x0 = max(int(math.floor(points[:, 0].min())), 0)
+    x1 = min(int(math.ceil(points[:, 0].max())), width)
+    y0 = max(int(math.floor(points[:, 1].min())), 0)
+    y1 = min(int(math.ceil(points[:, 1].max())), height)
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    # Pixel centers of the bounding box
+    px, py = numpy.meshgrid(numpy.arange(x0, x1) + 0.5, numpy.arange(y0, y1) + 0.5)
+    covered = numpy.zeros(px.shape, bool)
+    u = numpy.zeros(px.shape, numpy.float32)
+    v = numpy.zeros(px.shape, numpy.float32)
+    for p0, p1, p2 in (points[0:3], points[3:6]):
+        den = (p1[1] - p2[1]) * (p0[0] - p2[0]) + (p2[0] - p1[0]) * (p0[1] - p2[1])
+        if abs(den) < 1e-12:
+            continue
+        l0 = ((p1[1] - p2[1]) * (px - p2[0]) + (p2[0] - p1[0]) * (py - p2[1])) / den
+        l1 = ((p2[1] - p0[1]) * (px - p2[0]) + (p0[0] - p2[0]) * (py - p2[1])) / den
+        l2 = 1 - l0 - l1
+        # A pixel on the diagonal both triangles share is drawn once
+        inside = (l0 >= -1e-6) & (l1 >= -1e-6) & (l2 >= -1e-6) & ~covered
+        u[inside] = (l0 * p0[2] + l1 * p1[2] + l2 * p2[2])[inside]
+        v[inside] = (l0 * p0[3] + l1 * p1[3] + l2 * p2[3])[inside]
+        covered |= inside
+    if not covered.any():
+        return
+
+    # v counts from the bottom of the texture, which is stored top row first
+    tex_h, tex_w = texture.shape[:2]
+    tx = numpy.clip((u[covered] * tex_w).astype(numpy.int32), 0, tex_w - 1)
+    ty = numpy.clip(((1 - v[covered]) * tex_h).astype(numpy.int32), 0, tex_h - 1)
+    src = texture[ty, tx]
+    region = canvas[y0:y1, x0:x1]
+    region[covered] = src + region[covered] * (1 - src[:, 3:4])
+
+
+def Straighten(canvas):
+    # Premultiplied float canvas -> straight alpha uint8
+    alpha = canvas[:, :, 3:4]
+    rgb = numpy.where(alpha > 0, canvas[:, :, :3] / numpy.maximum(alpha, 1e-6), 0)
+    pixels = numpy.empty(canvas.shape, numpy.uint8)
+    pixels[:, :, :3] = numpy.clip(rgb * 255 + 0.5, 0, 255)
+    pixels[:, :, 3] = numpy.clip(alpha[:, :, 0] * 255 + 0.5, 0, 255)
+    return pixels
+
+
+def FitCell(pixels, size):
+    # pixels scaled down (nearest) to fit a size x size cell, centered on it
+    height, width = pixels.shape[:2]
+    factor = min(float(size) / width, float(size) / height, 1.0)
+    new_w = max(int(width * factor), 1)
+    new_h = max(int(height * factor), 1)
+    rows = (numpy.arange(new_h) / factor).astype(numpy.int32).clip(0, height - 1)
+    columns = (numpy.arange(new_w) / factor).astype(numpy.int32).clip(0, width - 1)
+    cell = numpy.zeros((size, size, 4), numpy.uint8)
+    top = (size - new_h) // 2
+    left = (size - new_w) // 2
+    cell[top:top + new_h, left:left + new_w] = pixels[rows[:, None], columns]
+    return cell
+
+
+def ContactSheet(images, columns, size):
+    # The images in a grid of size x size cells, columns wide
+    rows = max(int(math.ceil(len(images) / float(columns))), 1)
+    sheet = numpy.zeros((rows * size, columns * size, 4), numpy.uint8)
+    for i, pixels in enumerate(images):
+        row, column = divmod(i, columns)
+        sheet[row * size:(row + 1) * size, column * size:(column + 1) * size] = FitCell(pixels, size)
+    return sheet
+
+
+def LoadWorkspace(source):
+    # (anim_model.AnimBin, Renderer) of a workspace folder or anim.zip
+    def Read(name):
+        return anim_zip.ReadBin(source if anim_zip.IsAnimZip(source) else os.path.join(source, name), name)
+
+    animbin = anim_model.ReadAnimBin("<", Read("anim.bin"))
+    build = anim_model.ReadBuildBin("<", Read("build.bin"))
+    textures = dict((name, ktex.ReadKtex(Read(name))) for name in build.textures)
+    return animbin, Renderer(build, textures)
+
+
+def FindAnim(animbin, name):
+    # An anim by its name as in anim.xml ("idle_down"), or by its name without the facing (the first facing)
+    for anim in animbin.anims:
+        if AnimName(anim) == name:
+            return anim
+    for anim in animbin.anims:
+        if anim.name == name:
+            return anim
+    raise KeyError(name)
+
+
+_workspaces = {}
+
+
+def RenderSheet(args):
+    # Runs in a worker process, renders one contact sheet page. Every worker loads a workspace once.
+    source, anim_indices, frame, outpath, columns, size = args
+    start = time.time()
+    try:
+        if source not in _workspaces:
+            _workspaces.clear()
+            _workspaces[source] = LoadWorkspace(source)
+        animbin, renderer = _workspaces[source]
+        images = []
+        for idx in anim_indices:
+            anim = animbin.anims[idx]
+            frame_idx = min(frame, len(anim.frames) - 1) if frame >= 0 else len(anim.frames) // 2
+            if not anim.frames:
+                images.append(numpy.zeros((1, 1, 4), numpy.uint8))
+                continue
+            bounds = renderer.Bounds(anim, [frame_idx])
+            scale = min(float(size) / max(bounds[2] - bounds[0], bounds[3] - bounds[1], 1e-6), 1.0)
+            images.append(renderer.RenderFrame(anim, frame_idx, bounds, scale))
+        with open(outpath, "wb") as f:
+            ktex.WritePng(f, ContactSheet(images, columns, size))
+    except Exception:
+        return outpath, 0, traceback.format_exc(), time.time() - start
+    return outpath, len(anim_indices), None, time.time() - start
+
+
+def SheetTasks(sources, output, frame, columns, rows, size):
+    # One task per page of columns x rows anims of every workspace
+    tasks = []
+    bases = set()
+    for source in sources:
+        data = anim_zip.ReadBin(source if anim_zip.IsAnimZip(source) else os.path.join(source, "anim.bin"),
+                                "anim.bin")
+        anims_num = len(anim_model.ReadAnimBin("<", data).anims)
+        base = os.path.basename(os.path.abspath(anim_zip.ZipWorkspace(source)))
+        while base in bases:
+            base += "_"
+        bases.add(base)
+        per_page = columns * rows
+        for page, first in enumerate(range(0, anims_num, per_page)):
+            outpath = os.path.join(output, "{}_{}.png".format(base, page))
+            tasks.append((source, list(range(first, min(first + per_page, anims_num))), frame, outpath, columns, size))
+    return tasks
+
+
+def RenderSheets(tasks, jobs, report=sys.stdout):
+    # Runs the tasks of SheetTasks, returns the number of failed ones
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.imap_unordered(RenderSheet, tasks)
+    else:
+        pool = None
+        results = (RenderSheet(task) for task in tasks)
+
+    failed = 0
+    for outpath, num, error, elapsed in results:
+        if error is None:
+            report.write("OK   {} ({} anims) {:.2f}s\n".format(outpath, num, elapsed))
+        else:
+            failed += 1
+            report.write("FAIL {} {}\n".format(outpath, error))
+        report.flush()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render anim frames of a workspace to PNG.")
+    parser.add_argument("workspaces", nargs="+", help="workspace folders or anim.zip files with anim.bin, build.bin "
+                        "and their atlas-*.tex")
+    parser.add_argument("--anim", help="anim to render, as named in anim.xml (\"idle_down\")")
+    parser.add_argument("--frame", type=int, default=0, help="frame to render (default: 0)")
+    parser.add_argument("--scale", type=float, default=1.0, help="pixels per unit (default: 1)")
+    parser.add_argument("--output", "-o", help="PNG file of --anim, or the folder of the contact sheets")
+    parser.add_argument("--sheets", action="store_true",
+                        help="render contact sheets of every anim of the workspaces, frame -1 is the middle one")
+    parser.add_argument("--columns", type=int, default=SHEET_COLUMNS)
+    parser.add_argument("--rows", type=int, default=SHEET_ROWS, help="rows per sheet, more anims go to more sheets")
+    parser.add_argument("--cell", type=int, default=SHEET_CELL, help="size of a contact sheet cell in pixels")
+    parser.add_argument("--jobs", "-j", type=int, default=multiprocessing.cpu_count(),
+                        help="number of worker processes for --sheets (default: number of cpus)")
+    args = parser.parse_args()
+    if not args.sheets and (args.anim is None or len(args.workspaces) != 1):
+        parser.error("either --sheets, or --anim with a single workspace is needed")
+
+    if numpy is None:
+        sys.stderr.write("Error: numpy is needed to render anims\n")
+        exit(-1)
+
+    try:
+        if args.sheets:
+            output = args.output or "."
+            if not os.path.isdir(output):
+                os.makedirs(output)
+            tasks = SheetTasks(args.workspaces, output, args.frame, args.columns, args.rows, args.cell)
+        else:
+            animbin, renderer = LoadWorkspace(args.workspaces[0])
+            anim = FindAnim(animbin, args.anim)
+            if not 0 <= args.frame < len(anim.frames):
+                raise IndexError("{} has {} frames".format(AnimName(anim), len(anim.frames)))
+            pixels = renderer.RenderFrame(anim, args.frame, renderer.Bounds(anim), args.scale)
+            outpath = args.output or "{}_{}.png".format(AnimName(anim), args.frame)
+            with open(outpath, "wb") as f:
+                ktex.WritePng(f, pixels)
+
+    except:  # catch *all* exceptions
+        e = sys.exc_info()[1]
+        sys.stderr.write("Error Exporting {}\n".format(" ".join(args.workspaces)) + str(e) + "\n")
+        traceback.print_exc(file=sys.stderr)
+        exit(-1)
+
+    if args.sheets:
+        start = time.time()
+        failed = RenderSheets(tasks, max(1, args.jobs))
+        sys.stdout.write("{} sheets, {} failed in {:.2f}s\n".format(len(tasks), failed, time.time() - start))
+        if failed:
+            exit(-1)
@@ -0,0 +1,138 @@
+import json
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Opt-in instrumentation shared by the compilers and decompilers.
+#
+# A Stats object passed to one of the *Stream, *Data or file level functions collects the wall time of every
+# phase of the run, record counts and bytes in and out. Nothing is recorded when no Stats is passed and no
+# hook is registered, so the tools pay nothing for it by default.
+#
+# A host process can register a hook with AddHook, every run then collects its own Stats and the hook is
+# called with its report (the dict returned by Stats.Report) when the run finishes. Runs nest: the file level
+# functions record phases of their own around the *Stream functions they call, the hooks are only called
+# when the outermost run finishes, so their report has the same phases as the --stats json.
+
+_hooks = []
+
+
+def AddHook(callback):
+    _hooks.append(callback)
+
+
+def RemoveHook(callback):
+    if callback in _hooks:
+        _hooks.remove(callback)
+
+
+def PeakMemory():
+    # Peak resident set size of this process in KB, None where the resource module is missing (Windows)
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Stats(object):
+    def __init__(self, tool=None):
+        self.tool = tool
+        self.start = time.time()
+        self.phases = OrderedDict()
+        self.counts = OrderedDict()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.depth = 0  # runs started and not finished yet
+
+    @contextmanager
+    def Phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.AddTime(name, time.time() - start)
+
+    def AddTime(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def Count(self, name, num=1):
+        self.counts[name] = self.counts.get(name, 0) + num
+
+    def AddBytes(self, bytes_in=0, bytes_out=0):
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+
+    def Report(self):
+        return OrderedDict([
+            ("tool", self.tool),
+            ("seconds", time.time() - self.start),
+            ("phases", self.phases),
+            ("counts", self.counts),
+            ("bytes_in", self.bytes_in),
+            ("bytes_out", self.bytes_out),
+            ("peak_rss_kb", PeakMemory()),
+        ])
+
+
+def Start(tool, stats):
+    # The Stats a run records into: the one passed by the caller, a new one when a hook wants the report,
+    # otherwise None
+    if stats is None and _hooks:
+        stats = Stats(tool)
+    if stats is not None:
+        if stats.tool is None:
+            stats.tool = tool
+        stats.depth += 1
+    return stats
+
+
+def Finish(stats):
+    # Calls the hooks when the outermost run of stats finishes
+    if stats is None:
+        return
+    stats.depth -= 1
+    if stats.depth > 0 or not _hooks:
+        return
+    report = stats.Report()
+    for callback in list(_hooks):
+        callback(report)
+
+
+@contextmanager
+def Run(tool, stats):
+    # Start and Finish around the body, for entry points with phases of their own around the functions they
+    # call. A run that fails does not call the hooks and leaves stats as it found it.
+    depth = stats.depth if stats is not None else 0
+    stats = Start(tool, stats)
+    try:
+        yield stats
+    except:
+        if stats is not None:
+            stats.depth = depth
+        raise
+    Finish(stats)
+
+
+@contextmanager
+def Phase(stats, name):
+    # Same as stats.Phase(name), but does nothing when stats is None
+    if stats is None:
+        yield
+    else:
+        with stats.Phase(name):
+            yield
+
+
+def WriteReport(stats, path):
+    # Writes the report as json to path, "-" is stdout
+    data = json.dumps(stats.Report(), indent=2) + "\n"
+    if path == "-":
+        sys.stdout.write(data)
+    else:
+        with open(path, "w") as f:
+            f.write(data)
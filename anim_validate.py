@@ -0,0 +1,308 @@
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+from collections import OrderedDict
+
+import anim_model
+import anim_zip
+from anim_hash import strhash
+
+# Structural check of anim.bin and build.bin files without decoding them into XML or models.
+#
+# Every file is read in one forward pass with precompiled struct.Struct readers. Errors are what makes the
+# decompilers fail or write wrong XML: a bad magic or version, header totals that do not match the records,
+# records running past the end, vertex runs outside the vertex buffer, anim hashes missing from the hash
+# table, a broken build hash table and bytes after the end. Warnings are what the tools accept but is
+# probably not intended: hash table strings that do not hash to their hash, build symbols without a name,
+# build frames out of order.
+
+_structs = {}
+
+
+class Truncated(Exception):
+    pass
+
+
+class Readers(object):
+    # The struct.Struct readers of one byte order
+    def __init__(self, endianstring):
+        self.int = struct.Struct(endianstring + "i")
+        self.uint = struct.Struct(endianstring + "I")
+        self.anim_header = struct.Struct(endianstring + "IIII")
+        self.anim = struct.Struct(endianstring + "BIfI")
+        self.frame = struct.Struct(endianstring + "ffffI")
+        self.symbol = struct.Struct(endianstring + "II")
+        self.build_frame = struct.Struct(endianstring + "IIffffII")
+        self.hash_entry = struct.Struct(endianstring + "Ii")
+
+
+def _Readers(endianstring):
+    if endianstring not in _structs:
+        _structs[endianstring] = Readers(endianstring)
+    return _structs[endianstring]
+
+
+class Report(object):
+    def __init__(self, path, kind):
+        self.path = path
+        self.kind = kind
+        self.errors = []
+        self.warnings = []
+        self.counts = OrderedDict()
+
+    def Error(self, offset, message):
+        self.errors.append(OrderedDict([("offset", offset), ("message", message)]))
+
+    def Warning(self, offset, message):
+        self.warnings.append(OrderedDict([("offset", offset), ("message", message)]))
+
+    def AsDict(self):
+        return OrderedDict([("file", self.path), ("kind", self.kind), ("ok", not self.errors),
+                            ("errors", self.errors), ("warnings", self.warnings), ("counts", self.counts)])
+
+
+def _Unpack(reader, data, offset, what):
+    if offset + reader.size > len(data):
+        raise Truncated("the file ends inside " + what)
+    return reader.unpack_from(data, offset)
+
+
+def _String(readers, data, offset, what):
+    # A length prefixed string, returns it and the offset after it
+    length = _Unpack(readers.int, data, offset, what)[0]
+    offset += 4
+    if length < 0 or offset + length > len(data):
+        raise Truncated("the file ends inside " + what)
+    return data[offset:offset + length], offset + length
+
+
+def _HashTable(readers, data, offset, report):
+    # Reads the hash table at offset, returns {hash: string} and the offset after it
+    table = {}
+    num = _Unpack(readers.uint, data, offset, "the hash table")[0]
+    offset += 4
+    for _ in range(num):
+        entry_offset = offset
+        hash_idx, length = _Unpack(readers.hash_entry, data, offset, "the hash table")
+        offset += 8
+        if length < 0 or offset + length > len(data):
+            raise Truncated("the file ends inside the hash table")
+        name = data[offset:offset + length]
+        offset += length
+        if hash_idx in table and table[hash_idx] != name:
+            report.Warning(entry_offset, "hash {} is in the hash table more than once".format(hash_idx))
+        elif strhash(name, {}) != hash_idx:
+            report.Warning(entry_offset, "hash table string {!r} does not hash to {}".format(name, hash_idx))
+        table[hash_idx] = name
+    return table, offset
+
+
+def ValidateAnimBin(endianstring, data, path=None):
+    # Returns the Report of the content of an anim.bin
+    report = Report(path, "anim")
+    readers = _Readers(endianstring)
+    if data[0:4] != b"ANIM" or len(data) < 8 or readers.int.unpack_from(data, 4)[0] != anim_model.ANIMVERSION:
+        report.Error(0, "not an anim.bin of version " + str(anim_model.ANIMVERSION))
+        return report
+
+    offset = 8
+    try:
+        header = _Unpack(readers.anim_header, data, offset, "the header")
+        offset += 16
+        elements_num = frames_num = events_num = 0
+        used = set()  # every hash referenced by a record
+        blocks = []
+        for _ in range(header[3]):
+            name, offset = _String(readers, data, offset, "an anim name")
+            facing, root, framerate, frames = _Unpack(readers.anim, data, offset, "anim " + repr(name))
+            offset += 13
+            used.add(root)
+            for _ in range(frames):
+                x, y, w, h, events = _Unpack(readers.frame, data, offset, "a frame of anim " + repr(name))
+                offset += 20
+                if offset + 4 * events > len(data):
+                    raise Truncated("the file ends inside the events of anim " + repr(name))
+                used.update(struct.unpack_from(endianstring + str(events) + "I", data, offset))
+                offset += 4 * events
+                elements = _Unpack(readers.uint, data, offset, "a frame of anim " + repr(name))[0]
+                offset += 4
+                if offset + 40 * elements > len(data):
+                    raise Truncated("the file ends inside the elements of anim " + repr(name))
+                blocks.append((offset, elements))
+                offset += 40 * elements
+                frames_num += 1
+                events_num += events
+                elements_num += elements
+
+        # The symbol and layer hashes of all elements in one go
+        raw = b"".join(data[start:start + 40 * num] for start, num in blocks)
+        words = anim_model.ReadArray("I", raw, anim_model.NeedSwap(endianstring))
+        used.update(words[0::10])
+        used.update(words[2::10])
+
+        hash_offset = offset
+        table, offset = _HashTable(readers, data, offset, report)
+    except Truncated as e:
+        report.Error(offset, str(e))
+        return report
+
+    report.counts.update((("anims", header[3]), ("frames", frames_num), ("elements", elements_num),
+                          ("events", events_num), ("hash_strings", len(table))))
+    for name, expected, actual in (("elements", header[0], elements_num), ("frames", header[1], frames_num),
+                                   ("events", header[2], events_num)):
+        if expected != actual:
+            report.Error(8, "the header counts {} {}, the anims have {}".format(expected, name, actual))
+    missing = sorted(hash_idx for hash_idx in used if hash_idx not in table)
+    if missing:
+        report.Error(hash_offset, "{} hashes have no string in the hash table, the first is {}".format(
+            len(missing), missing[0]))
+    if offset != len(data):
+        report.Error(offset, "{} bytes after the hash table".format(len(data) - offset))
+    return report
+
+
+def ValidateBuildBin(endianstring, data, path=None):
+    # Returns the Report of the content of a build.bin
+    report = Report(path, "build")
+    readers = _Readers(endianstring)
+    if data[0:4] != b"BILD" or len(data) < 8 or readers.int.unpack_from(data, 4)[0] != anim_model.BUILDVERSION:
+        report.Error(0, "not a build.bin of version " + str(anim_model.BUILDVERSION))
+        return report
+
+    offset = 8
+    try:
+        symbols_num, frames_total = _Unpack(readers.symbol, data, offset, "the header")
+        offset += 8
+        _, offset = _String(readers, data, offset, "the build name")
+        textures = _Unpack(readers.uint, data, offset, "the textures")[0]
+        offset += 4
+        for _ in range(textures):
+            _, offset = _String(readers, data, offset, "a texture name")
+
+        frames_num = 0
+        symbols = []
+        runs = []
+        for _ in range(symbols_num):
+            symbol_offset = offset
+            symbol_hash, frames = _Unpack(readers.symbol, data, offset, "a symbol")
+            offset += 8
+            if offset + 32 * frames > len(data):
+                raise Truncated("the file ends inside the frames of symbol " + str(symbol_hash))
+            symbols.append((symbol_hash, symbol_offset))
+            last = None
+            for _ in range(frames):
+                frame = readers.build_frame.unpack_from(data, offset)
+                if last is not None and frame[0] < last:
+                    report.Warning(offset, "the frames of symbol {} are not in framenum order".format(symbol_hash))
+                last = frame[0]
+                runs.append((offset, frame[6], frame[7]))
+                offset += 32
+            frames_num += frames
+
+        verts = _Unpack(readers.uint, data, offset, "the vertex count")[0]
+        offset += 4
+        if offset + 24 * verts > len(data):
+            raise Truncated("the file ends inside the vertices")
+        offset += 24 * verts
+
+        table = None
+        hash_offset = offset
+        if offset < len(data):
+            table, offset = _HashTable(readers, data, offset, report)
+    except Truncated as e:
+        report.Error(offset, str(e))
+        return report
+
+    report.counts.update((("symbols", symbols_num), ("frames", frames_num), ("textures", textures),
+                          ("vertices", verts), ("hash_strings", len(table or ()))))
+    if frames_total != frames_num:
+        report.Error(12, "the header counts {} frames, the symbols have {}".format(frames_total, frames_num))
+    outside = [frame_offset for frame_offset, alphaidx, alphacount in runs if alphaidx + alphacount > verts]
+    if outside:
+        report.Error(outside[0], "{} frames have vertices outside the {} vertices, the first is here".format(
+            len(outside), verts))
+    unnamed = [symbol_offset for symbol_hash, symbol_offset in symbols if table is None or symbol_hash not in table]
+    if unnamed and table is not None:
+        report.Warning(unnamed[0], "{} symbols have no string in the hash table, the first is here".format(
+            len(unnamed)))
+    if table is None and symbols_num:
+        report.Warning(hash_offset, "there is no hash table, no symbol has a name")
+    if offset != len(data):
+        report.Error(offset, "{} bytes after the hash table".format(len(data) - offset))
+    return report
+
+
+def ValidateData(endianstring, data, path=None):
+    # Picks the check by the magic of data
+    if data[0:4] == b"BILD":
+        return ValidateBuildBin(endianstring, data, path)
+    if data[0:4] == b"ANIM":
+        return ValidateAnimBin(endianstring, data, path)
+    report = Report(path, None)
+    report.Error(0, "neither an anim.bin nor a build.bin")
+    return report
+
+
+def ValidatePath(endianstring, path):
+    # The Reports of a .bin file, or of the anim.bin and build.bin in an anim.zip
+    if anim_zip.IsAnimZip(path):
+        return [ValidateData(endianstring, anim_zip.ReadZipEntry(path, name), path + "/" + name)
+                for name in anim_zip.ZipEntries(path) if name in ("anim.bin", "build.bin")]
+    with open(path, "rb") as f:
+        return [ValidateData(endianstring, f.read(), path)]
+
+
+def FindFiles(paths):
+    # Folders are searched for anim.bin, build.bin and anim.zip files
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, filenames in sorted(os.walk(path)):
+                for filename in sorted(filenames):
+                    if filename in ("anim.bin", "build.bin") or filename.endswith(".zip"):
+                        files.append(os.path.join(folder, filename))
+        else:
+            files.append(path)
+    return files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the structure of anim.bin and build.bin files.")
+    parser.add_argument("paths", nargs="+", help="anim.bin, build.bin, anim.zip files or folders to search")
+    parser.add_argument("--json", nargs="?", const="-", metavar="FILE",
+                        help="write the reports as json to FILE (default: stdout)")
+    parser.add_argument("--strict", action="store_true", help="fail on warnings too")
+    args = parser.parse_args()
+
+    start = time.time()
+    endianstring = "<"
+    reports = []
+    for path in FindFiles(args.paths):
+        try:
+            reports.extend(report.AsDict() for report in ValidatePath(endianstring, path))
+        except (IOError, OSError, ValueError) as e:
+            report = Report(path, None)
+            report.Error(None, str(e))
+            reports.append(report.AsDict())
+
+    failed = [report for report in reports if report["errors"] or (args.strict and report["warnings"])]
+    if args.json:
+        data = json.dumps(OrderedDict([("files", len(reports)), ("failed", len(failed)),
+                                       ("seconds", time.time() - start), ("reports", reports)]), indent=2) + "\n"
+        if args.json == "-":
+            sys.stdout.write(data)
+        else:
+            with open(args.json, "w") as f:
+                f.write(data)
+    if args.json != "-":
+        for report in reports:
+            for level, problems in (("ERROR", report["errors"]), ("WARN ", report["warnings"])):
+                for problem in problems:
+                    sys.stdout.write("{} {} @{}: {}\n".format(level, report["file"], problem["offset"],
+                                                              problem["message"]))
+        sys.stdout.write("{} files, {} failed in {:.2f}s\n".format(len(reports), len(failed), time.time() - start))
+    if failed:
+        exit(-1)
@@ -0,0 +1,117 @@
+import os
+import struct
+import time
+import zipfile
+
+# Helpers to work on anim.zip directly instead of on its decompressed folder.
+# Entries that are not replaced (atlas-*.tex normally) are copied through with their compressed
+# data as is, so they are never decompressed and compressed again.
+
+
+def IsAnimZip(path):
+    return os.path.isfile(path) and zipfile.is_zipfile(path)
+
+
+def ZipWorkspace(zippath):
+    # The folder the XML files of an anim.zip are read from and written to, "anim/foo.zip" -> "anim/foo"
+    return os.path.splitext(zippath)[0]
+
+
+def ReadZipEntry(zippath, name):
+    with zipfile.ZipFile(zippath, "r") as zf:
+        return zf.read(name)
+
+
+def ZipEntries(zippath):
+    with zipfile.ZipFile(zippath, "r") as zf:
+        return zf.namelist()
+
+
+def CopyRawEntry(src, info, dst):
+    # Local file header is 30 bytes followed by the filename and the extra field
+    src.fp.seek(info.header_offset)
+    header = src.fp.read(30)
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    src.fp.seek(info.header_offset + 30 + name_len + extra_len)
+    data = src.fp.read(info.compress_size)
+
+    new_info = zipfile.ZipInfo(info.filename, info.date_time)
+    new_info.compress_type = info.compress_type
+    new_info.comment = info.comment
+    new_info.extra = info.extra
+    new_info.create_system = info.create_system
+    new_info.external_attr = info.external_attr
+    new_info.flag_bits = info.flag_bits & ~0x08  # crc and sizes are known, no data descriptor is needed
+    new_info.CRC = info.CRC
+    new_info.compress_size = info.compress_size
+    new_info.file_size = info.file_size
+    new_info.header_offset = dst.fp.tell()
+
+    dst.fp.write(new_info.FileHeader())
+    dst.fp.write(data)
+    dst.filelist.append(new_info)
+    dst.NameToInfo[new_info.filename] = new_info
+    dst._didModify = True
+    if hasattr(dst, "start_dir"):
+        dst.start_dir = dst.fp.tell()
+
+
+def WriteEntry(dst, name, data, compress_type):
+    info = zipfile.ZipInfo(name, time.localtime()[:6])
+    info.compress_type = compress_type
+    info.external_attr = 0o644 << 16
+    dst.writestr(info, data)
+
+
+def WriteAnimZip(zippath, entries):
+    # Writes anim.zip in one pass with the given {name: data} entries. When zippath already exists its
+    # other entries are kept, in their original order and without recompressing them.
+    tmpzippath = zippath + ".tmp"
+    entries = dict(entries)
+    try:
+        with zipfile.ZipFile(tmpzippath, "w", zipfile.ZIP_DEFLATED) as dst:
+            if os.path.exists(zippath):
+                with zipfile.ZipFile(zippath, "r") as src:
+                    for info in src.infolist():
+                        if info.filename in entries:
+                            WriteEntry(dst, info.filename, entries.pop(info.filename), info.compress_type)
+                        else:
+                            CopyRawEntry(src, info, dst)
+            for name in sorted(entries):
+                WriteEntry(dst, name, entries[name], zipfile.ZIP_DEFLATED)
+    except:
+        if os.path.exists(tmpzippath):
+            os.remove(tmpzippath)
+        raise
+
+    if os.path.exists(zippath):
+        os.remove(zippath)
+    os.rename(tmpzippath, zippath)
+
+
+def ReadBin(path, name):
+    # path is either the .bin itself or an anim.zip holding it as name
+    if IsAnimZip(path):
+        return ReadZipEntry(path, name)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def WriteBin(path, name, data):
+    # Counterpart of ReadBin, a plain file is written under a temporary name first like anim.zip is
+    if IsAnimZip(path):
+        WriteAnimZip(path, {name: data})
+        return
+
+    tmppath = path + ".tmp"
+    try:
+        with open(tmppath, "wb") as f:
+            f.write(data)
+    except:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmppath, path)
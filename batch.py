@@ -0,0 +1,148 @@
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+import anim_compiler
+import anim_decompiler
+import anim_names
+import anim_zip
+import build_compiler
+import build_decompiler
+
+
+# Each step is (input file, output file, function running it), a step is skipped when its input is missing
+STEPS = {
+    "compile": (
+        ("anim.xml", "anim.bin", anim_compiler.CompileAnimData),
+        ("build.xml", "build.bin", build_compiler.CompileBuildData),
+    ),
+    "decompile": (
+        ("anim.bin", "anim.xml", anim_decompiler.DecompileAnim),
+        ("build.bin", "build.xml", build_decompiler.DecompileBuild),
+    ),
+}
+
+
+def ProcessFolder(args):
+    # Runs in a worker process, every failure is returned instead of raised so one bad folder
+    # can not take down the whole batch.
+    # The target is either a workspace folder or an anim.zip, which is read from and written to directly
+    # with its XML files in the folder named after it.
+    # names_path is the reverse hash dictionary used by the decompilers, if any.
+    mode, target, names_path = args
+    endianstring = "<"
+    start = time.time()
+    done = []
+    bytes_in = 0
+    error = None
+    path = target
+    try:
+        zippath = target if anim_zip.IsAnimZip(target) else None
+        workspace = anim_zip.ZipWorkspace(target) if zippath else target
+        if mode == "compile":
+            compiled = {}
+            for in_name, out_name, step in STEPS[mode]:
+                path = os.path.join(workspace, in_name)
+                if not os.path.exists(path):
+                    continue
+                bytes_in += os.path.getsize(path)
+                with open(path, 'rb') as f:
+                    compiled[out_name] = step(endianstring, f)
+                done.append(in_name)
+            if zippath:
+                anim_zip.WriteAnimZip(zippath, compiled)
+            else:
+                for out_name, data in compiled.items():
+                    with open(os.path.join(workspace, out_name), "wb") as f:
+                        f.write(data)
+        else:
+            entries = anim_zip.ZipEntries(zippath) if zippath else os.listdir(workspace)
+            names = anim_names.NameDictionary(names_path) if names_path else None
+            for in_name, out_name, step in STEPS[mode]:
+                if in_name not in entries:
+                    continue
+                if zippath:
+                    path = zippath + "/" + in_name
+                    data = anim_zip.ReadZipEntry(zippath, in_name)
+                    if not os.path.isdir(workspace):
+                        os.makedirs(workspace)
+                else:
+                    path = os.path.join(workspace, in_name)
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                bytes_in += len(data)
+                step(endianstring, data, workspace, names=names)
+                done.append(in_name)
+            if names is not None:
+                names.Close()
+        if not done:
+            error = "There is nothing to " + mode + " under dictionary " + workspace
+    except Exception:
+        error = "Error Exporting {}\n{}".format(path, traceback.format_exc())
+    return target, done, error, bytes_in, time.time() - start
+
+
+def ExpandFolders(patterns):
+    folders = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        for folder in matches:
+            if (os.path.isdir(folder) or anim_zip.IsAnimZip(folder)) and folder not in folders:
+                folders.append(folder)
+    return folders
+
+
+def RunBatch(mode, folders, jobs, report=sys.stdout, names_path=None):
+    start = time.time()
+    tasks = [(mode, folder, names_path) for folder in folders]
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(ProcessFolder, tasks)
+    else:
+        pool = None
+        results = (ProcessFolder(task) for task in tasks)
+
+    failed = []
+    bytes_total = 0
+    for workspace, done, error, bytes_in, elapsed in results:
+        bytes_total += bytes_in
+        if error is None:
+            report.write("OK   {} ({}) {:.2f}s\n".format(workspace, ", ".join(done), elapsed))
+        else:
+            failed.append(workspace)
+            report.write("FAIL {} {}\n".format(workspace, error))
+        report.flush()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    elapsed = time.time() - start
+    elapsed = max(elapsed, 1e-6)
+    report.write("{} folders, {} succeeded, {} failed in {:.2f}s ({:.2f} folders/s, {:.2f} MB/s)\n".format(
+        len(folders), len(folders) - len(failed), len(failed), elapsed, len(folders) / elapsed,
+        bytes_total / 1048576.0 / elapsed))
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile or decompile many workspace folders at once.")
+    parser.add_argument("mode", choices=sorted(STEPS.keys()))
+    parser.add_argument("folders", nargs="+", help="workspace folders, anim.zip files or glob patterns")
+    parser.add_argument("--jobs", "-j", type=int, default=multiprocessing.cpu_count(),
+                        help="number of worker processes (default: number of cpus)")
+    parser.add_argument("--names", metavar="DATABASE",
+                        help="reverse hash dictionary (see anim_names.py) used when decompiling")
+    args = parser.parse_args()
+
+    folders = ExpandFolders(args.folders)
+    if not folders:
+        sys.stderr.write("Error: No workspace folder matches " + " ".join(args.folders) + "\n")
+        exit(-1)
+
+    if RunBatch(args.mode, folders, max(1, args.jobs), names_path=args.names):
+        exit(-1)
@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import anim_compiler
+import anim_decompiler
+import build_compiler
+import build_decompiler
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Benchmarks for the four tools on synthetic workspaces.
+#
+# Every operation runs in its own process so its peak memory can be measured, the time reported is the best
+# of --repeat runs of the operation itself, without the interpreter startup. Results are written as json and
+# can be compared against a stored baseline, any operation slower or bigger than the baseline by more than
+# --threshold is reported as a regression and makes the script exit with -1. The parameters of the tiers can be
+# overridden from the command line, a baseline is only compared against a run with the same parameters.
+
+OPERATIONS = ("compile_anim", "decompile_anim", "compile_build", "decompile_build")
+
+TIERS = {
+    "small": dict(anims=20, frames=10, elements=8, symbols=20, symbol_frames=4, quads=2),
+    "medium": dict(anims=100, frames=30, elements=15, symbols=100, symbol_frames=4, quads=2),
+    "large": dict(anims=300, frames=40, elements=20, symbols=300, symbol_frames=4, quads=4),
+}
+
+PARAMETERS = ("anims", "frames", "elements", "symbols", "symbol_frames", "quads")
+
+FACINGS = ("_down", "_up", "_side", "", "_left", "_right", "_upside", "_downside", "_45s", "_90s")
+
+
+def GenerateAnimXml(path, anims, frames, elements, symbols, seed=0, **_):
+    r = random.Random(seed)
+    symbol_names = ["symbol_%d" % i for i in range(symbols)]
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" ?>\n<Anims>\n')
+        for anim_idx in range(anims):
+            f.write('\t<anim name="anim_%d%s" root="root" framerate="30" numframes="%d">\n' %
+                    (anim_idx, FACINGS[anim_idx % len(FACINGS)], frames))
+            for frame_idx in range(frames):
+                f.write('\t\t<frame x="%r" y="%r" w="%r" h="%r">\n' %
+                        (r.uniform(-100, 100), r.uniform(-100, 100), r.uniform(1, 300), r.uniform(1, 300)))
+                if frame_idx % 10 == 0:
+                    f.write('\t\t\t<event name="event_%d"/>\n' % r.randint(0, 3))
+                for z_index in range(elements):
+                    symbol = r.choice(symbol_names)
+                    f.write('\t\t\t<element name="%s" layername="layer/%s" frame="%d" z_index="%d" m_a="%r" '
+                            'm_b="%r" m_c="%r" m_d="%r" m_tx="%r" m_ty="%r"/>\n' %
+                            (symbol, symbol, r.randint(0, 3), z_index, r.uniform(-1, 1), r.uniform(-1, 1),
+                             r.uniform(-1, 1), r.uniform(-1, 1), r.uniform(-200, 200), r.uniform(-200, 200)))
+                f.write('\t\t</frame>\n')
+            f.write('\t</anim>\n')
+        f.write('</Anims>\n')
+
+
+def GenerateBuildXml(path, symbols, symbol_frames, quads, seed=0, **_):
+    r = random.Random(seed)
+    verts = []
+    with open(path, "w") as f:
+        f.write('<Build name="benchmark">\n\t<Texture filename="atlas-0.tex"/>\n\t<Texture filename="atlas-1.tex"/>\n')
+        for symbol_idx in range(symbols):
+            f.write('\t<Symbol name="symbol_%d">\n' % symbol_idx)
+            for frame_idx in range(symbol_frames):
+                f.write('\t\t<Frame framenum="%d" duration="1" x="%r" y="%r" w="%r" h="%r" alphaidx="%d" '
+                        'alphacount="%d"/>\n' % (frame_idx, r.uniform(-50, 50), r.uniform(-50, 50), r.uniform(1, 100),
+                                                 r.uniform(1, 100), len(verts), quads * 6))
+                for _ in range(quads):
+                    atlas = float(r.randint(0, 1))
+                    u, v = r.random() * 0.5, r.random() * 0.5
+                    du, dv = r.random() * 0.4, r.random() * 0.4
+                    x, y = r.uniform(-50, 50), r.uniform(-50, 50)
+                    for qu, qv in ((0, 0), (1, 0), (0, 1), (1, 0), (1, 1), (0, 1)):
+                        verts.append((x + qu * 10, y + qv * 10, 0.0, u + qu * du, v + qv * dv, atlas))
+            f.write('\t</Symbol>\n')
+        for vert in verts:
+            f.write('\t<Alphavert x="%r" y="%r" z="%r" u="%r" v="%r" w="%r"/>\n' % vert)
+        f.write('</Build>\n')
+
+
+def GenerateWorkspace(workspace, params, seed=0):
+    # anim.xml and build.xml plus the anim.bin and build.bin compiled from them
+    if not os.path.isdir(workspace):
+        os.makedirs(workspace)
+    GenerateAnimXml(os.path.join(workspace, "anim.xml"), seed=seed, **params)
+    GenerateBuildXml(os.path.join(workspace, "build.xml"), seed=seed, **params)
+    with open(os.path.join(workspace, "anim.xml"), "rb") as f:
+        anim_compiler.CompileAnim("<", f, os.path.join(workspace, "anim.bin"))
+    with open(os.path.join(workspace, "build.xml"), "rb") as f:
+        build_compiler.CompileBuild("<", f.read(), os.path.join(workspace, "build.bin"))
+
+
+def RunOperation(op, workspace):
+    # Runs one operation in this process and returns its time. The outputs go to a separate folder so the
+    # inputs of the other operations stay untouched.
+    out = os.path.join(workspace, "out")
+    if not os.path.isdir(out):
+        os.makedirs(out)
+    start = time.time()
+    if op == "compile_anim":
+        with open(os.path.join(workspace, "anim.xml"), "rb") as f:
+            anim_compiler.CompileAnim("<", f, os.path.join(out, "anim.bin"))
+    elif op == "decompile_anim":
+        with open(os.path.join(workspace, "anim.bin"), "rb") as f:
+            anim_decompiler.DecompileAnim("<", anim_decompiler.MapFile(f), out)
+    elif op == "compile_build":
+        with open(os.path.join(workspace, "build.xml"), "rb") as f:
+            build_compiler.CompileBuild("<", f.read(), os.path.join(out, "build.bin"))
+    elif op == "decompile_build":
+        with open(os.path.join(workspace, "build.bin"), "rb") as f:
+            build_decompiler.DecompileBuild("<", f.read(), out)
+    else:
+        raise ValueError("Unknown operation " + op)
+    return time.time() - start
+
+
+def MeasureOperation(op, workspace):
+    # Returns (seconds, peak rss in KB) of one run in a child process
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--run-operation", op, workspace],
+                               stdout=subprocess.PIPE)
+    output = process.stdout.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = status
+    if status:
+        raise RuntimeError("{} failed on {}".format(op, workspace))
+    return json.loads(output)["seconds"], rusage.ru_maxrss
+
+
+def TierParams(tiers, overrides=None):
+    # The parameters of every tier by name, with the values of overrides that are not None put in
+    params = {}
+    for tier in tiers:
+        if tier not in TIERS:
+            raise ValueError("Unknown tier " + tier)
+        params[tier] = dict(TIERS[tier])
+        params[tier].update((key, value) for key, value in (overrides or {}).items() if value is not None)
+    return params
+
+
+def RunBenchmarks(tiers, repeat, workdir, report=sys.stdout, params=None):
+    # params maps every tier to its parameters, TIERS by default
+    params = params or TierParams(tiers)
+    results = {}
+    for tier in tiers:
+        workspace = os.path.join(workdir, tier)
+        report.write("Generating {} {}\n".format(tier, json.dumps(params[tier], sort_keys=True)))
+        GenerateWorkspace(workspace, params[tier])
+        results[tier] = {}
+        for op in OPERATIONS:
+            runs = [MeasureOperation(op, workspace) for _ in range(repeat)]
+            seconds = min(run[0] for run in runs)
+            peak_rss_kb = max(run[1] for run in runs)
+            results[tier][op] = {"seconds": seconds, "peak_rss_kb": peak_rss_kb}
+            report.write("  {:<16} {:>9.3f}s {:>9d}KB\n".format(op, seconds, peak_rss_kb))
+            report.flush()
+    return results
+
+
+def CheckBaseline(baseline, params):
+    # Raises ValueError when the baseline ran one of the tiers of params with other parameters
+    different = [tier for tier in sorted(params) if tier in baseline.get("results", {}) and
+                 baseline.get("tiers", {}).get(tier) != params[tier]]
+    if different:
+        raise ValueError("The baseline ran {} with other parameters: {}".format(", ".join(different), "; ".join(
+            "{} instead of {}".format(json.dumps(baseline.get("tiers", {}).get(tier), sort_keys=True),
+                                      json.dumps(params[tier], sort_keys=True)) for tier in different)))
+
+
+def CompareResults(results, baseline, threshold, params=None):
+    # Returns a list of the regressions found, as readable lines. params maps every tier to the parameters it
+    # ran with (TIERS by default), a baseline that ran them with other parameters raises ValueError
+    CheckBaseline(baseline, params or TierParams(results))
+    regressions = []
+    for tier, ops in sorted(results.items()):
+        for op, result in sorted(ops.items()):
+            base = baseline.get("results", {}).get(tier, {}).get(op)
+            if not base:
+                continue
+            for key in ("seconds", "peak_rss_kb"):
+                if base[key] and result[key] > base[key] * (1 + threshold):
+                    regressions.append("{} {} {}: {} -> {} (+{:.0%})".format(
+                        tier, op, key, base[key], result[key], result[key] / float(base[key]) - 1))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the compilers and decompilers on synthetic workspaces.")
+    parser.add_argument("--tiers", default="small,medium", help="comma separated tiers out of " +
+                        ", ".join(sorted(TIERS)) + " (default: small,medium)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of every operation, the best one is kept")
+    parser.add_argument("--output", default="benchmark_results.json", help="file the results are written to")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slow down or memory growth against the baseline (default: 0.2 = 20%%)")
+    for key in PARAMETERS:
+        parser.add_argument("--" + key.replace("_", "-"), type=int, metavar="N",
+                            help="number of {} of every tier instead of its own".format(key.replace("_", " ")))
+    parser.add_argument("--keep", metavar="DIR", help="generate the workspaces in DIR and keep them")
+    parser.add_argument("--run-operation", nargs=2, metavar=("OPERATION", "WORKSPACE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_operation:
+        sys.stdout.write(json.dumps({"seconds": RunOperation(*args.run_operation)}))
+        exit(0)
+
+    tiers = args.tiers.split(",")
+    baseline = None
+    try:
+        params = TierParams(tiers, dict((key, getattr(args, key)) for key in PARAMETERS))
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            # Checked before running so a different workload fails right away
+            CheckBaseline(baseline, params)
+    except ValueError as e:
+        sys.stderr.write("Error: " + str(e) + "\n")
+        exit(-1)
+
+    workdir = args.keep or tempfile.mkdtemp(prefix="dstanimtool-benchmark-")
+    try:
+        results = RunBenchmarks(tiers, max(1, args.repeat), workdir, params=params)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "python": platform.python_version(),
+            "numpy": numpy.__version__ if numpy is not None else None,
+            "platform": platform.platform(),
+            "tiers": params,
+            "results": results,
+        }, f, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = CompareResults(results, baseline, args.threshold, params)
+        for regression in regressions:
+            sys.stderr.write("Regression: " + regression + "\n")
+        if regressions:
+            exit(-1)
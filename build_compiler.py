@@ -1,10 +1,21 @@
+import argparse
 import os
-import struct
 import sys
 import traceback
-import xml.dom.minidom
 from io import BytesIO
 
+import anim_jsonl
+import anim_model
+import anim_stats
+import anim_zip
+from anim_errors import FormatError
+from anim_hash import strhash
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
 BUILDVERSION = 6
 
 #BUILD format 6
@@ -32,95 +43,277 @@ BUILDVERSION = 6
 #   original string (int, string)
 
 
-def strhash(str, hashcollection):
-    hash = 0
-    for c in str:
-        v = ord(c.lower())
-        hash = (v + (hash << 6) + (hash << 16) - hash) & 0xFFFFFFFF
-    hashcollection[hash] = str
-    return hash
+def BuildFromXml(root, hashcollection):
+    # Builds the anim_model.Build of a parsed build.xml, the symbol names it hashes are added to hashcollection
+    build_name = next(root.iter("Build")).attrib["name"].encode('ascii')
+    build_name = os.path.splitext(build_name)[0]
+
+    textures = [texture_node.get("filename", "").encode('ascii') for texture_node in root.iter('Texture')]
+
+    symbols = []
+    for symbol_node in root.iter("Symbol"):
+        if "namehash" in symbol_node.attrib:
+            symbol_hash = int(symbol_node.attrib["namehash"])
+        else:
+            symbol_name = symbol_node.attrib["name"].encode('ascii')
+            symbol_hash = strhash(symbol_name, hashcollection)
+
+        frames = []
+        for frame_node in symbol_node.iter("Frame"):
+            attrib = frame_node.attrib
+            frames.append(
+                anim_model.BuildFrame(int(attrib["framenum"]), int(attrib["duration"]), float(attrib["x"]),
+                                      float(attrib["y"]), float(attrib["w"]), float(attrib["h"]),
+                                      int(attrib["alphaidx"]), int(attrib["alphacount"])))
+        symbols.append(anim_model.BuildSymbol(symbol_hash, frames))
+
+    verts = []
+    for vert in root.iter("Alphavert"):
+        attrib = vert.attrib
+        verts.extend((float(attrib["x"]), float(attrib["y"]), float(attrib["z"]), float(attrib["u"]),
+                      float(attrib["v"]), float(attrib["w"])))
 
+    return anim_model.Build(build_name, textures, symbols, verts)
 
-def CompileBuild(endianstring, xmlstr, outfilename):
+
+def DedupVerts(build):
+    # Stores every distinct vertex run of the frames once and points the frames sharing it at the same copy.
+    # The runs are kept in the order they are first used, vertices no frame uses stay behind them. A build
+    # whose runs overlap could grow and is left as it is, as is one with runs past the end of its vertices.
+    # Returns the number of vertices removed.
+    verts = build.verts
+    verts_num = len(verts) // 6
+    frames = [frame for symbol in build.symbols for frame in symbol.frames if frame.alphacount]
+    if any(frame.alphaidx + frame.alphacount > verts_num for frame in frames):
+        return 0
+
+    used = bytearray(verts_num)
+    runs = {}
+    alphaidxs = []
+    deduped = anim_model.Column("f")
+    for frame in frames:
+        start, end = frame.alphaidx, frame.alphaidx + frame.alphacount
+        used[start:end] = b"\x01" * (end - start)
+        run = verts[start * 6:end * 6]
+        key = run.tostring()
+        if key not in runs:
+            runs[key] = len(deduped) // 6
+            deduped.extend(run)
+        alphaidxs.append(runs[key])
+
+    for idx in range(verts_num):
+        if not used[idx]:
+            deduped.extend(verts[idx * 6:idx * 6 + 6])
+
+    removed = verts_num - len(deduped) // 6
+    if removed <= 0:
+        return 0
+    for frame, alphaidx in zip(frames, alphaidxs):
+        frame.alphaidx = alphaidx
+    build.verts = deduped
+    return removed
+
+
+def CompileBuildStream(endianstring, xmlfile, outfile, stats=None, dedup_verts=False):
+    stats = anim_stats.Start("compile_build", stats)
     hashcollection = {}
+    start_pos = outfile.tell()
 
-    doc = xml.dom.minidom.parseString(xmlstr)
-    outfile = BytesIO()
+    with anim_stats.Phase(stats, "parse"):
+        root = ElementTree.parse(xmlfile).getroot()
 
-    outfile.write(struct.pack(endianstring + 'cccci', 'B', 'I', 'L', 'D', BUILDVERSION))
+    with anim_stats.Phase(stats, "model"):
+        build = BuildFromXml(root, hashcollection)
+        # The hash table is only written when some symbol was hashed by name
+        if len(hashcollection):
+            build.hashcollection = list(hashcollection.items())
 
-    outfile.write(struct.pack(endianstring + 'I', len(doc.getElementsByTagName("Symbol"))))
-    outfile.write(struct.pack(endianstring + 'I', len(doc.getElementsByTagName("Frame"))))
+    if dedup_verts:
+        with anim_stats.Phase(stats, "dedup_verts"):
+            removed = DedupVerts(build)
 
-    build_name = doc.getElementsByTagName("Build")[0].attributes["name"].value.encode('ascii')
-    build_name = os.path.splitext(build_name)[0]
-    outfile.write(struct.pack(endianstring + 'i' + str(len(build_name)) + 's', len(build_name), build_name))
+    with anim_stats.Phase(stats, "pack"):
+        anim_model.WriteBuildBin(endianstring, build, outfile)
 
-    texture_nodes = doc.getElementsByTagName('Texture')
+    if stats is not None:
+        if dedup_verts:
+            stats.Count("dedup_verts_removed", removed)
+            stats.Count("dedup_bytes_saved", removed * 24)
+        stats.Count("textures", len(build.textures))
+        stats.Count("symbols", len(build.symbols))
+        stats.Count("frames", sum(len(symbol.frames) for symbol in build.symbols))
+        stats.Count("vertices", len(build.verts) // len(anim_model.VERTEX_FIELDS))
+        stats.Count("hash_strings", len(hashcollection))
+        try:
+            stats.AddBytes(bytes_in=xmlfile.tell())
+        except (AttributeError, IOError, ValueError):
+            pass
+        stats.AddBytes(bytes_out=outfile.tell() - start_pos)
+        anim_stats.Finish(stats)
 
-    #write out the number of atlases:
-    outfile.write(struct.pack(endianstring + 'I', len(texture_nodes)))
-    for texture_node in texture_nodes:
-        tex_name = texture_node.getAttribute("filename").encode('ascii')
-        outfile.write(struct.pack(endianstring + 'i' + str(len(tex_name)) + 's', len(tex_name), tex_name))
 
-    symbol_nodes = doc.getElementsByTagName("Symbol")
+def CompileBuildData(endianstring, xml, stats=None, dedup_verts=False):
+    # Returns the content of build.bin, xml is either the content of build.xml or a file object to read it from
+    if not hasattr(xml, "read"):
+        xml = BytesIO(xml)
+    outfile = BytesIO()
+    CompileBuildStream(endianstring, xml, outfile, stats, dedup_verts)
+    return outfile.getvalue()
+
+
+def CompileBuild(endianstring, xmlstr, outfilename, stats=None, dedup_verts=False):
+    with anim_stats.Run("compile_build", stats) as stats:
+        build = CompileBuildData(endianstring, xmlstr, stats, dedup_verts)
+
+        with anim_stats.Phase(stats, "write"):
+            with open(outfilename, "wb") as f:
+                f.write(build)
 
-    for symbol_node in symbol_nodes:  #doc.getElementsByTagName("Symbol"):
-        if symbol_node.hasAttribute("namehash"):
-            outfile.write(struct.pack(endianstring + 'I', int(symbol_node.getAttribute("namehash"))))
+
+def BuildFromJsonl(header, records, floats, hashcollection):
+    # Builds the anim_model.Build of build.jsonl, the symbol names it hashes are added to hashcollection
+    symbols = []
+    for record in records:
+        if "namehash" in record:
+            symbol_hash = int(record["namehash"])
         else:
-            symbol_name = symbol_node.attributes["name"].value.encode('ascii')
-            outfile.write(struct.pack(endianstring + 'I', strhash(symbol_name, hashcollection)))
-        outfile.write(struct.pack(endianstring + 'I', len(symbol_node.getElementsByTagName("Frame"))))
+            symbol_hash = strhash(anim_jsonl.Ascii(record["name"]), hashcollection)
+
+        frame_records = record["frames"]
+        offset = record["offset"]
+        bboxes = floats[offset:offset + 4 * len(frame_records)]
+        if len(bboxes) != 4 * len(frame_records):
+            raise FormatError("The float32 sidecar ends inside symbol " + str(record.get("name", symbol_hash)))
+        frames = []
+        for frame_idx, (framenum, duration, alphaidx, alphacount) in enumerate(frame_records):
+            x, y, w, h = bboxes[4 * frame_idx:4 * frame_idx + 4]
+            frames.append(anim_model.BuildFrame(framenum, duration, x, y, w, h, alphaidx, alphacount))
+        symbols.append(anim_model.BuildSymbol(symbol_hash, frames))
+
+    verts_offset, verts_num = header["verts"]
+    verts = floats[verts_offset:verts_offset + 6 * verts_num]
+    if len(verts) != 6 * verts_num:
+        raise FormatError("The float32 sidecar ends inside the vertices")
+
+    build_name = os.path.splitext(anim_jsonl.Ascii(header["name"]))[0]
+    textures = [anim_jsonl.Ascii(tex_name) for tex_name in header["textures"]]
+    return anim_model.Build(build_name, textures, symbols, verts)
 
-        for frame_node in symbol_node.getElementsByTagName("Frame"):
-            framenum = int(frame_node.attributes["framenum"].value)
-            duration = int(frame_node.attributes["duration"].value)
 
-            w = float(frame_node.attributes["w"].value)
-            h = float(frame_node.attributes["h"].value)
-            x = float(frame_node.attributes["x"].value)
-            y = float(frame_node.attributes["y"].value)
+def CompileBuildJsonlStream(endianstring, jsonlfile, sidecar, outfile, stats=None, dedup_verts=False):
+    # Same as CompileBuildStream for build.jsonl, sidecar is the content of its float32 sidecar
+    stats = anim_stats.Start("compile_build", stats)
+    hashcollection = {}
+    start_pos = outfile.tell()
+
+    with anim_stats.Phase(stats, "parse"):
+        floats = anim_jsonl.ReadSidecar(sidecar)
+        lines = iter(jsonlfile)
+        header = anim_jsonl.ReadHeader(next(lines, ""), "build")
+        records = list(anim_jsonl.Records(lines))
+
+    with anim_stats.Phase(stats, "model"):
+        build = BuildFromJsonl(header, records, floats, hashcollection)
+        if len(hashcollection):
+            build.hashcollection = list(hashcollection.items())
+
+    if dedup_verts:
+        with anim_stats.Phase(stats, "dedup_verts"):
+            removed = DedupVerts(build)
 
-            outfile.write(struct.pack(endianstring + 'I', framenum))
-            outfile.write(struct.pack(endianstring + 'I', duration))
-            outfile.write(struct.pack(endianstring + 'ffff', x, y, w, h))
+    with anim_stats.Phase(stats, "pack"):
+        anim_model.WriteBuildBin(endianstring, build, outfile)
 
-            alphaidx = int(frame_node.attributes["alphaidx"].value)
-            alphacount = int(frame_node.attributes["alphacount"].value)
+    if stats is not None:
+        if dedup_verts:
+            stats.Count("dedup_verts_removed", removed)
+            stats.Count("dedup_bytes_saved", removed * 24)
+        stats.Count("textures", len(build.textures))
+        stats.Count("symbols", len(build.symbols))
+        stats.Count("frames", sum(len(symbol.frames) for symbol in build.symbols))
+        stats.Count("vertices", len(build.verts) // len(anim_model.VERTEX_FIELDS))
+        stats.Count("hash_strings", len(hashcollection))
+        try:
+            stats.AddBytes(bytes_in=jsonlfile.tell() + len(sidecar))
+        except (AttributeError, IOError, ValueError):
+            pass
+        stats.AddBytes(bytes_out=outfile.tell() - start_pos)
+        anim_stats.Finish(stats)
 
-            outfile.write(struct.pack(endianstring + 'I', alphaidx))
-            outfile.write(struct.pack(endianstring + 'I', alphacount))
 
-    alphaverts = doc.getElementsByTagName("Alphavert")
-    outfile.write(struct.pack(endianstring + 'I', len(alphaverts)))
-    for vert in alphaverts:
-        outfile.write(
-            struct.pack(endianstring + 'ffffff', float(vert.attributes["x"].value), float(vert.attributes["y"].value),
-                        float(vert.attributes["z"].value), float(vert.attributes["u"].value),
-                        float(vert.attributes["v"].value), float(vert.attributes["w"].value)))
+def CompileBuildJsonlData(endianstring, jsonl, sidecar, stats=None, dedup_verts=False):
+    # Returns the content of build.bin, jsonl is either the content of build.jsonl or a file object to read it
+    # from and sidecar the content of build.f32
+    if not hasattr(jsonl, "read"):
+        jsonl = BytesIO(jsonl)
+    outfile = BytesIO()
+    CompileBuildJsonlStream(endianstring, jsonl, sidecar, outfile, stats, dedup_verts)
+    return outfile.getvalue()
+
 
-    if len(hashcollection):
-        outfile.write(struct.pack(endianstring + 'I', len(hashcollection)))
-        for hash_idx, tex_name in hashcollection.iteritems():
-            outfile.write(struct.pack(endianstring + 'I', hash_idx))
-            outfile.write(struct.pack(endianstring + 'i' + str(len(tex_name)) + 's', len(tex_name), tex_name))
+def CompileBuildJsonl(endianstring, jsonlpath, outfilename, stats=None, dedup_verts=False):
+    # Compiles build.jsonl and the float32 sidecar next to it
+    with anim_stats.Run("compile_build", stats) as stats:
+        with open(anim_jsonl.SidecarPath(jsonlpath), 'rb') as f:
+            sidecar = f.read()
+        with open(jsonlpath, 'rb') as f:
+            build = CompileBuildJsonlData(endianstring, f, sidecar, stats, dedup_verts)
 
-    with open(outfilename, "wb") as f:
-        f.write(outfile.getvalue())
+        with anim_stats.Phase(stats, "write"):
+            with open(outfilename, "wb") as f:
+                f.write(build)
 
 
 if __name__ == "__main__":
-    workspace = sys.argv[1]
-    build_path = os.path.join(workspace, "build.xml")
+    parser = argparse.ArgumentParser(description="Compile build.xml of a workspace folder into build.bin.")
+    parser.add_argument("workspace")
+    parser.add_argument("zippath", nargs="?", metavar="anim.zip",
+                        help="write build.bin into this anim.zip instead of into the workspace")
+    parser.add_argument("--stats", nargs="?", const="-", metavar="FILE",
+                        help="write a json report of the time spent per phase and the records counted to FILE "
+                        "(default: stdout)")
+    parser.add_argument("--dedup-verts", action="store_true",
+                        help="store identical vertex runs of the frames once and report the bytes saved")
+    parser.add_argument("--format", choices=anim_jsonl.FORMATS,
+                        help="compile build.xml, or build.jsonl with its float32 sidecar build.f32 (default: "
+                        "build.xml, build.jsonl when the workspace only has that one)")
+    args = parser.parse_args()
+
+    workspace = args.workspace
+    zippath = args.zippath
+    build_path, build_format = anim_jsonl.WorkspaceFile(workspace, "build", args.format)
     if not os.path.exists(build_path):
-        sys.stderr.write("Error: There is no build.xml under dictionary " + workspace + "\n")
+        sys.stderr.write("Error: There is no build." + build_format + " under dictionary " + workspace + "\n")
 
     try:
         endianstring = "<"
-        with open(build_path, 'rb') as f:
-            CompileBuild(endianstring, f.read(), outfilename=os.path.join(workspace, "build.bin"))
+        stats = anim_stats.Stats("compile_build") if args.stats or args.dedup_verts else None
+        if build_format == "jsonl":
+            if zippath:
+                with open(anim_jsonl.SidecarPath(build_path), 'rb') as f:
+                    sidecar = f.read()
+                with open(build_path, 'rb') as f:
+                    build_bin = CompileBuildJsonlData(endianstring, f, sidecar, stats, args.dedup_verts)
+                with anim_stats.Phase(stats, "write_zip"):
+                    anim_zip.WriteAnimZip(zippath, {"build.bin": build_bin})
+            else:
+                CompileBuildJsonl(endianstring, build_path, os.path.join(workspace, "build.bin"), stats,
+                                  args.dedup_verts)
+        else:
+            with open(build_path, 'rb') as f:
+                if zippath:
+                    build_bin = CompileBuildData(endianstring, f, stats, args.dedup_verts)
+                    with anim_stats.Phase(stats, "write_zip"):
+                        anim_zip.WriteAnimZip(zippath, {"build.bin": build_bin})
+                else:
+                    CompileBuild(endianstring, f.read(), outfilename=os.path.join(workspace, "build.bin"), stats=stats,
+                                 dedup_verts=args.dedup_verts)
+        if args.dedup_verts:
+            sys.stderr.write("Deduplicated vertices: {} of {} removed, {} bytes saved\n".format(
+                stats.counts["dedup_verts_removed"], stats.counts["vertices"] + stats.counts["dedup_verts_removed"],
+                stats.counts["dedup_bytes_saved"]))
+        if args.stats:
+            anim_stats.WriteReport(stats, args.stats)
 
     except:
         e = sys.exc_info()[1]
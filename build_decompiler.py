@@ -1,10 +1,26 @@
+import argparse
+import mmap
+import numbers
 import os
 import struct
 import sys
 import traceback
-import xml.dom.minidom
+from collections import OrderedDict
 from io import BytesIO
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import anim_jsonl
+import anim_model
+import anim_names
+import anim_stats
+import anim_zip
+from anim_errors import FormatError, ReadsInput
+from anim_hash import strhash
+
 BUILDVERSION = 6
 
 #BUILD format 6
@@ -32,142 +48,437 @@ BUILDVERSION = 6
 #   original string (int, string)
 
 
-def strhash(str, hashcollection):
-    hash = 0
-    for c in str:
-        v = ord(c.lower())
-        hash = (v + (hash << 6) + (hash << 16) - hash) & 0xFFFFFFFF
-    hashcollection[hash] = str
-    return hash
+def _escape(data):
+    # Same escaping as xml.dom.minidom uses for attribute values
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
 
 
-def DecompileBuild(endianstring, build, workspace):
-    hashcollection = {}
-    infile = BytesIO(build)
+def ReadAlphaverts(endianstring, build, offset, quads_num, use_numpy=True):
+    # Reads the whole vertex buffer in one go. Returns the vertices grouped by quad as lists of
+    # (x, y, z, u, v, w) and the (u1, u2, v1, v2, atlas index) bounds of every quad.
+    # The bounds start at u1 = v1 = 1 and u2 = v2 = 0, the atlas index is the w of the last vertex.
+    if use_numpy and numpy is not None:
+        vert_array = numpy.frombuffer(build, endianstring + 'f4', count=quads_num * 36, offset=offset)
+        vert_array = vert_array.reshape(quads_num, 6, 6)
+        uv = vert_array[:, :, 3:5]
+        uv_min = numpy.fmin.reduce(uv, axis=1).tolist()
+        uv_max = numpy.fmax.reduce(uv, axis=1).tolist()
+        atlas = vert_array[:, 5, 5].tolist()
+        verts = vert_array.tolist()
+    else:
+        values = struct.unpack_from(endianstring + str(quads_num * 36) + 'f', build, offset)
+        verts = [[values[i:i + 6] for i in range(q, q + 36, 6)] for q in range(0, quads_num * 36, 36)]
+        uv_min = [(min(vert[3] for vert in quad), min(vert[4] for vert in quad)) for quad in verts]
+        uv_max = [(max(vert[3] for vert in quad), max(vert[4] for vert in quad)) for quad in verts]
+        atlas = [quad[5][5] for quad in verts]
 
-    if infile.read(4).decode() != "BILD" or struct.unpack(endianstring + 'i', infile.read(4))[0] != BUILDVERSION:
-        sys.stderr.write("Error: Input file not match BUILDVERSION_" + BUILDVERSION)
-        exit(-1)
+    quad_bounds = [(u1 if u1 < 1 else 1, u2 if u2 > 0 else 0, v1 if v1 < 1 else 1, v2 if v2 > 0 else 0, w)
+                   for (u1, v1), (u2, v2), w in zip(uv_min, uv_max, atlas)]
+    return verts, quad_bounds
 
-    dom = xml.dom.minidom.Document()
-    root_node = dom.createElement('root')
-    build_root_node = dom.createElement('Build')
-    root_node.appendChild(build_root_node)
-
-    symbol_len = struct.unpack(endianstring + 'I', infile.read(4))[0]
-    frame_len_total = struct.unpack(endianstring + 'I', infile.read(4))[0]
-    build_name_len = struct.unpack(endianstring + "i", infile.read(4))[0]
-    build_name = struct.unpack(endianstring + str(build_name_len) + 's', infile.read(build_name_len))[0]
-    build_root_node.setAttribute("name", build_name.decode())
-
-    atlases_len = struct.unpack(endianstring + 'I', infile.read(4))[0]
-    for _ in range(atlases_len):
-        atlas_node = dom.createElement('Atlas')
-        root_node.appendChild(atlas_node)
-        texture_node = dom.createElement('Texture')
-        atlas_node.appendChild(texture_node)
-        namelen = struct.unpack(endianstring + "i", infile.read(4))[0]
-        name = struct.unpack(endianstring + str(namelen) + 's', infile.read(namelen))[0]
-        texture_node.setAttribute("filename", name.decode())
-        build_root_node.appendChild(texture_node.cloneNode(True))
-
-    for _ in range(symbol_len):
-        symbol_node = dom.createElement('Symbol')
-        build_root_node.appendChild(symbol_node)
-        symbol_name_hash = struct.unpack(endianstring + 'I', infile.read(4))[0]
-        symbol_node.setAttribute("namehash", str(symbol_name_hash))
-        frame_len = struct.unpack(endianstring + 'I', infile.read(4))[0]
-        for frame_idx in range(frame_len):
-            frame_node = dom.createElement('Frame')
-            symbol_node.appendChild(frame_node)
-            framenum = struct.unpack(endianstring + 'I', infile.read(4))[0]
-            frame_node.setAttribute("framenum", str(framenum))
-            duration = struct.unpack(endianstring + 'I', infile.read(4))[0]
-            frame_node.setAttribute("duration", str(duration))
-            x, y, w, h = struct.unpack(endianstring + "ffff", infile.read(16))
-            frame_node.setAttribute("w", str(w))
-            frame_node.setAttribute("h", str(h))
-            frame_node.setAttribute("x", str(x))
-            frame_node.setAttribute("y", str(y))
-            alphaidx = struct.unpack(endianstring + 'I', infile.read(4))[0]
-            frame_node.setAttribute("alphaidx", str(alphaidx))
-            alphacount = struct.unpack(endianstring + 'I', infile.read(4))[0]
-            frame_node.setAttribute("alphacount", str(alphacount))
-
-    atlas_nodes = root_node.getElementsByTagName('Atlas')
-
-    alphavertslen = struct.unpack(endianstring + 'I', infile.read(4))[0]
-    for _ in range(alphavertslen // 6):
-        u1 = v1 = 1
-        u2 = v2 = 0
-        w = 0
-        for _ in range(6):
-            x, y, z, u, v, w = struct.unpack(endianstring + "ffffff", infile.read(24))
-            alphavert_node = dom.createElement("Alphavert")
-            alphavert_node.setAttribute("x", str(x))
-            alphavert_node.setAttribute("y", str(y))
-            alphavert_node.setAttribute("z", str(z))
-            alphavert_node.setAttribute("u", str(u))
-            alphavert_node.setAttribute("v", str(v))
-            alphavert_node.setAttribute("w", str(w))
-            build_root_node.appendChild(alphavert_node)
-            u1 = min(u1, u)
-            u2 = max(u2, u)
-            v1 = min(v1, v)
-            v2 = max(v2, v)
-        for atlas_node in atlas_nodes:
-            texture_node = atlas_node.getElementsByTagName("Texture")[0]
-            if texture_node.getAttribute("filename") == "atlas-" + str(int(w)) + ".tex":
-                elements_node = atlas_node.getElementsByTagName("Elements")
-                if not len(elements_node):
-                    elements_node = dom.createElement('Elements')
-                    atlas_node.appendChild(elements_node)
-                else:
-                    elements_node = elements_node[0]
-                element_node = dom.createElement('Element')
-                element_node.setAttribute("name", str(len(elements_node.getElementsByTagName("Element"))) + ".tex")
-                element_node.setAttribute("u1", str(u1))
-                element_node.setAttribute("u2", str(u2))
-                element_node.setAttribute("v1", str(v1))
-                element_node.setAttribute("v2", str(v2))
-                elements_node.appendChild(element_node)
 
+def MapFile(f):
+    # Memory maps an open build.bin, an empty file can not be mapped and is read instead
     try:
-        hash_list = struct.unpack(endianstring + 'I', infile.read(4))[0]
-        for _ in range(hash_list):
-            hash_id, hash_len = struct.unpack(endianstring + 'Ii', infile.read(8))
-            hash_str = struct.unpack(endianstring + str(hash_len) + 's', infile.read(hash_len))[0]
-            hashcollection[str(hash_id)] = hash_str
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        return f.read()
+
+
+class BuildBinIndex(object):
+    # Random access to the symbols of a build.bin. A single skip pass over the counts records where every
+    # symbol, the vertex buffer and the trailing hash table start, nothing else is decoded up front.
+    # Frame records are fixed 32 byte records, so frames are looked up with a binary search in place.
+    @ReadsInput("build.bin")
+    def __init__(self, endianstring, build):
+        if build[0:4] != b"BILD" or struct.unpack_from(endianstring + 'i', build, 4)[0] != BUILDVERSION:
+            raise FormatError("Input file not match BUILDVERSION_" + str(BUILDVERSION))
+
+        self.endianstring = endianstring
+        self.build = build
+        self.hashcollection = None
+
+        symbol_len, frame_len_total, build_name_len = struct.unpack_from(endianstring + 'IIi', build, 8)
+        offset = 20
+        self.name = struct.unpack_from(endianstring + str(build_name_len) + 's', build, offset)[0]
+        offset += build_name_len
+
+        self.textures = []
+        atlases_len = struct.unpack_from(endianstring + 'I', build, offset)[0]
+        offset += 4
+        for _ in range(atlases_len):
+            namelen = struct.unpack_from(endianstring + "i", build, offset)[0]
+            offset += 4
+            self.textures.append(struct.unpack_from(endianstring + str(namelen) + 's', build, offset)[0])
+            offset += namelen
+
+        # symbol hash -> (offset of its first frame, num frames), in file order
+        self.symbol_hashes = []
+        self.symbols = {}
+        for _ in range(symbol_len):
+            symbol_name_hash, frame_len = struct.unpack_from(endianstring + 'II', build, offset)
+            offset += 8
+            self.symbol_hashes.append(symbol_name_hash)
+            self.symbols.setdefault(symbol_name_hash, (offset, frame_len))
+            offset += 32 * frame_len
+
+        self.verts_num = struct.unpack_from(endianstring + 'I', build, offset)[0]
+        self.verts_offset = offset + 4
+        self.hash_offset = self.verts_offset + 24 * self.verts_num
+
+    @classmethod
+    def FromFile(cls, endianstring, path):
+        with open(path, 'rb') as f:
+            return cls(endianstring, MapFile(f))
+
+    def Close(self):
+        if isinstance(self.build, mmap.mmap):
+            self.build.close()
+
+    def __len__(self):
+        return len(self.symbol_hashes)
+
+    def __contains__(self, symbol):
+        return self.SymbolHash(symbol) in self.symbols
+
+    @ReadsInput("build.bin")
+    def HashCollection(self):
+        # The hash table is optional in build.bin
+        if self.hashcollection is None:
+            self.hashcollection = {}
+            if self.hash_offset + 4 <= len(self.build):
+                hash_list = struct.unpack_from(self.endianstring + 'I', self.build, self.hash_offset)[0]
+                offset = self.hash_offset + 4
+                for _ in range(hash_list):
+                    hash_id, hash_len = struct.unpack_from(self.endianstring + 'Ii', self.build, offset)
+                    offset += 8
+                    self.hashcollection[hash_id] = struct.unpack_from(
+                        self.endianstring + str(hash_len) + 's', self.build, offset)[0]
+                    offset += hash_len
+        return self.hashcollection
+
+    def SymbolHash(self, symbol):
+        # Symbols are given either by hash or by name
+        if isinstance(symbol, numbers.Integral):
+            return symbol
+        return strhash(symbol, {})
+
+    @ReadsInput("build.bin")
+    def ReadFrame(self, frames_offset, frame_idx):
+        # (framenum, duration, x, y, w, h, alphaidx, alphacount)
+        return struct.unpack_from(self.endianstring + 'IIffffII', self.build, frames_offset + 32 * frame_idx)
+
+    def Frames(self, symbol):
+        frames_offset, frame_len = self.symbols[self.SymbolHash(symbol)]
+        return [self.ReadFrame(frames_offset, frame_idx) for frame_idx in range(frame_len)]
+
+    @ReadsInput("build.bin")
+    def ReadVerts(self, alphaidx, alphacount, use_numpy=True):
+        # The (alphacount, 6) x, y, z, u, v, w of a frame, a list of tuples without numpy
+        offset = self.verts_offset + 24 * alphaidx
+        if use_numpy and numpy is not None:
+            return numpy.frombuffer(self.build, self.endianstring + 'f4', count=alphacount * 6,
+                                    offset=offset).reshape(alphacount, 6)
+        values = struct.unpack_from(self.endianstring + str(alphacount * 6) + 'f', self.build, offset)
+        return [values[i:i + 6] for i in range(0, alphacount * 6, 6)]
+
+    @ReadsInput("build.bin")
+    def Lookup(self, symbol, framenum, use_numpy=True, strict=False):
+        # Resolves framenum the way the game does: frames are sorted by framenum and each one is shown for
+        # duration frames, so the frame used is the last one starting at or before framenum. "covered" is
+        # False when framenum is not inside the duration of that frame: before the first frame (which then
+        # resolves to the first one), in a gap between two frames or past the end of the last one. Those
+        # keep resolving to the nearest earlier frame, with strict they return None instead.
+        # Returns None for a symbol without frames, raises KeyError for an unknown symbol.
+        frames_offset, frame_len = self.symbols[self.SymbolHash(symbol)]
+        if not frame_len:
+            return None
+
+        lo, hi = 0, frame_len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if struct.unpack_from(self.endianstring + 'I', self.build, frames_offset + 32 * mid)[0] <= framenum:
+                lo = mid + 1
+            else:
+                hi = mid
+        frame_num, duration, x, y, w, h, alphaidx, alphacount = self.ReadFrame(frames_offset, max(lo - 1, 0))
+        covered = frame_num <= framenum < frame_num + max(duration, 1)
+        if strict and not covered:
+            return None
+        return {
+            "framenum": frame_num,
+            "duration": duration,
+            "covered": covered,
+            "x": x,
+            "y": y,
+            "w": w,
+            "h": h,
+            "alphaidx": alphaidx,
+            "alphacount": alphacount,
+            "verts": self.ReadVerts(alphaidx, alphacount, use_numpy),
+        }
+
+
+def SymbolNames(build):
+    # Maps the hash of every symbol that gets a name to it. Symbols are named from the hash table in order
+    # until one is missing from it, the rest keep their namehash.
+    names = {}
+    hashcollection = build.HashDict()
+    if build.hashcollection is not None:
+        for symbol in build.symbols:
+            if symbol.hash not in hashcollection:
+                break
+            if hashcollection[symbol.hash]:
+                names[symbol.hash] = hashcollection[symbol.hash]
+    return names
+
+
+def ResolveSymbolNames(build, names):
+    # Adds the strings of the hash table to the anim_names.NameDictionary names, and the names it knows of
+    # symbols missing from the hash table to the table
+    names.AddHashCollection(build.hashcollection or ())
+    hashcollection = build.HashDict()
+    found = []
+    for symbol in build.symbols:
+        if not hashcollection.get(symbol.hash):
+            name = names.Lookup(symbol.hash)
+            if name is not None:
+                found.append((symbol.hash, name))
+                hashcollection[symbol.hash] = name
+    if found:
+        build.hashcollection = (build.hashcollection or []) + found
+
+
+def AtlasXmls(textures, quad_bounds):
+    # The (filename, content) of the xml of every atlas, listing the quads drawn from its texture.
+    # Every atlas keeps the filename of its texture and the list of its Elements, atlas_index maps a texture
+    # filename to the atlases using it so a quad finds its atlases without scanning all of them
+    atlases = []
+    atlas_index = {}
+    for name in textures:
+        atlas = (name, [])
+        atlases.append(atlas)
+        atlas_index.setdefault(atlas[0], []).append(atlas[1])
 
-        node_list = build_root_node.getElementsByTagName("Symbol")
+    for u1, u2, v1, v2, w in quad_bounds:
+        for elements in atlas_index.get("atlas-" + str(int(w)) + ".tex", ()):
+            elements.append('<Element name="%d.tex" u1="%s" u2="%s" v1="%s" v2="%s"/>' %
+                            (len(elements), u1, u2, v1, v2))
 
-        for node in node_list:
-            hash_id = node.getAttribute("namehash")
-            if hashcollection[hash_id]:
-                node.removeAttribute("namehash")
-                node.setAttribute("name", hashcollection[hash_id])
-    except:
-        pass
+    atlas_xmls = []
+    for filename, elements in atlases:
+        atlas_xml = '<Atlas><Texture filename="%s"/>' % _escape(filename)
+        if elements:
+            atlas_xml += '<Elements>' + ''.join(elements) + '</Elements>'
+        atlas_xml += '</Atlas>'
+        atlas_xmls.append((filename[:-4] + ".xml", atlas_xml))
+    return atlas_xmls
 
-    with open(os.path.join(workspace, "build.xml"), "wb") as f:
-        build_root_node.writexml(f, indent='', addindent='\t', newl='\n')
 
-    for atlas_root in root_node.getElementsByTagName('Atlas'):
-        texture_node = atlas_root.getElementsByTagName("Texture")[0]
-        with open(os.path.join(workspace, texture_node.getAttribute("filename")[:-4] + ".xml"), "wb") as f:
-            atlas_root.writexml(f)
+def WriteBuildXml(outfile, build, verts):
+    # Writes build.xml of an anim_model.Build in the layout xml.dom.minidom gave it, verts are the vertices
+    # grouped by quad as returned by ReadAlphaverts
+    names = SymbolNames(build)
+    outfile.write('<Build name="%s"' % _escape(build.name))
+    if not build.textures and not build.symbols and not len(verts):
+        outfile.write('/>\n')
+        return
+    outfile.write('>\n')
+
+    for tex_name in build.textures:
+        outfile.write('\t<Texture filename="%s"/>\n' % _escape(tex_name))
+
+    for symbol in build.symbols:
+        if symbol.hash in names:
+            lines = ['\t<Symbol name="%s"' % _escape(names[symbol.hash])]
+        else:
+            lines = ['\t<Symbol namehash="%s"' % str(symbol.hash)]
+        for frame in symbol.frames:
+            lines.append('\t\t<Frame alphacount="%s" alphaidx="%s" duration="%s" framenum="%s" h="%s" w="%s" x="%s" '
+                         'y="%s"/>\n' % (str(frame.alphacount), str(frame.alphaidx), str(frame.duration),
+                                        str(frame.framenum), str(frame.h), str(frame.w), str(frame.x), str(frame.y)))
+        if len(lines) > 1:
+            lines[0] += '>\n'
+            lines.append('\t</Symbol>\n')
+        else:
+            lines[0] += '/>\n'
+        outfile.write(''.join(lines))
+
+    for quad in verts:
+        outfile.write(''.join([
+            '\t<Alphavert u="%s" v="%s" w="%s" x="%s" y="%s" z="%s"/>\n' % (u, v, w, x, y, z)
+            for x, y, z, u, v, w in quad
+        ]))
+    outfile.write('</Build>\n')
+
+
+def DecompileBuildStream(endianstring, build, outfile, stats=None, names=None):
+    # Writes build.xml to outfile and returns the (filename, content) of the xml of every atlas.
+    # With names, an anim_names.NameDictionary, symbols missing from the hash table are looked up in it.
+    stats = anim_stats.Start("decompile_build", stats)
+    start_pos = outfile.tell()
+
+    with anim_stats.Phase(stats, "read"):
+        model = anim_model.ReadBuildBin(endianstring, build)
+        if names is not None:
+            ResolveSymbolNames(model, names)
+
+    with anim_stats.Phase(stats, "verts"):
+        # The model keeps the vertices in the byte order of this machine
+        verts, quad_bounds = ReadAlphaverts("=", model.verts, 0, len(model.verts) // 36)
+
+    with anim_stats.Phase(stats, "write"):
+        WriteBuildXml(outfile, model, verts)
+
+    with anim_stats.Phase(stats, "atlas"):
+        atlas_xmls = AtlasXmls(model.textures, quad_bounds)
+
+    if stats is not None:
+        stats.Count("textures", len(model.textures))
+        stats.Count("symbols", len(model.symbols))
+        stats.Count("frames", sum(len(symbol.frames) for symbol in model.symbols))
+        stats.Count("vertices", len(model.verts) // len(anim_model.VERTEX_FIELDS))
+        stats.Count("hash_strings", len(model.hashcollection or ()))
+        stats.AddBytes(bytes_in=len(build), bytes_out=outfile.tell() - start_pos)
+        stats.AddBytes(bytes_out=sum(len(atlas_xml) for _, atlas_xml in atlas_xmls))
+        anim_stats.Finish(stats)
+    return atlas_xmls
+
+
+def DecompileBuildData(endianstring, build, stats=None, names=None):
+    # Returns the content of build.xml and the (filename, content) of the xml of every atlas
+    outfile = BytesIO()
+    atlas_xmls = DecompileBuildStream(endianstring, build, outfile, stats, names)
+    return outfile.getvalue(), atlas_xmls
+
+
+def DecompileBuild(endianstring, build, workspace, stats=None, names=None):
+    with anim_stats.Run("decompile_build", stats) as stats:
+        build_xml, atlas_xmls = DecompileBuildData(endianstring, build, stats, names)
+        with anim_stats.Phase(stats, "write_files"):
+            with open(os.path.join(workspace, "build.xml"), "wb") as f:
+                f.write(build_xml)
+            for filename, atlas_xml in atlas_xmls:
+                with open(os.path.join(workspace, filename), "wb") as f:
+                    f.write(atlas_xml)
+
+
+def DecompileBuildJsonlStream(endianstring, build, outfile, sidecarfile, stats=None, names=None):
+    # Same as DecompileBuildStream, but writes build.jsonl to outfile and its floats to sidecarfile
+    stats = anim_stats.Start("decompile_build", stats)
+    start_pos = outfile.tell()
+
+    with anim_stats.Phase(stats, "read"):
+        model = anim_model.ReadBuildBin(endianstring, build)
+        if names is not None:
+            ResolveSymbolNames(model, names)
+
+    # Only whole quads, the same as build.xml has
+    with anim_stats.Phase(stats, "verts"):
+        quads_num = len(model.verts) // 36
+        quad_verts = model.verts[:quads_num * 36]
+        quad_bounds = ReadAlphaverts("=", model.verts, 0, quads_num)[1]
+
+    with anim_stats.Phase(stats, "write"):
+        sidecar = anim_jsonl.Sidecar(sidecarfile)
+        verts_offset = sidecar.Add(quad_verts)
+        anim_jsonl.DumpLine(outfile, anim_jsonl.Header(
+            "build", ("name", model.name), ("textures", model.textures), ("verts", [verts_offset, quads_num * 6])))
+
+        # Every symbol found in the hash table is named, build.xml stops at the first one that is missing
+        symbol_names = dict((hash_idx, name) for hash_idx, name in model.HashDict().items() if name)
+        for symbol in model.symbols:
+            frames = symbol.frames
+            offset = sidecar.Add([value for frame in frames for value in (frame.x, frame.y, frame.w, frame.h)])
+            if symbol.hash in symbol_names:
+                record = OrderedDict([("name", symbol_names[symbol.hash])])
+            else:
+                record = OrderedDict([("namehash", symbol.hash)])
+            record["offset"] = offset
+            record["frames"] = [[frame.framenum, frame.duration, frame.alphaidx, frame.alphacount] for frame in frames]
+            anim_jsonl.DumpLine(outfile, record)
+        sidecar.Flush()
+
+    with anim_stats.Phase(stats, "atlas"):
+        atlas_xmls = AtlasXmls(model.textures, quad_bounds)
+
+    if stats is not None:
+        stats.Count("textures", len(model.textures))
+        stats.Count("symbols", len(model.symbols))
+        stats.Count("frames", sum(len(symbol.frames) for symbol in model.symbols))
+        stats.Count("vertices", len(model.verts) // len(anim_model.VERTEX_FIELDS))
+        stats.Count("hash_strings", len(model.hashcollection or ()))
+        stats.AddBytes(bytes_in=len(build), bytes_out=outfile.tell() - start_pos + 4 * sidecar.base)
+        stats.AddBytes(bytes_out=sum(len(atlas_xml) for _, atlas_xml in atlas_xmls))
+        anim_stats.Finish(stats)
+    return atlas_xmls
+
+
+def DecompileBuildJsonlData(endianstring, build, stats=None, names=None):
+    # Returns the content of build.jsonl, of its float32 sidecar and the (filename, content) of the xml of
+    # every atlas
+    outfile = BytesIO()
+    sidecarfile = BytesIO()
+    atlas_xmls = DecompileBuildJsonlStream(endianstring, build, outfile, sidecarfile, stats, names)
+    return outfile.getvalue(), sidecarfile.getvalue(), atlas_xmls
+
+
+def DecompileBuildJsonl(endianstring, build, workspace, stats=None, names=None):
+    with anim_stats.Run("decompile_build", stats) as stats:
+        build_jsonl, sidecar, atlas_xmls = DecompileBuildJsonlData(endianstring, build, stats, names)
+        with anim_stats.Phase(stats, "write_files"):
+            with open(os.path.join(workspace, "build.jsonl"), "wb") as f:
+                f.write(build_jsonl)
+            with open(os.path.join(workspace, "build.f32"), "wb") as f:
+                f.write(sidecar)
+            for filename, atlas_xml in atlas_xmls:
+                with open(os.path.join(workspace, filename), "wb") as f:
+                    f.write(atlas_xml)
 
 
 if __name__ == "__main__":
-    workspace = sys.argv[1]
-    build_path = os.path.join(workspace, "build.bin")
-    if not os.path.exists(build_path):
-        sys.stderr.write("Error: There is no anim.bin under dictionary " + workspace + "\n")
+    parser = argparse.ArgumentParser(description="Decompile build.bin of a workspace folder or anim.zip into build.xml.")
+    parser.add_argument("workspace", help="workspace folder, or an anim.zip which is read directly and whose "
+                        "build.xml goes to the folder named after it (\"foo.zip\" -> \"foo\")")
+    parser.add_argument("--format", choices=anim_jsonl.FORMATS, default="xml",
+                        help="write build.xml, or build.jsonl with its float32 sidecar build.f32 (default: xml)")
+    parser.add_argument("--stats", nargs="?", const="-", metavar="FILE",
+                        help="write a json report of the time spent per phase and the records counted to FILE "
+                        "(default: stdout)")
+    parser.add_argument("--names", metavar="DATABASE",
+                        help="reverse hash dictionary (see anim_names.py) the strings of the hash table are added "
+                        "to and missing strings are looked up in")
+    args = parser.parse_args()
+
+    workspace = args.workspace
+    zippath = None
+    if anim_zip.IsAnimZip(workspace):
+        zippath = workspace
+        workspace = anim_zip.ZipWorkspace(zippath)
+        build_path = zippath + "/build.bin"
+    else:
+        build_path = os.path.join(workspace, "build.bin")
+        if not os.path.exists(build_path):
+            sys.stderr.write("Error: There is no build.bin under dictionary " + workspace + "\n")
 
     try:
         endianstring = "<"
-        with open(build_path, 'rb') as f:
-            DecompileBuild(endianstring, f.read(), workspace)
+        stats = anim_stats.Stats("decompile_build") if args.stats else None
+        decompile = DecompileBuildJsonl if args.format == "jsonl" else DecompileBuild
+        names = anim_names.NameDictionary(args.names) if args.names else None
+        if zippath:
+            if not os.path.isdir(workspace):
+                os.makedirs(workspace)
+            with anim_stats.Phase(stats, "read_zip"):
+                build = anim_zip.ReadZipEntry(zippath, "build.bin")
+            decompile(endianstring, build, workspace, stats, names)
+        else:
+            with open(build_path, 'rb') as f:
+                decompile(endianstring, f.read(), workspace, stats, names)
+        if names is not None:
+            names.Close()
+        if stats is not None:
+            anim_stats.WriteReport(stats, args.stats)
 
     except:  # catch *all* exceptions
         e = sys.exc_info()[1]
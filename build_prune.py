@@ -0,0 +1,98 @@
+import argparse
+import bisect
+import sys
+import traceback
+from io import BytesIO
+
+import anim_model
+import anim_zip
+
+# Removes the symbols and frames of a build.bin that none of the given anim.bin files use.
+#
+# Every element of an anim refers to a build symbol by hash and to one of its frames by frame number, the
+# frame shown is the last one starting at or before that number (see BuildBinIndex.Lookup). Only those
+# frames are kept, together with their vertex runs, alphaidx is remapped to the smaller vertex buffer and
+# the hash table keeps just the names of the symbols left.
+
+
+def CollectReferences(endianstring, anims):
+    # The (symbol hash, frame number) pairs used by the elements of the anim.bin contents in anims
+    references = set()
+    for anim in anims:
+        for record in anim_model.ReadAnimBin(endianstring, anim).anims:
+            references.update(zip(record.elements["name"].tolist(), record.elements["frame"].tolist()))
+    return references
+
+
+def PruneBuild(build, references):
+    # Prunes the anim_model.Build in place, returns (symbols, frames, vertices) removed
+    framenums = {}
+    for hash_idx, framenum in references:
+        framenums.setdefault(hash_idx, set()).add(framenum)
+
+    verts = build.verts
+    symbols = []
+    runs = {}
+    pruned = anim_model.Column("f")
+    frames_removed = 0
+    for symbol in build.symbols:
+        if symbol.hash not in framenums or not symbol.frames:
+            frames_removed += len(symbol.frames)
+            continue
+
+        starts = [frame.framenum for frame in symbol.frames]
+        used = set(max(bisect.bisect_right(starts, framenum) - 1, 0) for framenum in framenums[symbol.hash])
+        frames = [frame for idx, frame in enumerate(symbol.frames) if idx in used]
+        frames_removed += len(symbol.frames) - len(frames)
+
+        # Frames sharing a vertex run keep sharing it
+        for frame in frames:
+            run = (frame.alphaidx, frame.alphacount)
+            if run not in runs:
+                runs[run] = len(pruned) // 6
+                pruned.extend(verts[frame.alphaidx * 6:(frame.alphaidx + frame.alphacount) * 6])
+            frame.alphaidx = runs[run]
+        symbol.frames = frames
+        symbols.append(symbol)
+
+    symbols_removed = len(build.symbols) - len(symbols)
+    verts_removed = (len(verts) - len(pruned)) // 6
+    build.symbols = symbols
+    build.verts = pruned
+    if build.hashcollection is not None:
+        kept = set(symbol.hash for symbol in symbols)
+        build.hashcollection = [(hash_idx, name) for hash_idx, name in build.hashcollection if hash_idx in kept]
+    return symbols_removed, frames_removed, verts_removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove the symbols and frames of a build.bin that no anim uses.")
+    parser.add_argument("build", help="build.bin, or an anim.zip holding it")
+    parser.add_argument("anims", nargs="+", help="anim.bin files, or anim.zip files holding one")
+    parser.add_argument("--output", "-o", help="file the pruned build.bin is written to (default: overwrite build)")
+    args = parser.parse_args()
+
+    try:
+        endianstring = "<"
+        build_data = anim_zip.ReadBin(args.build, "build.bin")
+        build = anim_model.ReadBuildBin(endianstring, build_data)
+        references = CollectReferences(endianstring, [anim_zip.ReadBin(path, "anim.bin") for path in args.anims])
+        symbols_num = len(build.symbols)
+        frames_num = sum(len(symbol.frames) for symbol in build.symbols)
+        verts_num = len(build.verts) // 6
+
+        symbols_removed, frames_removed, verts_removed = PruneBuild(build, references)
+
+        outfile = BytesIO()
+        anim_model.WriteBuildBin(endianstring, build, outfile)
+        anim_zip.WriteBin(args.output or args.build, "build.bin", outfile.getvalue())
+
+        sys.stdout.write("Removed {} of {} symbols, {} of {} frames, {} of {} vertices: {} -> {} bytes\n".format(
+            symbols_removed, symbols_num, frames_removed, frames_num, verts_removed, verts_num, len(build_data),
+            len(outfile.getvalue())))
+
+    except:  # catch *all* exceptions
+        e = sys.exc_info()[1]
+        sys.stderr.write("Error Pruning {}\n".format(args.build) + str(e) + "\n")
+        traceback.print_exc(file=sys.stderr)
+        exit(-1)
@@ -0,0 +1,348 @@
+import argparse
+import multiprocessing
+import os
+import struct
+import sys
+import time
+import traceback
+import zlib
+from xml.etree import cElementTree as ElementTree
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import anim_model
+import anim_zip
+import build_decompiler
+from anim_errors import FormatError
+
+# Reads Klei textures (atlas-*.tex) and exports the Elements of their atlas as PNG.
+#
+# KTEX format
+# 'KTEX'
+# header (uint32 bit field, lowest bits first)
+#   platform (4), pixel format (5), texture type (4), num mips (5), flags (2), fill (12, all ones)
+#   before the Caves update: platform (3), pixel format (3), texture type (3), num mips (4), flags (1),
+#   fill (18, all ones)
+# num mips times
+#   width, height, pitch (uint16), data size (uint32)
+# the data of every mip in the same order, the first one is the full size texture
+#
+# Rows are stored bottom up, images are flipped when read so row 0 is the top one. An Element covers
+# u1..u2 from the left and v1..v2 from the bottom of its texture.
+#
+# The DXT blocks of a whole texture are decoded at once with numpy, the palettes are computed the way
+# libsquish (used by the Klei tools) does.
+
+PIXEL_DXT1 = 0
+PIXEL_DXT3 = 1
+PIXEL_DXT5 = 2
+PIXEL_RGBA = 4
+PIXEL_RGB = 5
+
+DXT_BLOCK_SIZE = {PIXEL_DXT1: 8, PIXEL_DXT3: 16, PIXEL_DXT5: 16}
+
+# (shift, bits) of platform, pixel format, texture type, num mips, flags and fill, and the fill value
+HEADER_LAYOUTS = (
+    (((0, 4), (4, 5), (9, 4), (13, 5), (18, 2), (20, 12)), 0xFFF),
+    (((0, 3), (3, 3), (6, 3), (9, 4), (13, 1), (14, 18)), 0x3FFFF),
+)
+
+
+class KtexMip(object):
+    __slots__ = ("width", "height", "pitch", "offset", "size")
+
+    def __init__(self, width, height, pitch, offset, size):
+        self.width = width
+        self.height = height
+        self.pitch = pitch
+        self.offset = offset
+        self.size = size
+
+
+class Ktex(object):
+    __slots__ = ("platform", "pixel_format", "texture_type", "flags", "mips")
+
+    def __init__(self, platform, pixel_format, texture_type, flags, mips):
+        self.platform = platform
+        self.pixel_format = pixel_format
+        self.texture_type = texture_type
+        self.flags = flags
+        self.mips = mips
+
+
+def ReadKtexHeader(data):
+    # The Ktex of the texture in data. The header layout whose mip table fits the length of data wins, the
+    # one in use since the Caves update is tried first.
+    if data[0:4] != b"KTEX" or len(data) < 8:
+        raise FormatError("Input file is not a KTEX texture")
+    header = struct.unpack_from("<I", data, 4)[0]
+    for layout, fill in HEADER_LAYOUTS:
+        fields = [(header >> shift) & ((1 << bits) - 1) for shift, bits in layout]
+        platform, pixel_format, texture_type, mips_num, flags, header_fill = fields
+        if header_fill != fill or len(data) < 8 + 10 * mips_num:
+            continue
+        mips = []
+        offset = 8 + 10 * mips_num
+        for i in range(mips_num):
+            width, height, pitch, size = struct.unpack_from("<HHHI", data, 8 + 10 * i)
+            mips.append(KtexMip(width, height, pitch, offset, size))
+            offset += size
+        if offset == len(data):
+            return Ktex(platform, pixel_format, texture_type, flags, mips)
+    raise FormatError("The KTEX header does not match the size of the texture")
+
+
+def _Expand565(colors):
+    # uint16 565 colors -> int32 (n, 3) rgb, the low bits repeat the high ones like libsquish does
+    r = (colors >> 11) & 31
+    g = (colors >> 5) & 63
+    b = colors & 31
+    return numpy.stack(((r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)), axis=-1)
+
+
+def _DecodeColors(blocks, dxt1):
+    # (n, 16, 4) rgba of the 8 byte color part of n blocks
+    num = len(blocks)
+    words = numpy.ascontiguousarray(blocks[:, 0:4]).view("<u2").astype(numpy.int32)
+    c0 = words[:, 0]
+    c1 = words[:, 1]
+    p0 = _Expand565(c0)
+    p1 = _Expand565(c1)
+
+    palette = numpy.empty((num, 4, 4), numpy.uint8)
+    palette[:, 0, :3] = p0
+    palette[:, 1, :3] = p1
+    palette[:, :, 3] = 255
+    if dxt1:
+        # A block whose first color is not the larger one has 3 colors and transparent black
+        four = (c0 > c1)[:, None]
+        palette[:, 2, :3] = numpy.where(four, (2 * p0 + p1) // 3, (p0 + p1) // 2)
+        palette[:, 3, :3] = numpy.where(four, (p0 + 2 * p1) // 3, 0)
+        palette[:, 3, 3] = numpy.where(four[:, 0], 255, 0)
+    else:
+        palette[:, 2, :3] = (2 * p0 + p1) // 3
+        palette[:, 3, :3] = (p0 + 2 * p1) // 3
+
+    indices = numpy.ascontiguousarray(blocks[:, 4:8]).view("<u4")
+    selectors = (indices >> (2 * numpy.arange(16, dtype=numpy.uint32))) & 3
+    return palette[numpy.arange(num)[:, None], selectors]
+
+
+def _DecodeDxt3Alpha(blocks):
+    # (n, 16) alpha of the explicit 4 bit alpha part of n DXT3 blocks
+    bits = numpy.ascontiguousarray(blocks[:, 0:8]).view("<u8")
+    return (((bits >> (4 * numpy.arange(16, dtype=numpy.uint64))) & 15) * 17).astype(numpy.uint8)
+
+
+def _DecodeDxt5Alpha(blocks):
+    # (n, 16) alpha of the interpolated alpha part of n DXT5 blocks
+    num = len(blocks)
+    a0 = blocks[:, 0].astype(numpy.int32)
+    a1 = blocks[:, 1].astype(numpy.int32)
+    eight = (a0 > a1)[:, None]
+    steps = numpy.arange(1, 7, dtype=numpy.int32)
+    palette = numpy.empty((num, 8), numpy.int32)
+    palette[:, 0] = a0
+    palette[:, 1] = a1
+    # 6 interpolated alphas, or 4 and then 0 and 255
+    palette[:, 2:8] = numpy.where(eight, ((7 - steps) * a0[:, None] + steps * a1[:, None]) // 7,
+                                  ((5 - steps) * a0[:, None] + steps * a1[:, None]) // 5)
+    palette[:, 6] = numpy.where(eight[:, 0], palette[:, 6], 0)
+    palette[:, 7] = numpy.where(eight[:, 0], palette[:, 7], 255)
+
+    bits = numpy.zeros(num, numpy.uint64)
+    for i in range(6):
+        bits |= blocks[:, 2 + i].astype(numpy.uint64) << numpy.uint64(8 * i)
+    selectors = (bits[:, None] >> (3 * numpy.arange(16, dtype=numpy.uint64))) & 7
+    return palette[numpy.arange(num)[:, None], selectors.astype(numpy.intp)].astype(numpy.uint8)
+
+
+def DecodeDxt(data, width, height, pixel_format):
+    # (height, width, 4) rgba of DXT1/3/5 data, rows top down as stored
+    block_size = DXT_BLOCK_SIZE[pixel_format]
+    blocks_w = (width + 3) // 4
+    blocks_h = (height + 3) // 4
+    num = blocks_w * blocks_h
+    if len(data) < num * block_size:
+        raise FormatError("The KTEX data ends inside a mip")
+    blocks = numpy.frombuffer(data, numpy.uint8, num * block_size).reshape(num, block_size)
+
+    if pixel_format == PIXEL_DXT1:
+        pixels = _DecodeColors(blocks, True)
+    else:
+        pixels = _DecodeColors(blocks[:, 8:16], False)
+        if pixel_format == PIXEL_DXT3:
+            pixels[:, :, 3] = _DecodeDxt3Alpha(blocks)
+        else:
+            pixels[:, :, 3] = _DecodeDxt5Alpha(blocks)
+
+    # (blocks_h, blocks_w, 4 rows, 4 columns, rgba) -> rows of pixels
+    pixels = pixels.reshape(blocks_h, blocks_w, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    return pixels.reshape(blocks_h * 4, blocks_w * 4, 4)[:height, :width]
+
+
+def DecodeMip(data, ktex, mip_idx=0):
+    # (height, width, 4) rgba of a mip, flipped so row 0 is the top one
+    mip = ktex.mips[mip_idx]
+    mip_data = data[mip.offset:mip.offset + mip.size]
+    if ktex.pixel_format in DXT_BLOCK_SIZE:
+        pixels = DecodeDxt(mip_data, mip.width, mip.height, ktex.pixel_format)
+    elif ktex.pixel_format in (PIXEL_RGBA, PIXEL_RGB):
+        channels = 4 if ktex.pixel_format == PIXEL_RGBA else 3
+        pitch = mip.pitch or mip.width * channels
+        if len(mip_data) < pitch * mip.height:
+            raise FormatError("The KTEX data ends inside a mip")
+        rows = numpy.frombuffer(mip_data, numpy.uint8, pitch * mip.height).reshape(mip.height, pitch)
+        pixels = numpy.empty((mip.height, mip.width, 4), numpy.uint8)
+        pixels[:, :, :channels] = rows[:, :mip.width * channels].reshape(mip.height, mip.width, channels)
+        if channels == 3:
+            pixels[:, :, 3] = 255
+    else:
+        raise FormatError("Unsupported KTEX pixel format " + str(ktex.pixel_format))
+    return pixels[::-1]
+
+
+def ReadKtex(data):
+    # The full size image of a KTEX texture as (height, width, 4) rgba, top row first
+    if numpy is None:
+        raise ImportError("numpy is needed to decode KTEX textures")
+    return DecodeMip(data, ReadKtexHeader(data))
+
+
+def Unpremultiply(pixels):
+    # Klei textures have their colors multiplied by alpha, this divides it out again
+    alpha = pixels[:, :, 3:4].astype(numpy.uint32)
+    rgb = (pixels[:, :, :3].astype(numpy.uint32) * 255 + alpha // 2) // numpy.maximum(alpha, 1)
+    result = pixels.copy()
+    result[:, :, :3] = numpy.minimum(rgb, 255)
+    return result
+
+
+def WritePng(outfile, pixels):
+    # Writes (height, width, 4) rgba as an 8 bit RGBA PNG, every row with filter type 0
+    height, width = pixels.shape[:2]
+    rows = numpy.zeros((height, width * 4 + 1), numpy.uint8)
+    rows[:, 1:] = pixels.reshape(height, width * 4)
+
+    def Chunk(kind, body):
+        outfile.write(struct.pack(">I", len(body)) + kind + body)
+        outfile.write(struct.pack(">I", zlib.crc32(kind + body) & 0xFFFFFFFF))
+
+    outfile.write(b"\x89PNG\r\n\x1a\n")
+    Chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+    Chunk(b"IDAT", zlib.compress(rows.tostring(), 6))
+    Chunk(b"IEND", b"")
+
+
+def AtlasElements(atlas_xml):
+    # The texture filename of an atlas xml and the (name, u1, u2, v1, v2) of its Elements
+    root = ElementTree.fromstring(atlas_xml)
+    texture = root.find("Texture").get("filename")
+    elements = [(node.get("name"), float(node.get("u1")), float(node.get("u2")), float(node.get("v1")),
+                 float(node.get("v2"))) for node in root.iter("Element")]
+    return texture, elements
+
+
+def CropElement(pixels, u1, u2, v1, v2):
+    # The part of a texture an Element covers, v counts from the bottom
+    height, width = pixels.shape[:2]
+    left = int(round(u1 * width))
+    right = max(int(round(u2 * width)), left + 1)
+    top = int(round((1 - v2) * height))
+    bottom = max(int(round((1 - v1) * height)), top + 1)
+    return pixels[top:bottom, left:right]
+
+
+def ExportAtlas(args):
+    # Runs in a worker process, crops every Element of one atlas out of its texture into folder/<name>.png.
+    # Failures are returned instead of raised so one bad texture can not stop the others.
+    source, texture, elements, folder, unpremultiply = args
+    start = time.time()
+    try:
+        pixels = ReadKtex(anim_zip.ReadBin(source if anim_zip.IsAnimZip(source) else os.path.join(source, texture),
+                                           texture))
+        if unpremultiply:
+            pixels = Unpremultiply(pixels)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        for name, u1, u2, v1, v2 in elements:
+            with open(os.path.join(folder, os.path.splitext(name)[0] + ".png"), "wb") as f:
+                WritePng(f, CropElement(pixels, u1, u2, v1, v2))
+    except Exception:
+        return texture, 0, traceback.format_exc(), time.time() - start
+    return texture, len(elements), None, time.time() - start
+
+
+def WorkspaceAtlases(workspace, zippath=None):
+    # (texture, elements) of every atlas: from the atlas-*.xml files the build decompiler wrote to workspace,
+    # otherwise from build.bin
+    names = sorted(os.listdir(workspace)) if os.path.isdir(workspace) else []
+    atlas_xmls = []
+    for name in names:
+        if name.startswith("atlas-") and name.endswith(".xml"):
+            with open(os.path.join(workspace, name), "rb") as f:
+                atlas_xmls.append(f.read())
+    if not atlas_xmls:
+        build = anim_zip.ReadBin(zippath or os.path.join(workspace, "build.bin"), "build.bin")
+        model = anim_model.ReadBuildBin("<", build)
+        quad_bounds = build_decompiler.ReadAlphaverts("=", model.verts, 0, len(model.verts) // 36)[1]
+        atlas_xmls = [atlas_xml for _, atlas_xml in build_decompiler.AtlasXmls(model.textures, quad_bounds)]
+    return [AtlasElements(atlas_xml) for atlas_xml in atlas_xmls]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the atlas Elements of the textures of a workspace as PNG.")
+    parser.add_argument("workspace", help="workspace folder, or an anim.zip whose textures are read directly")
+    parser.add_argument("--output", "-o",
+                        help="folder the PNGs go to, one subfolder per texture (default: the workspace)")
+    parser.add_argument("--jobs", "-j", type=int, default=multiprocessing.cpu_count(),
+                        help="number of worker processes (default: number of cpus)")
+    parser.add_argument("--unpremultiply", action="store_true",
+                        help="divide the colors by alpha, Klei textures store them premultiplied")
+    args = parser.parse_args()
+
+    if numpy is None:
+        sys.stderr.write("Error: numpy is needed to decode KTEX textures\n")
+        exit(-1)
+
+    source = args.workspace
+    zippath = source if anim_zip.IsAnimZip(source) else None
+    workspace = anim_zip.ZipWorkspace(zippath) if zippath else source
+    try:
+        output = args.output or workspace
+        tasks = [(source, texture, elements, os.path.join(output, os.path.splitext(texture)[0]), args.unpremultiply)
+                 for texture, elements in WorkspaceAtlases(workspace, zippath)]
+    except:  # catch *all* exceptions
+        e = sys.exc_info()[1]
+        sys.stderr.write("Error Exporting {}\n".format(source) + str(e) + "\n")
+        traceback.print_exc(file=sys.stderr)
+        exit(-1)
+
+    start = time.time()
+    if args.jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(tasks)))
+        results = pool.imap_unordered(ExportAtlas, tasks)
+    else:
+        pool = None
+        results = (ExportAtlas(task) for task in tasks)
+
+    failed = 0
+    elements_num = 0
+    for texture, num, error, elapsed in results:
+        elements_num += num
+        if error is None:
+            sys.stdout.write("OK   {} ({} elements) {:.2f}s\n".format(texture, num, elapsed))
+        else:
+            failed += 1
+            sys.stdout.write("FAIL {} {}\n".format(texture, error))
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    sys.stdout.write("{} textures, {} elements, {} failed in {:.2f}s\n".format(len(tasks), elements_num, failed,
+                                                                               time.time() - start))
+    if failed:
+        exit(-1)